@@ -3,7 +3,10 @@
 This file keeps backward compatibility for running python app.py.
 It imports the app object from the package and runs it.
 """
-from src.media_server.app import app
+# Job workers are spawned with this file as their __mp_main__; they only
+# need their own functions, not the app's config, caches and media scan
+if __name__ != '__mp_main__':
+    from src.media_server.app import app
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
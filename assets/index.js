@@ -13,6 +13,136 @@ const tagNameInput = document.getElementById('tagNameInput');
 const tagModal = document.getElementById('tagSelect');
 var modalMenu = document.getElementById("modalMenu");
 
+/**
+ * Prefetch the media around the one shown in the modal, so stepping to
+ * them shows them at once: images whole, videos only as far as their
+ * metadata and first seconds (the start of a faststart MP4, or the first
+ * HLS segment). How many are fetched on each side follows the connection,
+ * and fetches for media no longer near are aborted.
+ */
+var PREFETCH_DEPTH = 2;
+var PREFETCH_PARALLEL = 2;
+var prefetches = new Map();
+var prefetchQueue = [];
+
+function prefetchDepth() {
+    var connection = navigator.connection;
+    if (!connection) {
+        return PREFETCH_DEPTH;
+    }
+    if (connection.saveData || /2g$/.test(connection.effectiveType || '')) {
+        return 0;
+    }
+    if (connection.effectiveType === '3g' || (connection.downlink && connection.downlink < 2)) {
+        return 1;
+    }
+    return connection.downlink >= 10 ? 3 : PREFETCH_DEPTH;
+}
+
+function isVideo(url) {
+    return url.endsWith('.mp4') || url.endsWith('.webm');
+}
+
+// Bytes for the first seconds of a video at the current downlink
+function videoHeadBytes() {
+    var downlink = (navigator.connection && navigator.connection.downlink) || 5;
+    return Math.round(Math.min(Math.max(downlink * 2 * 125000, 256 * 1024), 4 * 1024 * 1024));
+}
+
+// The requests loading a media as the modal will, so they hit the cache
+function prefetchRequests(url) {
+    if (!isVideo(url)) {
+        return [[url, {}]];
+    }
+    if (hlsInUse(document.getElementById('video01'), url)) {
+        var playlist = hlsUrl(url);
+        return [[playlist, {}], [playlist.replace(/index\.m3u8$/, '0.ts'), {}]];
+    }
+    return [[videoSource(url), { headers: { Range: 'bytes=0-' + (videoHeadBytes() - 1) } }]];
+}
+
+function startPrefetches() {
+    var running = Array.from(prefetches.values()).filter(p => p.running).length;
+    while (running < PREFETCH_PARALLEL && prefetchQueue.length) {
+        var url = prefetchQueue.shift();
+        var prefetch = prefetches.get(url);
+        if (!prefetch) {
+            continue;
+        }
+        prefetch.running = true;
+        running++;
+        Promise.all(prefetchRequests(url).map(function ([requestUrl, options]) {
+            return fetch(requestUrl, { ...options, signal: prefetch.controller.signal, priority: 'low' })
+                .then(response => response.blob());
+        }))
+            .catch(function (error) {
+                if (error.name !== 'AbortError') {
+                    console.error(error);
+                }
+            })
+            .finally(function () {
+                prefetch.running = false;
+                prefetch.done = true;
+                startPrefetches();
+            });
+    }
+}
+
+/**
+ * Prefetch the neighbours of the media at ``index``, those in the
+ * direction of travel first, and abort the others still loading.
+ */
+function prefetchAround(index, step) {
+    var depth = document.getElementById('mediaModal').style.display === 'block' ? prefetchDepth() : 0;
+    var direction = step < 0 ? -1 : 1;
+    var wanted = [];
+    var ahead = index;
+    var behind = index;
+    for (var i = 0; i < depth; i++) {
+        ahead = stepIndex(ahead, direction);
+        behind = stepIndex(behind, -direction);
+        [ahead, behind].forEach(function (neighbour) {
+            var url = medias[neighbour];
+            if (neighbour !== index && url && !wanted.includes(url)) {
+                wanted.push(url);
+            }
+        });
+    }
+
+    prefetches.forEach(function (prefetch, url) {
+        if (!wanted.includes(url)) {
+            if (!prefetch.done) {
+                prefetch.controller.abort();
+            }
+            prefetches.delete(url);
+        }
+    });
+    prefetchQueue = wanted.filter(url => !prefetches.has(url));
+    prefetchQueue.forEach(function (url) {
+        prefetches.set(url, { controller: new AbortController(), running: false, done: false });
+    });
+    whenModalMediaLoaded(startPrefetches);
+}
+
+// Let the media shown load first, or give it a head start
+function whenModalMediaLoaded(callback) {
+    var modalVideo = document.getElementById('video01');
+    var showingVideo = modalVideo.style.display === 'block';
+    var element = showingVideo ? modalVideo : document.getElementById('img01');
+    var eventName = showingVideo ? 'loadeddata' : 'load';
+    if (showingVideo ? modalVideo.readyState >= 2 : element.complete) {
+        callback();
+        return;
+    }
+    var timer = setTimeout(done, 1500);
+    function done() {
+        clearTimeout(timer);
+        element.removeEventListener(eventName, done);
+        callback();
+    }
+    element.addEventListener(eventName, done);
+}
+
 /**
  * Open media in modal
  */
@@ -28,7 +158,7 @@ function openModal(mediaElement, type) {
 
     mediaName.textContent = currentMediaName;
     currentIndex = medias.indexOf(currentMedia);
-    currentMediaTags.textContent = media_tags[currentIndex] || '--';
+    currentMediaTags.textContent = tagText(currentIndex);
     console.log(currentIndex);
 
     modal.style.display = "block";
@@ -38,11 +168,20 @@ function openModal(mediaElement, type) {
         modalImg.style.display = "block";
     } else if (type === 'video') {
         modalImg.style.display = "none";
-        modalVideo.src = currentMedia;
+        setVideoSource(modalVideo, currentMedia);
         modalVideo.style.display = "block";
     }
 
     document.getElementById('bottomBar').style.display = 'none';
+    prefetchAround(currentIndex, 1);
+}
+
+/**
+ * Get the tags of a media as shown in the modal
+ */
+function tagText(index) {
+    var tags = media_tags[index] || [];
+    return tags.length ? tags.join(' ') : '--';
 }
 
 /**
@@ -51,38 +190,59 @@ function openModal(mediaElement, type) {
 function closeModal() {
     var modal = document.getElementById('mediaModal');
     modal.style.display = "none";
+    prefetchAround(currentIndex, 1);
     var modalVideo = document.getElementById('video01');
     modalVideo.pause();
     if (document.fullscreenElement === modal) {
         document.exitFullscreen().catch(err => console.error(err));
     }
     lazyVideoLoad();
+    gifTwinLoad();
     closeTagModal();
     document.getElementById('bottomBar').style.display = 'block';
 }
 
 /**
- * Change to previous/next media in modal
+ * Get the index of the media ``step`` away in the modal, wrapping around
+ * and skipping those hidden by a search.
  */
-function changeMedia(step) {
+function stepIndex(index, step) {
     var gridItems = document.querySelectorAll('.grid-item.media-item');
 
-    currentIndex += step;
-    if (currentIndex >= medias.length) {
-        currentIndex = 0;
-    } else if (currentIndex < 0) {
-        currentIndex = medias.length - 1;
+    index += step;
+    if (index >= medias.length) {
+        index = 0;
+    } else if (index < 0) {
+        index = medias.length - 1;
     }
 
     // Skip hidden items
-    while (gridItems[currentIndex] && gridItems[currentIndex].style.display == 'none') {
-        currentIndex += step < 0 ? -1 : 1;
-        if (currentIndex >= medias.length) {
-            currentIndex = 0;
-        } else if (currentIndex < 0) {
-            currentIndex = medias.length - 1;
+    var skipped = 0;
+    while (gridItems[index] && gridItems[index].style.display == 'none' && skipped++ < medias.length) {
+        index += step < 0 ? -1 : 1;
+        if (index >= medias.length) {
+            index = 0;
+        } else if (index < 0) {
+            index = medias.length - 1;
         }
     }
+    return index;
+}
+
+/**
+ * Change to previous/next media in modal
+ */
+function changeMedia(step) {
+    // Near the end of what is loaded, fetch the next page of the listing,
+    // and wait for it rather than wrapping around
+    if (step > 0 && next_cursor && currentIndex + step >= medias.length - 5) {
+        var pending = loadNextPage();
+        if (currentIndex + step >= medias.length) {
+            pending.then(loaded => { if (loaded) changeMedia(step); });
+            return;
+        }
+    }
+    currentIndex = stepIndex(currentIndex, step);
 
     var modalImg = document.getElementById('img01');
     var modalVideo = document.getElementById('video01');
@@ -92,11 +252,11 @@ function changeMedia(step) {
     var currentMedia = medias[currentIndex];
     var currentMediaName = currentMedia.split('/').pop();
     mediaName.textContent = currentMediaName;
-    currentMediaTags.textContent = media_tags[currentIndex] || '--';
+    currentMediaTags.textContent = tagText(currentIndex);
     toggleSelectedInTagModal();
 
     if (currentMedia.endsWith('.mp4') || currentMedia.endsWith('.webm')) {
-        modalVideo.src = currentMedia;
+        setVideoSource(modalVideo, currentMedia);
         modalVideo.style.display = "block";
         modalImg.style.display = "none";
     } else {
@@ -107,6 +267,7 @@ function changeMedia(step) {
     }
 
     closeTagModal();
+    prefetchAround(currentIndex, step);
 }
 
 /**
@@ -170,8 +331,7 @@ function deleteMedia() {
         .then(response => response.json())
         .then(data => {
             if (data.success) {
-                medias.splice(currentIndex, 1);
-                media_tags.splice(currentIndex, 1);
+                applyChanges(data.changes);
                 changeMedia(0);
             } else {
                 alert('Error deleting media: ' + data.error);
@@ -180,11 +340,6 @@ function deleteMedia() {
         .catch((error) => {
             console.error('Error:', error);
         });
-
-    var gridItems = document.querySelectorAll('.grid-item');
-    if (gridItems[currentIndex]) {
-        gridItems[currentIndex].remove();
-    }
 }
 
 /**
@@ -283,9 +438,8 @@ function renameMedia() {
             .then(response => response.json())
             .then(data => {
                 if (data.success) {
-                    var oldMediaSrc = mediaSrc;
-                    var newMediaSrc = oldMediaSrc.replace(/\/[^\/]+$/, '/' + newName + '.' + extension);
-                    medias[currentIndex] = newMediaSrc;
+                    applyChanges(data.changes);
+                    var newMediaSrc = data.new_path;
 
                     var modalImg = document.getElementById('img01');
                     var modalVideo = document.getElementById('video01');
@@ -294,10 +448,9 @@ function renameMedia() {
                     if (modalImg.style.display !== "none") {
                         modalImg.src = newMediaSrc;
                     } else if (modalVideo.style.display !== "none") {
-                        modalVideo.src = newMediaSrc;
+                        setVideoSource(modalVideo, newMediaSrc);
                     }
-                    mediaName.textContent = newName + '.' + extension;
-                    location.reload();  // Reload to update grid and ensure consistency
+                    mediaName.textContent = newMediaSrc.split('/').pop();
                 } else {
                     alert('Error renaming media: ' + data.error);
                 }
@@ -315,31 +468,507 @@ function renameMedia() {
 }
 
 /**
- * Load lazy videos when they enter viewport
+ * Start a grid preview, loading its source on first play. At most
+ * MAX_PLAYING_PREVIEWS play at once; the one started first is paused.
+ */
+var MAX_PLAYING_PREVIEWS = 6;
+var playingPreviews = [];
+
+function playPreview(video) {
+    if (!video.getAttribute('src')) {
+        video.src = video.getAttribute('data-src');
+    }
+    playingPreviews = playingPreviews.filter(v => v !== video && !v.paused && v.isConnected);
+    while (playingPreviews.length >= MAX_PLAYING_PREVIEWS) {
+        playingPreviews.shift().pause();
+    }
+    playingPreviews.push(video);
+    var playPromise = video.play();
+    if (playPromise) {
+        playPromise.catch(() => {});  // Interrupted by a pause, nothing to do
+    }
+}
+
+/**
+ * Grid videos show their poster frame and only play on hover, or on touch
+ * screens while they are in the middle of the viewport
  */
+var canHover = window.matchMedia('(hover: hover)').matches;
+var focusVideoObserver = null;
+
 function lazyVideoLoad() {
-    var lazyVideos = [].slice.call(document.querySelectorAll("video.lazy"));
-    if ("IntersectionObserver" in window) {
-        var lazyVideoObserver = new IntersectionObserver(function (entries, observer) {
-            entries.forEach(function (videoObserver) {
-                video = videoObserver.target;
-                if (videoObserver.isIntersecting) {
-                    if (!video.src) {
-                        video.src = video.getAttribute('data-src');
-                        video.load();
-                    } else if (video.paused) {
-                        video.play();
-                    }
+    var lazyVideos = document.querySelectorAll("video.lazy:not([data-bound])");
+    if (!canHover && !focusVideoObserver && "IntersectionObserver" in window) {
+        focusVideoObserver = new IntersectionObserver(function (entries) {
+            entries.forEach(function (entry) {
+                if (entry.isIntersecting) {
+                    playPreview(entry.target);
                 } else {
-                    video.pause();
+                    entry.target.pause();
                 }
             });
+        }, { rootMargin: '-40% 0px -40% 0px' });
+    }
+
+    lazyVideos.forEach(function (video) {
+        video.setAttribute('data-bound', '1');
+        if (canHover) {
+            video.addEventListener('mouseenter', () => playPreview(video));
+            video.addEventListener('mouseleave', () => video.pause());
+        } else if (focusVideoObserver) {
+            focusVideoObserver.observe(video);
+        }
+    });
+}
+
+/**
+ * Video twins of animated GIFs play like GIFs, but only while on screen
+ */
+var gifTwinObserver = null;
+
+function gifTwinLoad() {
+    var gifTwins = document.querySelectorAll("video.gif-twin");
+    if (!("IntersectionObserver" in window)) {
+        gifTwins.forEach(playPreview);
+        return;
+    }
+    if (!gifTwinObserver) {
+        gifTwinObserver = new IntersectionObserver(function (entries) {
+            entries.forEach(function (entry) {
+                if (entry.isIntersecting) {
+                    playPreview(entry.target);
+                } else {
+                    entry.target.pause();
+                }
+            });
+        }, { rootMargin: '200px 0px' });
+    }
+    // Observing again reports current visibility, restarting visible twins
+    gifTwins.forEach(function (video) {
+        gifTwinObserver.unobserve(video);
+        gifTwinObserver.observe(video);
+    });
+}
+
+/**
+ * Build the grid tile of a media from the JSON API, with the same markup
+ * as index.html
+ */
+function createMediaTile(item) {
+    var tile = document.createElement('div');
+    tile.className = 'grid-item media-item';
+    tile.dataset.name = item.url;
+
+    var checkbox = document.createElement('input');
+    checkbox.type = 'checkbox';
+    checkbox.className = 'grid-checkbox';
+    checkbox.dataset.name = item.url;
+    // Shown like the others when multi select is on
+    var other = document.querySelector('.grid-checkbox');
+    if (other) {
+        checkbox.style.display = other.style.display;
+    }
+    tile.appendChild(checkbox);
+
+    var media;
+    var type = item.kind === 'video' ? 'video' : 'image';
+    if (item.kind === 'video' || item.kind === 'gif') {
+        media = document.createElement('video');
+        media.className = item.kind === 'video' ? 'lazy' : 'gif-twin';
+        media.dataset.src = item.kind === 'video' ? item.preview : item.gif_video;
+        if (item.poster) {
+            media.poster = item.poster;
+        }
+        media.setAttribute('preload', 'none');
+        media.setAttribute('muted', '');
+        media.setAttribute('loop', '');
+        media.setAttribute('playsinline', '');
+        media.muted = true;
+    } else {
+        media = document.createElement('img');
+        media.src = item.thumb;
+        if (item.srcset) {
+            media.srcset = item.srcset;
+            media.sizes = '33vw';
+            media.decoding = 'async';
+        }
+        media.alt = 'Gallery media';
+        media.loading = 'lazy';
+    }
+    media.dataset.full = item.url;
+    if (item.size) {
+        media.setAttribute('width', item.size[0]);
+        media.setAttribute('height', item.size[1]);
+    }
+    if (item.placeholder) {
+        media.style.background = "center / cover no-repeat url('" + item.placeholder + "')";
+    }
+    // An attribute rather than a listener, so it survives the grid's virtualization
+    media.setAttribute('onclick', "openModal(this, '" + type + "');");
+    tile.appendChild(media);
+    return tile;
+}
+
+/**
+ * Build a folder tile, with the same markup as index.html
+ */
+function createFolderTile(path) {
+    var name = path.split('/').pop();
+    var tile = document.createElement('a');
+    tile.href = '/browse/' + path;
+    tile.className = 'grid-item directory-item';
+    tile.dataset.name = name;
+    var checkbox = document.createElement('input');
+    checkbox.type = 'checkbox';
+    checkbox.className = 'grid-checkbox small-checkbox';
+    checkbox.dataset.name = subpath + '/' + name;
+    tile.appendChild(checkbox);
+    tile.appendChild(document.createTextNode(name));
+    return tile;
+}
+
+/**
+ * Add the chips of a new tag to the tag list and the tag modal
+ */
+function addTagChips(tag) {
+    var exists = Array.from(document.querySelectorAll('.tag-modal-button'))
+        .some(button => button.dataset.name === tag.name);
+    if (exists) {
+        return;
+    }
+    var modalButton = document.createElement('button');
+    modalButton.className = 'tag-modal-button';
+    modalButton.dataset.name = tag.name;
+    modalButton.dataset.pinyin = tag.pinyin;
+    modalButton.setAttribute('onclick', 'toggleSelected(this)');
+    modalButton.textContent = tag.name;
+    document.getElementById('existingTags').appendChild(modalButton);
+
+    var tagsHomePage = document.getElementById('tagsHomePage');
+    if (tagsHomePage) {
+        var link = document.createElement('a');
+        link.href = '/tags/' + encodeURIComponent(tag.name);
+        link.className = 'tag-button';
+        link.dataset.name = tag.name;
+        link.dataset.pinyin = tag.pinyin;
+        var checkbox = document.createElement('input');
+        checkbox.type = 'checkbox';
+        checkbox.className = 'grid-checkbox small-checkbox';
+        checkbox.dataset.name = tag.name;
+        link.appendChild(checkbox);
+        link.appendChild(document.createTextNode(tag.name));
+        tagsHomePage.appendChild(link);
+    }
+}
+
+function findTile(url) {
+    var tiles = document.querySelectorAll('.grid-item.media-item');
+    for (var i = 0; i < tiles.length; i++) {
+        if (tiles[i].dataset.name === url) {
+            return tiles[i];
+        }
+    }
+    return null;
+}
+
+/**
+ * Patch the page with what a mutation changed, as sent by the server in
+ * 'changes': media removed, media renamed, moved or retagged (with their
+ * new tile data), folders and tag chips. Nothing else is reloaded.
+ */
+function applyChanges(changes) {
+    if (!changes) {
+        return;
+    }
+    var grid = document.querySelector('.grid');
+    var folder = subpath.replace(/^\/+|\/+$/g, '');
+    var folderUrl = '/media' + (folder ? '/' + folder : '');
+
+    (changes.removed || []).forEach(function (url) {
+        var tile = findTile(url);
+        if (tile) {
+            tile.remove();
+        }
+        var index = medias.indexOf(url);
+        if (index !== -1) {
+            medias.splice(index, 1);
+            media_tags.splice(index, 1);
+        }
+    });
+
+    (changes.updated || []).forEach(function (change) {
+        var item = change.item;
+        // Changes can arrive twice, from a request and from the change feed
+        var index = change.old ? medias.indexOf(change.old) : -1;
+        var tile = change.old ? findTile(change.old) : null;
+        if (!tile && findTile(item.url)) {
+            tile = findTile(item.url);
+            index = medias.indexOf(item.url);
+            change = {old: item.url, item: item};
+        }
+        // A new preview also needs a new tile
+        var preview = tile && tile.querySelector('video.lazy');
+        if (tile && (change.old !== item.url || (preview && preview.dataset.src !== item.preview))) {
+            tile.replaceWith(createMediaTile(item));
+        } else if (!tile && endpoint === 'Home' && item.url.substring(0, item.url.lastIndexOf('/')) === folderUrl) {
+            // Moved into the folder shown
+            grid.appendChild(createMediaTile(item));
+            medias.push(item.url);
+            media_tags.push(item.tags);
+            return;
+        }
+        if (index !== -1) {
+            medias[index] = item.url;
+            media_tags[index] = item.tags;
+        }
+    });
+
+    (changes.folders || []).forEach(function (change) {
+        // Folder checkboxes are named by their path in the media folder
+        document.querySelectorAll('.directory-item').forEach(function (tile) {
+            var checkbox = tile.querySelector('.grid-checkbox');
+            if (checkbox && checkbox.dataset.name.replace(/^\/+/, '') === change.old) {
+                tile.remove();
+            }
+        });
+        var parent = change.path.split('/').slice(0, -1).join('/');
+        var shown = Array.from(document.querySelectorAll('.directory-item'))
+            .some(tile => tile.getAttribute('href') === '/browse/' + change.path);
+        if (endpoint === 'Home' && parent === folder && !shown) {
+            grid.insertBefore(createFolderTile(change.path), grid.querySelector('.media-item'));
+        }
+    });
+
+    (changes.removed_tags || []).forEach(function (tag) {
+        document.querySelectorAll('.tag-button, .tag-modal-button').forEach(function (button) {
+            if (button.dataset.name === tag) {
+                button.remove();
+            }
+        });
+    });
+    if (changes.tag) {
+        addTagChips(changes.tag);
+    }
+
+    lazyVideoLoad();
+    gifTwinLoad();
+    virtualizeGrid();
+}
+
+/**
+ * Show a line of status over the bottom bar; an empty text hides it.
+ */
+var statusTimer = null;
+
+function showStatus(text, hideAfter) {
+    var line = document.getElementById('liveStatus');
+    if (!line) {
+        return;
+    }
+    clearTimeout(statusTimer);
+    line.textContent = text;
+    line.style.display = text ? 'block' : 'none';
+    if (text && hideAfter) {
+        statusTimer = setTimeout(() => showStatus(''), hideAfter);
+    }
+}
+
+/**
+ * Follow the change feed: patch the page with what other pages change,
+ * and show the progress of background jobs. The feed starts after the
+ * version the page was rendered at, and EventSource reconnects by itself
+ * with the id of the last event, so nothing is missed. It is streamed
+ * from /events/stream, which the front proxy forwards to the event
+ * server; when that can't be reached, /events on the app is polled.
+ */
+var EVENTS_STREAM = '/events/stream';
+var EVENTS_POLL = '/events';
+
+function followChanges(url) {
+    if (!window.EventSource) {
+        return;
+    }
+    url = url || EVENTS_STREAM;
+    var source = new EventSource(url + '?since=' + state_version);
+    source.addEventListener('error', function () {
+        // Closed for good: answered with an error rather than a stream
+        if (source.readyState === EventSource.CLOSED && url === EVENTS_STREAM) {
+            followChanges(EVENTS_POLL);
+        }
+    });
+    ['changes', 'job', 'reset'].forEach(function (type) {
+        source.addEventListener(type, function (event) {
+            state_version = Math.max(state_version, Number(event.lastEventId));
+        });
+    });
+    source.addEventListener('changes', function (event) {
+        applyChanges(JSON.parse(event.data));
+    });
+    source.addEventListener('job', function (event) {
+        var job = JSON.parse(event.data);
+        var text = job.name + ': ' + (job.done + job.failed) + '/' + job.total;
+        if (job.state === 'running') {
+            showStatus(text);
+        } else {
+            showStatus(text + ' ' + job.state, 5000);
+        }
+    });
+    source.addEventListener('reset', function () {
+        // Too many changes were missed to patch the page
+        showStatus('This page is out of date, reload it to update');
+    });
+}
+
+/**
+ * Load the next page of the listing from the JSON API and append it to
+ * the grid. Resolves to whether a page was added.
+ */
+var loadingPage = null;
+
+function loadNextPage() {
+    if (!list_api || !next_cursor) {
+        return Promise.resolve(false);
+    }
+    if (loadingPage) {
+        return loadingPage;
+    }
+    var url = list_api + (list_api.includes('?') ? '&' : '?') + 'cursor=' + encodeURIComponent(next_cursor);
+    loadingPage = fetch(url)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                throw new Error(data.error);
+            }
+            var fragment = document.createDocumentFragment();
+            data.items.forEach(item => {
+                medias.push(item.url);
+                media_tags.push(item.tags);
+                fragment.appendChild(createMediaTile(item));
+            });
+            document.querySelector('.grid').appendChild(fragment);
+            next_cursor = data.next;
+            lazyVideoLoad();
+            gifTwinLoad();
+            virtualizeGrid();
+            var searchBar = document.getElementById('searchBar');
+            if (searchBar.value) {
+                searchMedia(searchBar);
+            }
+            return true;
+        })
+        .catch(error => {
+            console.error('Error loading page:', error);
+            return false;
+        })
+        .finally(() => {
+            loadingPage = null;
         });
+    return loadingPage;
+}
 
-        lazyVideos.forEach(function (lazyVideo) {
-            lazyVideoObserver.observe(lazyVideo);
+/**
+ * Load the next page when the end of the grid comes near
+ */
+function infiniteScroll() {
+    var sentinel = document.getElementById('gridSentinel');
+    if (!sentinel || !next_cursor) {
+        return;
+    }
+    if (!("IntersectionObserver" in window)) {
+        loadNextPage().then(loaded => { if (loaded) infiniteScroll(); });
+        return;
+    }
+    var observer = new IntersectionObserver(function (entries) {
+        if (!entries[0].isIntersecting) {
+            return;
+        }
+        loadNextPage().then(function (loaded) {
+            if (!next_cursor) {
+                observer.disconnect();
+            } else if (loaded) {
+                // Observing again reports if the end is still in view
+                observer.unobserve(sentinel);
+                observer.observe(sentinel);
+            }
         });
+    }, { rootMargin: '1500px 0px' });
+    observer.observe(sentinel);
+}
+
+/**
+ * Virtualized grid: tiles far from the viewport are reduced to their
+ * shell (the tile and its checkbox, so search and selection still work)
+ * and their media element is removed, after releasing video sources so
+ * the browser frees decoders and buffers. The element is rebuilt from
+ * its markup when the tile comes back near the viewport.
+ */
+var VIRTUAL_MARGIN = '150% 0px';
+var virtualObserver = null;
+
+function releaseVideo(video) {
+    video.pause();
+    if (video.hasAttribute('src')) {
+        video.removeAttribute('src');
+        video.load();
+    }
+}
+
+function evictTile(tile) {
+    var media = tile.querySelector('img, video');
+    if (!media) {
+        return;
+    }
+    if (media.tagName === 'VIDEO') {
+        releaseVideo(media);
+        media.removeAttribute('data-bound');
+        if (focusVideoObserver) {
+            focusVideoObserver.unobserve(media);
+        }
+        if (gifTwinObserver) {
+            gifTwinObserver.unobserve(media);
+        }
+    }
+    tile.dataset.media = media.outerHTML;
+    tile.classList.add('evicted');
+    media.remove();
+}
+
+function restoreTile(tile) {
+    if (!tile.dataset.media) {
+        return false;
+    }
+    tile.insertAdjacentHTML('beforeend', tile.dataset.media);
+    delete tile.dataset.media;
+    tile.classList.remove('evicted');
+    return true;
+}
+
+function virtualizeGrid() {
+    if (!("IntersectionObserver" in window)) {
+        return;
     }
+    if (!virtualObserver) {
+        virtualObserver = new IntersectionObserver(function (entries) {
+            var restored = false;
+            entries.forEach(function (entry) {
+                if (!entry.target.isConnected) {
+                    virtualObserver.unobserve(entry.target);
+                } else if (entry.isIntersecting) {
+                    restored = restoreTile(entry.target) || restored;
+                } else {
+                    evictTile(entry.target);
+                }
+            });
+            if (restored) {
+                lazyVideoLoad();
+                gifTwinLoad();
+            }
+        }, { rootMargin: VIRTUAL_MARGIN });
+    }
+    document.querySelectorAll('.grid-item.media-item:not([data-virtual])').forEach(function (tile) {
+        tile.setAttribute('data-virtual', '1');
+        virtualObserver.observe(tile);
+    });
 }
 
 /**
@@ -384,12 +1013,129 @@ function toggleSelectedInTagModal() {
 }
 
 /**
- * Show tag modal for single media
+ * Show tag modal for single media. The tags of the page are selected at
+ * once, then those the server has now, if they differ.
  */
 function showTagModal() {
     toggleSelectedInTagModal();
     tagModal.style.display = "block";
     modalMenu.style.display = "none";
+    updateTagCatalog();
+
+    var index = currentIndex;
+    if (index == -1) {
+        return;
+    }
+    fetch('/api/media_tags?media=' + encodeURIComponent(medias[index]))
+        .then(response => response.json())
+        .then(function (data) {
+            if (index != currentIndex || tagModal.style.display != "block") {
+                return;
+            }
+            if (data.tags.join('\n') !== media_tags[index].join('\n')) {
+                media_tags[index] = data.tags;
+                toggleSelectedInTagModal();
+            }
+        })
+        .catch(error => console.error(error));
+}
+
+/**
+ * Tag catalog: every tag as [name, pinyin] in display order, with the
+ * state version it is current at. It is kept in localStorage across
+ * pages and only the changes since that version are fetched, when the
+ * change feed or the page shows a newer version.
+ */
+var TAG_CATALOG_KEY = 'tagCatalog';
+var tagCatalog = null;
+var tagCatalogUpdate = null;
+
+function loadTagCatalog() {
+    try {
+        tagCatalog = JSON.parse(localStorage.getItem(TAG_CATALOG_KEY));
+    } catch (e) {
+        tagCatalog = null;
+    }
+    if (!tagCatalog || !Array.isArray(tagCatalog.tags)) {
+        tagCatalog = { version: 0, tags: [] };
+    }
+    renderTagModal();
+}
+
+/**
+ * Apply the changes sent by /api/tag_catalog: removed tags go, added tags
+ * are inserted after the tag preceding them on the server.
+ */
+function mergeTagCatalog(delta) {
+    var gone = new Set(delta.removed.concat(delta.tags.map(entry => entry[0])));
+    var tags = delta.full ? [] : tagCatalog.tags.filter(entry => !gone.has(entry[0]));
+    delta.tags.forEach(function (entry) {
+        var at = entry[2] === null ? 0 : tags.findIndex(tag => tag[0] === entry[2]) + 1;
+        tags.splice(at, 0, [entry[0], entry[1]]);
+    });
+    tagCatalog = { version: delta.version, tags: tags };
+    try {
+        localStorage.setItem(TAG_CATALOG_KEY, JSON.stringify(tagCatalog));
+    } catch (e) {
+        console.error(e);
+    }
+}
+
+function updateTagCatalog() {
+    if (tagCatalogUpdate) {
+        return tagCatalogUpdate;
+    }
+    if (tagCatalog.version >= state_version) {
+        return Promise.resolve(tagCatalog);
+    }
+    tagCatalogUpdate = fetch('/api/tag_catalog?since=' + tagCatalog.version)
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error('Failed to load tags.');
+            }
+            return response.json();
+        })
+        .then(function (delta) {
+            mergeTagCatalog(delta);
+            if (delta.full || delta.tags.length || delta.removed.length) {
+                renderTagModal();
+            }
+            return tagCatalog;
+        })
+        .catch(function (error) {
+            console.error(error);
+            return tagCatalog;
+        })
+        .finally(function () {
+            tagCatalogUpdate = null;
+        });
+    return tagCatalogUpdate;
+}
+
+/**
+ * Fill the tag modal from the catalog, keeping the tags selected.
+ */
+function renderTagModal() {
+    var container = document.getElementById('existingTags');
+    if (!container) {
+        return;
+    }
+    var selected = new Set(
+        Array.from(container.querySelectorAll('.tag-modal-button.selected')).map(button => button.dataset.name)
+    );
+    container.replaceChildren(...tagCatalog.tags.map(function (entry) {
+        var button = document.createElement('button');
+        button.className = 'tag-modal-button';
+        button.dataset.name = entry[0];
+        button.dataset.pinyin = entry[1];
+        button.setAttribute('onclick', 'toggleSelected(this)');
+        button.textContent = entry[0];
+        if (selected.has(entry[0])) {
+            button.classList.add('selected');
+        }
+        return button;
+    }));
+    searchTagModal();
 }
 
 /**
@@ -476,12 +1222,12 @@ function saveTags(create_new_tag = '') {
         selectedMediaNames.forEach(media => {
             currentIndex = medias.indexOf(media);
             media_tags[currentIndex] = media_tags[currentIndex].concat(selectedTags);
-            currentMediaTags.textContent = media_tags[currentIndex];
+            currentMediaTags.textContent = tagText(currentIndex);
         });
     } else {
         // For current displayed media
         media_tags[currentIndex] = selectedTags;
-        currentMediaTags.textContent = media_tags[currentIndex];
+        currentMediaTags.textContent = tagText(currentIndex);
         currentMedia = medias[currentIndex];
     }
 
@@ -495,7 +1241,9 @@ function saveTags(create_new_tag = '') {
             if (!response.ok) {
                 throw new Error('Failed to save tags.');
             }
+            return response.json();
         })
+        .then(data => applyChanges(data.changes))
         .catch(error => {
             console.error(error);
         });
@@ -540,9 +1288,13 @@ function focusMediaFromURL() {
                 const origBox = item.style.boxShadow;
                 item.style.boxShadow = '0 0 0 4px rgba(255, 215, 0, 0.9)';
                 setTimeout(() => { item.style.boxShadow = origBox; }, 2500);
-                break;
+                return;
             }
         }
+        // Not loaded yet: keep loading pages until it is
+        if (next_cursor) {
+            loadNextPage().then(loaded => { if (loaded) focusMediaFromURL(); });
+        }
     } catch (e) {
         console.error('focusMediaFromURL error', e);
     }
@@ -551,6 +1303,12 @@ function focusMediaFromURL() {
 /**
  * Toggle modal menu
  */
+// Reload the video shown in the modal when its quality is changed
+initQualitySelect(document.getElementById('videoQuality'), document.getElementById('video01'), function () {
+    var modalVideo = document.getElementById('video01');
+    return modalVideo.style.display === 'block' ? medias[currentIndex] : null;
+});
+
 function toggleModalMenu() {
     var modalMenu = document.getElementById("modalMenu");
     if (modalMenu.style.display === "block") {
@@ -623,14 +1381,8 @@ function deleteSelected() {
         })
             .then(response => response.json())
             .then(data => {
-                if (data.success) {
-                    selectedItems.forEach(item => item.closest('.grid-item').remove());
-                    selectedNames.forEach(item => {
-                        var idx = medias.indexOf(item);
-                        medias.splice(idx, 1);
-                        media_tags.splice(idx, 1);
-                    });
-                } else {
+                applyChanges(data.changes);
+                if (!data.success) {
                     alert('Failed to delete selected items');
                 }
             })
@@ -677,9 +1429,9 @@ function renameSelected() {
         })
             .then(response => response.json())
             .then(data => {
-                if (data.success) {
-                    location.reload();
-                } else {
+                // Some items may be renamed even if others failed
+                applyChanges(data.changes);
+                if (!data.success) {
                     alert('Failed to rename selected items');
                 }
             })
@@ -731,9 +1483,8 @@ function pasteSelected() {
     })
         .then(response => response.json())
         .then(data => {
-            if (data.success) {
-                location.reload();
-            } else {
+            applyChanges(data.changes);
+            if (!data.success) {
                 alert('Failed to paste selected items');
             }
         })
@@ -761,10 +1512,18 @@ function filterMediaWithTags(operation) {
 
 // Event listeners setup
 document.addEventListener("DOMContentLoaded", function () {
+    loadTagCatalog();
+    updateTagCatalog();
     lazyVideoLoad();
+    gifTwinLoad();
+    virtualizeGrid();
+    infiniteScroll();
     focusMediaFromURL();
+    followChanges();
+    if (navigator.connection) {
+        navigator.connection.addEventListener('change', () => prefetchAround(currentIndex, 1));
+    }
 });
-document.addEventListener("scroll", lazyVideoLoad);
 document.addEventListener("scroll", foldSideMenu);
 
 // Click on left/right of modal to change media
@@ -0,0 +1,167 @@
+// Video playback shared by the media browser and the clip marker
+
+/**
+ * The quality videos are played at, kept in localStorage as 'auto' (a
+ * proxy picked from the connection), 'original', a proxy height, or
+ * 'hls' (streamed in segments where the browser can play HLS).
+ */
+var VIDEO_QUALITY_KEY = 'videoQuality';
+// hls.js is served from the assets (fingerprinted, like this script), its
+// URL given by the page on the data-hls-js attribute of this script tag
+var HLS_JS_URL = document.currentScript ? document.currentScript.dataset.hlsJs : '';
+
+function videoQuality() {
+    return localStorage.getItem(VIDEO_QUALITY_KEY) || 'auto';
+}
+
+/**
+ * Get the progressive URL playing a video at a quality: the original, or
+ * a proxy chosen by the server. HLS has no progressive URL, so it falls
+ * back to 'auto' here.
+ */
+function videoSource(url, quality) {
+    quality = quality || videoQuality();
+    if (quality === 'hls') {
+        quality = 'auto';
+    }
+    if (quality === 'original' || !url.startsWith('/media/')) {
+        return url;
+    }
+    var query = '?proxy=' + quality;
+    var connection = navigator.connection;
+    if (quality === 'auto' && connection) {
+        if (connection.saveData) {
+            query += '&save_data=1';
+        }
+        if (connection.downlink) {
+            query += '&downlink=' + connection.downlink;
+        }
+    }
+    return url + query;
+}
+
+function hlsUrl(url) {
+    return url.replace(/^\/media\//, '/hls/') + '/index.m3u8';
+}
+
+// Load hls.js once, for browsers without native HLS but with MediaSource
+var hlsJsLoading = null;
+
+function loadHlsJs() {
+    if (!hlsJsLoading) {
+        hlsJsLoading = new Promise(function (resolve, reject) {
+            if (!window.MediaSource) {
+                reject(new Error('MediaSource is not available'));
+                return;
+            }
+            if (!HLS_JS_URL) {
+                reject(new Error('hls.js is not served'));
+                return;
+            }
+            var script = document.createElement('script');
+            script.src = HLS_JS_URL;
+            script.onload = function () {
+                if (window.Hls && Hls.isSupported()) {
+                    resolve(window.Hls);
+                } else {
+                    reject(new Error('hls.js is not supported'));
+                }
+            };
+            script.onerror = function () {
+                reject(new Error('hls.js failed to load'));
+            };
+            document.head.appendChild(script);
+        });
+    }
+    return hlsJsLoading;
+}
+
+function playsHlsNatively(video) {
+    return video.canPlayType('application/vnd.apple.mpegurl') !== '';
+}
+
+// Whether a video is streamed as HLS right now, rather than falling back
+function hlsInUse(video, url) {
+    return videoQuality() === 'hls' && url.startsWith('/media/')
+        && (playsHlsNatively(video) || Boolean(window.Hls && Hls.isSupported()));
+}
+
+/**
+ * Play a video at the chosen quality. HLS plays natively or through
+ * hls.js; when neither works, or the stream fails, the video falls back
+ * to the proxy 'auto' would pick.
+ */
+var hlsPlayer = null;
+var videoSourceRequest = 0;
+
+function setVideoSource(video, url) {
+    var request = ++videoSourceRequest;
+    if (hlsPlayer) {
+        hlsPlayer.destroy();
+        hlsPlayer = null;
+    }
+    if (videoQuality() !== 'hls' || !url.startsWith('/media/')) {
+        video.src = videoSource(url);
+        return;
+    }
+    if (playsHlsNatively(video)) {
+        video.src = hlsUrl(url);
+        return;
+    }
+    var fallBack = function (error) {
+        if (request !== videoSourceRequest) {
+            return;
+        }
+        console.warn('HLS unavailable, playing a progressive video:', error.message);
+        if (hlsPlayer) {
+            hlsPlayer.destroy();
+            hlsPlayer = null;
+        }
+        video.src = videoSource(url, 'auto');
+    };
+    loadHlsJs().then(function (Hls) {
+        if (request !== videoSourceRequest) {
+            return;
+        }
+        hlsPlayer = new Hls();
+        hlsPlayer.on(Hls.Events.ERROR, function (event, data) {
+            if (data.fatal) {
+                fallBack(new Error(data.details));
+            }
+        });
+        hlsPlayer.loadSource(hlsUrl(url));
+        hlsPlayer.attachMedia(video);
+    }).catch(fallBack);
+}
+
+/**
+ * Wire a quality <select> to the stored setting. On change the video
+ * playing is reloaded at the new quality from where it was.
+ */
+function initQualitySelect(select, video, currentUrl) {
+    select.value = videoQuality();
+    if (select.selectedIndex < 0) {
+        select.value = 'auto';
+    }
+    select.addEventListener('change', function () {
+        localStorage.setItem(VIDEO_QUALITY_KEY, select.value);
+        var url = currentUrl();
+        if (!url) {
+            return;
+        }
+        var time = video.currentTime;
+        var paused = video.paused;
+        video.addEventListener('loadedmetadata', function () {
+            video.currentTime = time;
+            if (!paused) {
+                video.play();
+            }
+        }, { once: true });
+        setVideoSource(video, url);
+    });
+}
+
+if (videoQuality() === 'hls' && !playsHlsNatively(document.createElement('video'))) {
+    // Start loading early; failures are handled when a video is played
+    loadHlsJs().catch(function () {});
+}
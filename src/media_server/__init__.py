@@ -1,8 +1,14 @@
 """media_server package entrypoints."""
 from . import img_utils
-from .app import app
 
 __all__ = ["app", "img_utils"]
-"""media_server package entrypoints."""
 
-__all__ = ["app"]
+
+def __getattr__(name):
+    # The app is imported on first use: job workers spawned by it import
+    # this package for their functions, and mustn't set up a second server
+    if name == "app":
+        from .app import app
+        globals()["app"] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
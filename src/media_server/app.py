@@ -1,44 +1,450 @@
+import hashlib
 import os
-import subprocess
+import threading
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import quote
 
-from flask import Flask, jsonify, redirect, render_template, request, url_for, send_from_directory
+from flask import (
+    Flask,
+    abort,
+    jsonify,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from werkzeug.security import safe_join
 
 from src.media_server.browse import (
+    describe_media,
     filter_hidden_media,
     get_all_media_files,
     get_all_video_files,
+    list_directory,
+    page_slice,
     prepare_media_page,
+    scan_media_files,
     search_media_files,
 )
-from src.media_server.config import fs_to_url, get_paths, url_to_fs
+from src.media_server.cache import LRUDiskCache
+from src.media_server.config import fs_to_url, get_paths, load_config, url_to_fs
+from src.media_server.delivery import (
+    OFFLOAD_MODES,
+    compress_response,
+    file_digest,
+    precompress_assets,
+    prefetch_links,
+    send_asset,
+    send_media,
+)
+from src.media_server.events import EventServer, parse_since, replay
+from src.media_server.img_utils import (
+    CONVERT_EXTS,
+    THUMB_EXTS,
+    THUMB_SIZES,
+    Thumbnailer,
+    conversion_job,
+    find_images,
+    image_meta_job,
+    placeholder_job,
+    thumbnail_job,
+    xmp_import_job,
+)
+from src.media_server.jobs import JOBS, BackgroundJob, start_job
 from src.media_server.media_handlers import (
     delete_media,
+    get_media_preview,
     move_items,
     rename_media_file,
 )
 from src.media_server.models import MediaState, get_pinyin
-from src.media_server.tag_handlers import merge_tags, update_tag_global_variables
+from src.media_server.tag_handlers import (
+    import_media_tags,
+    merge_tags,
+    rename_media_tags,
+    update_tag_global_variables,
+)
+from src.media_server.video_utils import (
+    CUT_MODES,
+    PROXY_LADDER,
+    choose_proxy,
+    clip_manifest,
+    faststart_job,
+    faststart_scan_job,
+    get_keyframes,
+    get_media_info,
+    get_video_resolution,
+    gif_twin_job,
+    hls_can_copy,
+    hls_playlist,
+    hls_segment_path,
+    hls_segments,
+    is_output_current,
+    make_hls_segment,
+    make_poster,
+    poster_job,
+    poster_offset,
+    poster_path,
+    preview_job,
+    probe_media_job,
+    proxy_job,
+    proxy_path,
+    record_output,
+    remove_outputs,
+    render_clip,
+    render_preview,
+    scaled_size,
+)
 
 # Initialize paths and state
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+CONFIG = load_config(ROOT)
 PATHS = get_paths(ROOT)
 STATE = MediaState(ROOT)
+THUMBNAILER = Thumbnailer(STATE.db_dir / 'thumbs')
+POSTERS_DIR = str(STATE.db_dir / 'posters')
+GIF_TWINS_DIR = str(STATE.db_dir / 'gif_videos')
+PROXIES_DIR = str(STATE.db_dir / 'proxies')
+# (short side, video kbps) of each proxy, configurable in config.json
+PROXY_LADDER = [
+    tuple(rung) for rung in CONFIG.get('PROXY_LADDER', PROXY_LADDER)
+]
+VIDEO_EXTS = ('.mp4', '.webm', '.ogg')
+# HLS segments are cut on demand and the least recently used evicted
+HLS_DIR = str(STATE.db_dir / 'hls')
+HLS_SEGMENTS = LRUDiskCache(
+    HLS_DIR, int(CONFIG.get('HLS_CACHE_MB', 2048)) * 1024 * 1024
+)
+SEGMENTER = Thumbnailer(HLS_DIR, workers=2)
+# Let the front proxy send files: 'x-accel' (nginx) or 'x-sendfile'. For
+# nginx, OFFLOAD_LOCATIONS maps folders to internal locations serving them.
+OFFLOAD = CONFIG.get('OFFLOAD') if CONFIG.get('OFFLOAD') in OFFLOAD_MODES else None
+OFFLOAD_LOCATIONS = CONFIG.get('OFFLOAD_LOCATIONS', {PATHS['media_path']: '/_media/'})
+# Seconds browsers may reuse media, thumbnails and previews before revalidating
+MEDIA_MAX_AGE = int(CONFIG.get('MEDIA_MAX_AGE', 86400))
+# Media per page: pages render the first, the grid fetches the rest from the API
+PAGE_SIZE = int(CONFIG.get('PAGE_SIZE', 200))
+MAX_PAGE_SIZE = 1000
+# Asset URLs carry a content hash, so they never need revalidating
+ASSET_MAX_AGE = 365 * 24 * 3600
+# HTML and JSON bodies smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = int(CONFIG.get('COMPRESS_MIN_SIZE', 1024))
+# Media at the top of tag and search pages suggested for browsers to prefetch
+PREFETCH_HINT = int(CONFIG.get('PREFETCH_HINT', 3))
+# The change feed is streamed by its own asyncio server on localhost,
+# started by the first poll of /events; the front proxy forwards
+# /events/stream to it, and pages that can't reach it poll /events
+EVENTS = EventServer(STATE, port=int(CONFIG.get('EVENTS_PORT', 5001)))
+EVENTS_POLL_MS = int(CONFIG.get('EVENTS_POLL_MS', 5000))
 
-# Configure Flask app
+# Configure Flask app. Assets are served by static_asset(), which picks
+# the copies precompressed here when the client accepts them.
 app = Flask(
     __name__,
     template_folder=PATHS['templates_dir'],
-    static_folder=PATHS['asset_path'],
-    static_url_path='/assets',
+    static_folder=None,
 )
+app.static_folder = PATHS['asset_path']
+precompress_assets(app.static_folder)
+
+@app.route('/assets/<path:filename>', endpoint='static')
+def static_asset(filename):
+    """Serve an asset, precompressed when possible."""
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return send_asset(path, request.accept_encodings, app.get_send_file_max_age(path))
 
 media_url_prefix = '/media'
 @app.route(media_url_prefix + '/<path:filename>')
 def media_files(filename):
-    return send_from_directory(PATHS['media_path'], filename)
+    requested = request.args.get('proxy')
+    if requested and filename.lower().endswith(VIDEO_EXTS):
+        proxy = _proxy_for(filename, requested)
+        if proxy is not None:
+            response = send_media_file(proxy, mimetype='video/mp4')
+            response.headers['Vary'] = 'Save-Data, Downlink'
+            return response
+    path = safe_join(PATHS['media_path'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return send_media_file(path)
+
+def send_media_file(path: str, mimetype: str | None = None):
+    """Send a file, through the front proxy if offloading is configured."""
+    return send_media(path, mimetype, OFFLOAD, OFFLOAD_LOCATIONS, MEDIA_MAX_AGE)
+
+@app.url_defaults
+def fingerprint_assets(endpoint, values):
+    """Add a hash of the content to asset URLs, so each version has its own."""
+    if endpoint != 'static' or 'v' in values:
+        return
+    path = safe_join(app.static_folder, values.get('filename', ''))
+    if path is not None and os.path.isfile(path):
+        values['v'] = file_digest(path)
+
+@app.after_request
+def cache_assets(response):
+    """Let browsers keep fingerprinted assets without revalidating.
+
+    Only a URL carrying the asset's current hash is fingerprinted: a stale
+    or made-up one is revalidated like any asset.
+    """
+    if request.endpoint != 'static' or response.status_code not in (200, 304):
+        return response
+    path = safe_join(app.static_folder, request.view_args.get('filename', ''))
+    if path is None or not os.path.isfile(path):
+        return response
+    if request.args.get('v') == file_digest(path):
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+@app.context_processor
+def state_version():
+    """Let pages tell the change feed which version they were rendered at."""
+    return {'state_version': STATE.version}
+
+@app.context_processor
+def proxy_heights():
+    """Let the video quality settings offer the proxy heights rendered."""
+    return {'proxy_heights': [height for height, _ in PROXY_LADDER]}
+
+@app.after_request
+def compress(response):
+    """Compress HTML and JSON responses for clients that accept it."""
+    return compress_response(response, request.accept_encodings, COMPRESS_MIN_SIZE)
+
+_asset_versions = {}
+
+def asset_version() -> str:
+    """Get a hash of every asset, computed once per assets folder.
+
+    Assets change with a deploy, which restarts the app; in debug mode
+    they are hashed again for each page, as templates are reloaded.
+    """
+    folder = app.static_folder
+    if app.debug or folder not in _asset_versions:
+        digests = sorted(
+            (entry.name, file_digest(entry.path))
+            for entry in os.scandir(folder)
+            if entry.is_file()
+        ) if os.path.isdir(folder) else []
+        _asset_versions[folder] = hashlib.sha1(repr(digests).encode()).hexdigest()
+    return _asset_versions[folder]
+
+def page_etag(*extra) -> str:
+    """Get the ETag of a page from everything its HTML is rendered from.
+
+    That is the state version, the progress of the jobs filling the
+    thumbnail and metadata caches, the asset versions and the request.
+    """
+    parts = (
+        STATE.version,
+        [(name, job.done) for name, job in JOBS.items()],
+        asset_version(),
+        request.full_path,
+        extra,
+    )
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def cached_page(key=None):
+    """Answer 304 when a page's HTML would be unchanged.
+
+    Pages always revalidate (``no-cache``), so edits show up immediately,
+    but unchanged pages cost a round trip instead of a render. ``key``
+    gets more ETag parts from the view arguments.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = page_etag(*(key(*args, **kwargs) if key else ()))
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # Weak: the same page is sent with different content codings
+            response.set_etag(etag, weak=True)
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+def _folder_mtime(subpath: str = '') -> tuple:
+    """ETag part of a browsed folder: adding or removing files changes its mtime."""
+    try:
+        return (os.stat(os.path.join(PATHS['media_path'], subpath)).st_mtime_ns,)
+    except OSError:
+        return ()
+
+def _proxy_for(filename: str, requested: str) -> str | None:
+    """Get the proxy to serve for a video, from the request and client hints."""
+    video = safe_join(PATHS['media_path'], filename)
+    if video is None or not os.path.isfile(video):
+        return None
+    proxies = []
+    for height, kbps in PROXY_LADDER:
+        try:
+            path = proxy_path(PROXIES_DIR, video, height)
+        except OSError:
+            return None
+        if os.path.isfile(path):
+            proxies.append((height, kbps, path))
+    
+    # Downlink is in Mbps, sent as a client hint or by the player
+    downlink = request.args.get('downlink') or request.headers.get('Downlink')
+    try:
+        downlink_kbps = float(downlink) * 1000 if downlink else None
+    except ValueError:
+        downlink_kbps = None
+    save_data = (
+        request.headers.get('Save-Data', '').lower() == 'on'
+        or request.args.get('save_data') == '1'
+    )
+    return choose_proxy(
+        proxies, requested, STATE.media_info.get(video), downlink_kbps, save_data
+    )
+
+@app.route('/thumb/<int:size>/<path:filename>')
+def thumbnail(size, filename):
+    """Serve a cached, downscaled copy of an image."""
+    source = safe_join(PATHS['media_path'], filename)
+    if source is None or not os.path.isfile(source):
+        abort(404)
+    if not filename.lower().endswith(THUMB_EXTS):
+        return send_media_file(source)
+    
+    # Round up to a known size so the cache holds few variants per image
+    size = min((s for s in THUMB_SIZES if s >= size), default=THUMB_SIZES[-1])
+    try:
+        return send_media_file(THUMBNAILER.get(source, size), mimetype='image/webp')
+    except Exception as e:
+        print(f"Error creating thumbnail of {filename}: {e}")
+        return send_media_file(source)
+
+@app.route('/poster/<path:filename>')
+def poster(filename):
+    """Serve the cached poster frame of a video."""
+    video = safe_join(PATHS['media_path'], filename)
+    if video is None or not os.path.isfile(video):
+        abort(404)
+    
+    dest = poster_path(POSTERS_DIR, video)
+    offset = poster_offset(STATE.media_info.get(video))
+    try:
+        return send_media_file(
+            THUMBNAILER.render(dest, make_poster, video, dest, offset),
+            mimetype='image/jpeg',
+        )
+    except Exception as e:
+        print(f"Error creating poster of {filename}: {e}")
+        abort(404)
+
+@app.route('/gif_video/<path:filename>')
+def gif_video(filename):
+    """Serve the video twin of an animated GIF, or the GIF if it has none."""
+    gif = safe_join(PATHS['media_path'], filename)
+    if gif is None or not os.path.isfile(gif):
+        abort(404)
+    twin = STATE.gif_twins.get(gif)
+    if not twin or not os.path.isfile(twin):
+        return send_media_file(gif)
+    return send_media_file(twin)
+
+def _hls_video(filename: str) -> tuple[str, list[tuple[float, float]]]:
+    """Get the path and HLS segments of a video, aborting if it isn't one."""
+    video = safe_join(PATHS['media_path'], filename)
+    if (
+        video is None
+        or not os.path.isfile(video)
+        or not filename.lower().endswith(VIDEO_EXTS)
+    ):
+        abort(404)
+    info = get_media_info(video, STATE.media_info)
+    return video, hls_segments(get_keyframes(video, STATE.keyframes), info['duration'])
+
+@app.route('/hls/<path:filename>/index.m3u8')
+def hls_index(filename):
+    """Serve the HLS playlist of a video, its segments are cut when requested."""
+    _, segments = _hls_video(filename)
+    if not segments:
+        abort(404)
+    return app.response_class(
+        hls_playlist(segments, '{}.ts'), mimetype='application/vnd.apple.mpegurl'
+    )
+
+@app.route('/hls/<path:filename>/<int:index>.ts')
+def hls_segment(filename, index):
+    """Serve one HLS segment of a video from the segment cache."""
+    video, segments = _hls_video(filename)
+    if index >= len(segments):
+        abort(404)
+    dest = hls_segment_path(HLS_DIR, video, index)
+    if os.path.isfile(dest):
+        HLS_SEGMENTS.touch(dest)
+    else:
+        start, duration = segments[index]
+        copy = hls_can_copy(STATE.media_info.get(video))
+        try:
+            SEGMENTER.render(dest, make_hls_segment, video, dest, start, duration, copy)
+        except Exception as e:
+            print(f"Error cutting segment {index} of {filename}: {e}")
+            abort(500)
+        HLS_SEGMENTS.add(dest)
+    return send_media_file(dest, mimetype='video/mp2t')
+
+@app.template_filter('gif_video')
+def gif_video_url(media_url: str) -> str:
+    """Get the video twin URL of a GIF URL, or '' if it has none."""
+    prefix = media_url_prefix + '/'
+    if not media_url.startswith(prefix) or not media_url.lower().endswith('.gif'):
+        return ''
+    gif = safe_join(PATHS['media_path'], media_url[len(prefix):])
+    if gif is None or not STATE.gif_twins.get(gif):
+        return ''
+    return f'/gif_video/{quote(media_url[len(prefix):])}'
+
+@app.template_filter('poster')
+def poster_url(media_url: str) -> str:
+    """Get the poster frame URL of a video URL."""
+    prefix = media_url_prefix + '/'
+    if not media_url.startswith(prefix):
+        return ''
+    return f'/poster/{quote(media_url[len(prefix):])}'
+
+@app.template_filter('media_size')
+def media_size(media_url: str) -> tuple[int, int] | None:
+    """Get the indexed (width, height) of a media URL, if known."""
+    prefix = media_url_prefix + '/'
+    if not media_url.startswith(prefix):
+        return None
+    path = safe_join(PATHS['media_path'], media_url[len(prefix):])
+    if path is None:
+        return None
+    is_image = media_url.lower().endswith(THUMB_EXTS)
+    cache = STATE.image_meta if is_image else STATE.media_info
+    meta = cache.get(path)
+    if not meta or not meta.get('width') or not meta.get('height'):
+        return None
+    return meta['width'], meta['height']
+
+@app.template_filter('thumb')
+def thumb_url(media_url: str, size: int = THUMB_SIZES[1]) -> str:
+    """Get the thumbnail URL of an image URL, other URLs are unchanged."""
+    prefix = media_url_prefix + '/'
+    if not media_url.startswith(prefix) or not media_url.lower().endswith(THUMB_EXTS):
+        return media_url
+    # Quoted so the URL can be used in srcset, where spaces separate fields
+    return f'/thumb/{size}/{quote(media_url[len(prefix):])}'
 
 @app.route('/')
 @app.route('/browse/<path:subpath>')
+@cached_page(_folder_mtime)
 def Home(subpath=''):
     """Browse media by directory."""
     full_path = os.path.join(PATHS['media_path'], subpath)
@@ -53,6 +459,8 @@ def Home(subpath=''):
         PATHS['media_path'],
         'media',
         'Home',
+        STATE.placeholders,
+        PAGE_SIZE,
     )
     
     if page_data is None:
@@ -64,30 +472,39 @@ def Home(subpath=''):
         directories=page_data['directories'],
         medias=page_data['media_paths'],
         previews=page_data['preview_paths'],
+        placeholders=page_data['placeholders'],
         breadcrumb_paths=page_data['breadcrumb_paths'],
         subpath=subpath,
         endpoint='Home',
         media_tags=page_data['media_tags'],
         last_used_tags=STATE.last_used_tags,
+        next_cursor=page_data['next_cursor'],
+        list_api=url_for('browse_api', subpath=subpath),
     )
 
 @app.route('/search_media/<path:subpath>')
+@cached_page()
 def search_media(subpath=''):
     """Search media files by keywords."""
+    results = _search_results(subpath)
+    if results is None:
+        return redirect(url_for('Home'))
+    
+    keywords = request.args.get('keywords', '')
+    list_api = url_for('search_api', subpath=subpath, keywords=keywords)
+    return page_for_medias(results, tagname='search', list_api=list_api)
+
+def _search_results(subpath: str) -> list | None:
+    """Get the names of media under a folder matching the keywords arg."""
     keywords = request.args.get('keywords', '').split('_')
-    subpath = subpath.strip()
-    full_path = os.path.join(PATHS['media_path'], subpath)
+    full_path = os.path.join(PATHS['media_path'], subpath.strip())
     
     if not os.path.isdir(full_path):
-        return redirect(url_for('Home'))
-    
-    results = search_media_files(
-        full_path,
-        keywords,
-        STATE.all_media_files,
-    )
+        return None
     
-    return page_for_medias(results, tagname='search')
+    # Search the catalog of the whole media folder, cached for every page
+    catalog = get_all_media_files(PATHS['media_path'], STATE.all_media_files)
+    return search_media_files(full_path, keywords, catalog)
 
 @app.route('/all_media')
 def all_media(subpath=''):
@@ -121,35 +538,27 @@ def all_videos(subpath=''):
         media_files = random.choices(media_files, k=99)
     
     media_files = filter_hidden_media(media_files, STATE.tags, STATE.hidden_tags)
-    # Convert filesystem paths to URL paths and compute previews
-    media_paths = [fs_to_url(f, PATHS['media_path'], 'media') for f in media_files]
-    media_tags = [
-        " ".join([
-            tag for tag, _ in STATE.sorted_tags
-            if tag in STATE.tags and os.path.basename(f) in STATE.tags[tag]
-        ])
-        for f in media_files
-    ]
-    preview_paths = []
-    for f in media_files:
-        basename = os.path.basename(f)
-        b_no_ext, ext = os.path.splitext(basename)
-        preview_fs = os.path.join(os.path.dirname(f), 'previews', f'{b_no_ext} preview{ext}').replace('\\', '/')
-        if not os.path.isfile(preview_fs):
-            preview_fs = f
-        preview_paths.append(fs_to_url(preview_fs, PATHS['media_path'], 'media'))
+    page_data = describe_media(
+        media_files,
+        STATE.sorted_tags,
+        STATE.tags,
+        PATHS['media_path'],
+        'media',
+        STATE.placeholders,
+    )
     breadcrumb_paths = subpath.split('/') if subpath else []
     
     return render_template(
         'index.html',
         tags=STATE.sorted_tags,
         directories=[],
-        medias=media_paths,
-        previews=preview_paths,
+        medias=page_data['media_paths'],
+        previews=page_data['preview_paths'],
+        placeholders=page_data['placeholders'],
         breadcrumb_paths=breadcrumb_paths,
         subpath=subpath,
         endpoint='Home',
-        media_tags=media_tags,
+        media_tags=page_data['media_tags'],
         last_used_tags=STATE.last_used_tags,
     )
 
@@ -161,14 +570,18 @@ def delete_multiple():
     endpoint = data.get('endpoint', '')
     
     success = True
+    changes = {}
     try:
         if endpoint == 'Tags':
             # Delete tags
             for tag in items:
                 STATE.tags.pop(tag, None)
+            STATE.update_sorted_tags()
             STATE.save_tags()
+            changes = tag_changes(items)
         else:
             # Delete media files
+            removed = []
             for item in items:
                 success_item, error = delete_media(
                     item,
@@ -176,14 +589,18 @@ def delete_multiple():
                     PATHS['media_path'],
                     PATHS['trash_dir'],
                 )
-                if not success_item:
+                if success_item:
+                    removed.append('/' + item)
+                else:
                     print(f"Error deleting {item}: {error}")
                     success = False
+            STATE.clear_media_cache()
+            changes = media_changes(removed=removed)
     except Exception as e:
         print(f"Error in delete_multiple: {e}")
         success = False
     
-    return jsonify(success=success)
+    return jsonify(success=success, changes=publish_changes(changes))
 
 @app.route('/delete', methods=['POST'])
 def delete():
@@ -200,8 +617,15 @@ def delete():
         PATHS['media_path'],
         PATHS['trash_dir'],
     )
+    STATE.clear_media_cache()
     
-    return jsonify({'success': success, 'error': error if not success else ''})
+    return jsonify({
+        'success': success,
+        'error': error if not success else '',
+        'changes': publish_changes(
+            media_changes(removed=[media_path] if success else [])
+        ),
+    })
     
 @app.route('/rename', methods=['POST'])
 def rename():
@@ -237,10 +661,14 @@ def rename():
         if success:
             STATE.save_tags()
             STATE.save_clips()
+            STATE.clear_media_cache()
             return jsonify({
                 'success': True,
                 'new_path': fs_to_url(new_path, PATHS['media_path'], 'media'),
                 'new_pinyin': get_pinyin(new_filename),
+                'changes': publish_changes(
+                    media_changes(updated=[(media_path, new_path)])
+                ),
             })
         else:
             print(f"Error renaming {media_path}: {error}")
@@ -258,13 +686,17 @@ def rename_multiple():
     new_name = data.get('new_name', '')
     
     success = True
+    changes = {}
     try:
         if endpoint == 'Tags':
             # Merge tags
             merge_tags(items, new_name, STATE.tags)
             STATE.update_sorted_tags()
             STATE.save_tags()
+            changes = tag_changes(items, new_name)
         else:
+            updated = []
+            folders = []
             # Rename media/folders
             print(f"Renaming items: {items} to {new_name}")
             for item in items:
@@ -276,7 +708,7 @@ def rename_multiple():
                         dir_name, old_name = os.path.split(fs_item)
                         new_file_name = new_name.replace('#', old_name)
                         print(new_file_name)
-                        rename_media_file(
+                        renamed, error, new_path, _ = rename_media_file(
                             fs_item,
                             new_file_name,
                             STATE.tags,
@@ -284,22 +716,33 @@ def rename_multiple():
                             'media',
                             PATHS['media_path'],
                         )
+                        if renamed:
+                            updated.append(('/' + item, new_path))
+                        else:
+                            print(f"Error renaming {item}: {error}")
+                            success = False
                     elif os.path.isdir(fs_item):
                         # Rename directory
                         new_path = os.path.join(os.path.dirname(fs_item), new_name)
                         os.rename(fs_item, new_path)
+                        folders.append((
+                            os.path.relpath(fs_item, PATHS['media_path']),
+                            os.path.relpath(new_path, PATHS['media_path']),
+                        ))
                 except Exception as e:
                     print(f"Error renaming {item}: {e}")
                     success = False
             
             STATE.save_tags()
             STATE.save_clips()
+            STATE.clear_media_cache()
+            changes = media_changes(updated=updated, folders=folders)
     
     except Exception as e:
         print(f"Error in rename_multiple: {e}")
         success = False
     
-    return jsonify(success=success)
+    return jsonify(success=success, changes=publish_changes(changes))
 
 @app.route('/cut_multiple', methods=['POST'])
 def cut_multiple():
@@ -316,15 +759,50 @@ def paste_multiple():
     data = request.get_json()
     destination = data.get('destination', '').strip('/')
     
+    updated = []
+    folders = []
+    
+    def on_moved(old_path, new_path):
+        if os.path.isdir(new_path):
+            folders.append((
+                os.path.relpath(old_path, PATHS['media_path']),
+                os.path.relpath(new_path, PATHS['media_path']),
+            ))
+        else:
+            old_url = fs_to_url(old_path, PATHS['media_path'], 'media')
+            updated.append((old_url, new_path))
+    
     success, error = move_items(
         STATE.medias_in_clipboard,
         destination,
         PATHS['media_path'],
         'media',
+        on_moved,
     )
     
     STATE.medias_in_clipboard = []
-    return jsonify(success=success)
+    STATE.clear_media_cache()
+    changes = publish_changes(media_changes(updated=updated, folders=folders))
+    return jsonify(success=success, changes=changes)
+
+@app.route('/events')
+def events():
+    """Send the events a page missed, for pages that can't reach the stream.
+
+    The response ends after the events since the Last-Event-ID header or
+    the since arg, and EventSource comes back after EVENTS_POLL_MS: the
+    feed is polled without holding a worker. The event server is started
+    for the streams of the next pages.
+    """
+    EVENTS.start()
+    since = parse_since(
+        request.full_path,
+        {'last-event-id': request.headers.get('Last-Event-ID', '')},
+    )
+    message, _ = replay(STATE, since, EVENTS_POLL_MS)
+    response = app.response_class(message, mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    return response
 
 @app.route('/video_clip_marker')
 def mark_video_clips():
@@ -339,6 +817,12 @@ def settings_page():
     return render_template('settings.html')
 
 
+@app.route('/perf')
+def perf_page():
+    """Show the page measuring grid FPS and memory while scrolling."""
+    return render_template('perf.html')
+
+
 @app.route('/save_settings', methods=['POST'])
 def save_settings():
     """Save user settings."""
@@ -371,30 +855,121 @@ def clips():
     }
     return render_template('clips.html', clips=new_dict)
 
-def get_video_resolution(file: str) -> tuple[int, int]:
-    """Get video resolution using ffprobe."""
-    cmd = (
-        f'ffprobe -v error -select_streams v:0 -show_entries stream=width,height '
-        f'-of csv=p=0  "{file}"'
-    )
-    output = subprocess.run(
-        cmd,
-        check=False,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        shell=True,
-    ).stdout
-    
-    if output:
-        try:
-            w, h = [int(n) for n in output.strip().split()[0].split(',')]
-            return w, h
-        except (ValueError, IndexError):
-            return 0, 0
+def _media_file(media_url: str) -> str:
+    """Get the path of a media file from its URL, aborting if there is none."""
+    prefix = media_url_prefix + '/'
+    media_url = '/' + media_url.lstrip('/')
+    path = None
+    if media_url.startswith(prefix):
+        path = safe_join(PATHS['media_path'], media_url[len(prefix):])
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return path
+
+@app.route('/keyframes', methods=['GET'])
+def video_keyframes():
+    """Get keyframe timestamps of a video."""
+    video = _media_file(request.args.get('video', ''))
+    return jsonify(get_keyframes(video, STATE.keyframes))
+
+
+@app.route('/media_info', methods=['GET'])
+def media_info():
+    """Get ffprobe metadata of a media file."""
+    path = _media_file(request.args.get('path', ''))
+    return jsonify(get_media_info(path, STATE.media_info))
+
+
+# Clip manifests are read and saved by concurrent gen_clips requests
+_clip_outputs_lock = threading.Lock()
+
+def _save_clip_outputs(video: str, recorded: dict, superseded=()) -> None:
+    """Merge the outputs a request rendered into the video's manifest and save.
+
+    ``superseded`` outputs are deleted. Stored manifests are replaced,
+    never changed in place, so a save pickling them can't see one
+    mid-update.
+    """
+    if not recorded and not superseded:
+        return
+    with _clip_outputs_lock:
+        manifest = {
+            **clip_manifest(video, STATE.clip_outputs, recorded), **recorded
+        }
+        remove_outputs(manifest, superseded)
+        STATE.clip_outputs.set(video, manifest)
+        STATE.clip_outputs.save()
+
+def _render_clips(
+    video: str,
+    video_url: str,
+    clips: dict,
+    manifest: dict,
+    recorded: dict,
+    cut_mode: str,
+    encode_args: list[str],
+) -> None:
+    """Render the clips not already current in the manifest, with progress.
+
+    ``clips`` maps output paths to their (start, stop, scale, cut mode);
+    the rendered ones are recorded in ``recorded``.
+    """
+    todo = {
+        output: params for output, params in clips.items()
+        if not is_output_current(manifest, output, params)
+    }
+    print(f'{len(todo)} of {len(clips)} clips to render')
+    if not todo:
+        return
+    keyframes = []
+    if cut_mode != 'reencode':
+        keyframes = get_keyframes(video, STATE.keyframes)
+    info = get_media_info(video, STATE.media_info) if cut_mode == 'smart' else None
     
-    return 0, 0
+    rendered = []
+    progress = {'name': 'gen_clips', 'video': '/' + video_url, 'total': len(todo)}
+    for i, (output, params) in enumerate(todo.items()):
+        publish_job({
+            **progress,
+            'state': 'running',
+            'done': len(rendered),
+            'failed': i - len(rendered),
+        })
+        start, stop = params[0], params[1]
+        if render_clip(
+            video, start, stop, output, keyframes, cut_mode, encode_args,
+            info=info,
+        ):
+            record_output(recorded, output, params)
+            rendered.append(output)
+    publish_job({
+        **progress,
+        'state': 'finished',
+        'done': len(rendered),
+        'failed': len(todo) - len(rendered),
+    })
+    publish_changes(media_changes(updated=[(None, f) for f in rendered]))
 
+def _render_clip_preview(
+    video: str,
+    video_url: str,
+    preview_path: str,
+    ranges: list[tuple[float, float]],
+    scale: str,
+    manifest: dict,
+    recorded: dict,
+) -> bool:
+    """Render the preview of a video from its clip ranges, unless current."""
+    preview_params = (tuple(ranges), scale)
+    if is_output_current(manifest, preview_path, preview_params):
+        return True
+    # Render the preview straight from the source time ranges
+    if not render_preview(video, ranges, preview_path, scale):
+        return False
+    record_output(recorded, preview_path, preview_params)
+    # Pages showing the video get its new preview tile
+    publish_changes(media_changes(updated=[('/' + video_url, video)]))
+    return True
 
 @app.route('/gen_clips', methods=['POST'])
 def gen_clips():
@@ -407,54 +982,64 @@ def gen_clips():
         timestamps = request.json.get('clips', [])
         resolution = int(request.json.get('resolution', 1))
         gen_preview = bool(request.json.get('gen_preview', False))
+        # Clips are always written when no preview is asked for
+        keep_clips = bool(request.json.get('keep_clips', not gen_preview))
+        ranges = [(float(t['start']), float(t['stop'])) for t in timestamps]
         
-        res_cmd = ['-c', 'copy']
+        cut_mode = request.json.get('cut_mode', 'snap')
+        if cut_mode not in CUT_MODES:
+            cut_mode = 'snap'
+        
+        scale = ''
+        encode_args = []
         if resolution != 1:
-            w, h = get_video_resolution(video)
-            if w == 0:
-                w = h = resolution
-            elif w > h:
-                r = resolution / h
-                w = int(w * r) // 2 * 2
-                h = resolution
-            else:
-                r = resolution / w
-                h = int(h * r) // 2 * 2
-                w = resolution
-            res_cmd = ['-vf', f'scale={w}:{h}']
+            w, h = get_video_resolution(video, STATE.media_info)
+            scale = scaled_size(w, h, resolution)
+            encode_args = ['-vf', f'scale={scale}']
+            # Scaling needs every frame decoded, so nothing can be copied
+            cut_mode = 'reencode'
         
-        temp_file_contents = ""
-        for t in timestamps:
-            start, stop = t['start'], t['stop']
-            output = f"{basename}_{start}_{stop}{extension}"
-            temp_file_contents += f"file '{output}'\n"
-            
-            cmd = ['ffmpeg', '-v', 'error', '-y', '-i', video] + res_cmd + [
-                '-ss', str(start), '-to', str(stop), output
-            ]
-            subprocess.run(cmd)
+        preview_path = get_media_preview(video, check_exist=False)
+        clips = {}
+        if keep_clips:
+            clips = {
+                f"{basename}_{t['start']}_{t['stop']}{extension}": (
+                    start, stop, scale, cut_mode
+                )
+                for t, (start, stop) in zip(timestamps, ranges, strict=True)
+            }
+        requested = [*clips, preview_path] if gen_preview else list(clips)
         
-        if not gen_preview:
-            print('Clips generated successfully')
-            return jsonify({"status": "success"})
+        # Outputs already rendered with the same settings are reused, and
+        # those of an older version of the video removed
+        with _clip_outputs_lock:
+            manifest = dict(clip_manifest(video, STATE.clip_outputs, requested))
+        recorded = {}
+        # A new clip list replaces the clips of the previous one
+        superseded = [
+            output for output in manifest
+            if keep_clips and output not in clips and output != preview_path
+        ]
         
-        # Generate preview
-        with open('clips_files_tempo.txt', 'w', encoding='utf-8') as f:
-            f.write(temp_file_contents)
+        if keep_clips:
+            _render_clips(
+                video, video_url, clips, manifest, recorded, cut_mode, encode_args
+            )
         
-        folder = os.path.dirname(video)
-        basename_file = os.path.basename(video)
-        basename_file, extension = os.path.splitext(basename_file)
-        preview_path = os.path.join(folder, 'previews', f'{basename_file} preview{extension}')
+        preview_ok = True
+        if gen_preview:
+            preview_ok = _render_clip_preview(
+                video, video_url, preview_path, ranges, scale, manifest, recorded
+            )
         
-        if not os.path.exists(os.path.join(folder, 'previews')):
-            os.makedirs(os.path.join(folder, 'previews/'))
+        _save_clip_outputs(video, recorded, superseded)
         
-        cmd = [
-            'ffmpeg', '-v', 'error', '-y', '-f', 'concat', '-safe', '0',
-            '-i', 'clips_files_tempo.txt', preview_path
-        ]
-        subprocess.run(cmd)
+        if not gen_preview:
+            print('Clips generated successfully')
+            return jsonify({"status": "success"})
+        
+        if not preview_ok:
+            return jsonify({"status": "error", "message": "Preview generation failed"})
         
         print('Preview generated successfully')
         return jsonify({"status": "success"})
@@ -467,10 +1052,8 @@ def gen_clips():
 def get_tags():
     """Get tags for a media file."""
     media = request.json.get('media', '')
-    tag_list = [
-        [tag, media in STATE.tags.get(tag, set())]
-        for tag, _ in STATE.sorted_tags
-    ]
+    media_tags = set(STATE.tags_of(media))
+    tag_list = [[tag, tag in media_tags] for tag, _ in STATE.sorted_tags]
     return jsonify(tag_list)
 
 
@@ -484,7 +1067,11 @@ def save_tags():
         medias = [medias]
     
     changed = False
+    updated = []
     for media in medias:
+        fs_media = url_to_fs(media.lstrip('/'), PATHS['media_path'], 'media')
+        if os.path.isfile(fs_media):
+            updated.append((media, fs_media))
         media = media.split('/')[-1]
         media_changed = update_tag_global_variables(
             media,
@@ -496,29 +1083,59 @@ def save_tags():
         changed = changed or media_changed
     
     STATE.update_sorted_tags()
+    changes = media_changes(updated=updated)
     if changed:
         STATE.save_tags()
+        publish_changes(changes)
     
-    return jsonify({"status": "success"})
+    return jsonify({"status": "success", "changes": changes})
 
-def page_for_medias(medias: list, tagname: str = '') -> str:
-    """Render HTML page for given media names."""
+# Sorted tag, search and filter listings, reused until the state changes
+TAGGED_CACHE_SIZE = 32
+_tagged = {'key': None, 'paths': {}, 'listings': OrderedDict()}
+_tagged_lock = threading.Lock()
+
+def _tagged_key() -> tuple:
+    """Get what the name index and listings are computed from."""
+    return (
+        STATE.version,
+        PATHS['media_path'],
+        id(STATE.all_media_files),
+        len(STATE.all_media_files),
+        frozenset(STATE.hidden_tags),
+    )
+
+def _media_path_index() -> dict[str, str]:
+    """Map media names to file paths, from the cached catalog outside the trash."""
     media_exts = ('.jpg', '.jpeg', '.png', '.webm', '.webp', '.mp4', '.gif', '.ogg')
+    trash_dir = PATHS['trash_dir'].replace('\\', '/')
     path_dict = {}
+    for path in get_all_media_files(PATHS['media_path'], STATE.all_media_files):
+        if path.lower().endswith(media_exts) and trash_dir not in os.path.dirname(path):
+            path_dict[os.path.basename(path)] = path
+    return path_dict
+
+def tagged_media(medias, tagname: str = '') -> list[str]:
+    """Get the file paths of media given by name, sorted as on tag pages.
+
+    Names are found in the cached catalog, outside the trash; media with
+    a hidden tag are left out, except on the page of that tag. Listings
+    are kept for the pages of the same listing, until the state changes.
+    """
+    if not STATE.all_media_files:
+        get_all_media_files(PATHS['media_path'], STATE.all_media_files)
+    key = _tagged_key()
+    listing_key = (frozenset(medias), tagname)
+    with _tagged_lock:
+        if _tagged['key'] != key:
+            _tagged.update(key=key, paths=_media_path_index(), listings=OrderedDict())
+        path_dict = _tagged['paths']
+        listings = _tagged['listings']
+        if listing_key in listings:
+            listings.move_to_end(listing_key)
+            return listings[listing_key]
     
-    for root, dirs, files in os.walk(PATHS['media_path']):
-        if PATHS['trash_dir'] not in root:
-            for file in files:
-                if file.lower().endswith(media_exts):
-                    path_dict[file] = root.replace('\\', '/')
-    
-    # Filter existing media
-    media_files = [
-        media for media in medias
-        if media in path_dict and os.path.isfile(
-            os.path.join(path_dict[media], media)
-        )
-    ]
+    media_files = [media for media in listing_key[0] if media in path_dict]
     
     # Apply hidden tags filter
     if tagname != 'hidden':
@@ -530,49 +1147,92 @@ def page_for_medias(medias: list, tagname: str = '') -> str:
     # Sort by pinyin
     from src.hanzi_sort.hanzi_sort import pinyin_order
     media_files = sorted(media_files, key=pinyin_order)
-    
-    # Prepare media data
-    media_tags = [
-        [tag for tag, _ in STATE.sorted_tags if media in STATE.tags.get(tag, set())]
-        for media in media_files
-    ]
-    
-    # Convert filesystem paths to URL paths using fs_to_url
-    media_paths = []
-    preview_paths = []
-    for file in media_files:
-        fs_file = os.path.join(path_dict[file], file).replace('\\', '/')
-        media_paths.append(fs_to_url(fs_file, PATHS['media_path'], 'media'))
+    listing = [path_dict[media] for media in media_files]
+    with _tagged_lock:
+        if _tagged['key'] == key:
+            listings[listing_key] = listing
+            if len(listings) > TAGGED_CACHE_SIZE:
+                listings.popitem(last=False)
+    return listing
+
+def page_for_medias(medias: list, tagname: str = '', list_api: str | None = None):
+    """Render HTML page for given media names.
 
-        # compute preview file path and convert to URL
-        basename_no_ext, extension = os.path.splitext(file)
-        preview_fs = os.path.join(path_dict[file], 'previews', f'{basename_no_ext} preview{extension}').replace('\\', '/')
-        if not os.path.isfile(preview_fs):
-            preview_fs = fs_file
-        preview_paths.append(fs_to_url(preview_fs, PATHS['media_path'], 'media'))
+    With ``list_api``, the URL of the same listing in the JSON API, only
+    the first page is rendered and the browser loads the rest as it
+    scrolls. The first media are suggested for prefetching.
+    """
+    fs_paths = tagged_media(medias, tagname)
+    next_cursor = None
+    if list_api is not None:
+        fs_paths, next_cursor = page_slice(fs_paths, None, PAGE_SIZE)
+    # The catalog is cached, so check the files shown still exist
+    fs_paths = [path for path in fs_paths if os.path.isfile(path)]
+    page_data = describe_media(
+        fs_paths,
+        STATE.sorted_tags,
+        STATE.tags,
+        PATHS['media_path'],
+        'media',
+        STATE.placeholders,
+    )
     
-    return render_template(
+    response = make_response(render_template(
         'index.html',
         tags=STATE.sorted_tags,
         directories=[],
-        medias=media_paths,
-        previews=preview_paths,
+        medias=page_data['media_paths'],
+        previews=page_data['preview_paths'],
+        placeholders=page_data['placeholders'],
         breadcrumb_paths=[tagname],
         subpath='',
         endpoint='Tags',
-        media_tags=media_tags,
+        media_tags=page_data['media_tags'],
         last_used_tags=STATE.last_used_tags,
-    )
+        next_cursor=next_cursor,
+        list_api=list_api,
+    ))
+    return prefetch_hint(response, page_data['media_paths'])
+
+def prefetch_hint(response, media_urls: list[str]):
+    """Suggest the first media of a listing for the browser to prefetch.
+
+    They are those most likely opened first. Videos are too large to
+    fetch on speculation, so their poster is suggested instead. Nothing
+    is suggested on slow connections or to clients saving data.
+    """
+    response.vary.update(('Save-Data', 'ECT', 'Downlink'))
+    response.headers['Accept-CH'] = 'Save-Data, ECT, Downlink'
+    try:
+        slow = float(request.headers.get('Downlink', 10)) < 1.5
+    except ValueError:
+        slow = False
+    if (
+        request.headers.get('Save-Data', '').lower() == 'on'
+        or request.headers.get('ECT', '') in ('slow-2g', '2g')
+        or slow
+    ):
+        return response
+    urls = [
+        poster_url(url) if url.lower().endswith(VIDEO_EXTS) else quote(url)
+        for url in media_urls[:PREFETCH_HINT]
+    ]
+    if urls:
+        response.headers['Link'] = prefetch_links(urls)
+    return response
 
 
 @app.route('/tags')
 @app.route('/tags/<subpath>')
+@cached_page()
 def Tags(subpath=''):
     """Get all medias with a given tag, or list all tags."""
     tagname = subpath
     
     if tagname and tagname in STATE.tags:
-        return page_for_medias(STATE.tags[tagname], tagname)
+        return page_for_medias(
+            STATE.tags[tagname], tagname, url_for('tag_api', tagname=tagname)
+        )
     else:
         STATE.update_sorted_tags()
         return render_template(
@@ -601,6 +1261,13 @@ def filter_media_with_tags():
         STATE.save_tags()
         return Tags()
     
+    medias = _filter_results(op, selected_tags)
+    tagname = f'{op}({",".join(selected_tags)})'
+    list_api = url_for('filter_api', op=op, tags=request.args.get('tags', ''))
+    return page_for_medias(medias, tagname=tagname, list_api=list_api)
+
+def _filter_results(op: str, selected_tags: list[str]) -> set:
+    """Get the names of media having all ('and') or any ('or') of the tags."""
     # Calculate intersection or union
     medias = set()
     if op == 'and':
@@ -614,8 +1281,422 @@ def filter_media_with_tags():
         print('OR filter applied')
     
     print(f'{len(medias)} medias in filter result')
+    return medias
+
+
+def media_item(url: str, preview: str, tags: list[str], placeholder: str) -> dict:
+    """Get what the grid needs to show a media tile, as index.html renders it."""
+    if url.endswith(('.mp4', '.webm')):
+        kind = 'video'
+    elif gif_video_url(url):
+        kind = 'gif'
+    else:
+        kind = 'image'
+    thumb = thumb_url(url)
+    srcset = ''
+    if thumb != url:
+        srcset = ', '.join(f'{thumb_url(url, size)} {size}w' for size in THUMB_SIZES)
+    return {
+        'url': url,
+        'kind': kind,
+        'preview': preview,
+        'poster': poster_url(url) if kind == 'video' else '',
+        'gif_video': gif_video_url(url) if kind == 'gif' else '',
+        'thumb': thumb,
+        'srcset': srcset,
+        'size': media_size(url),
+        'placeholder': placeholder,
+        'tags': tags,
+    }
+
+def media_items(fs_paths: list[str]) -> list[dict]:
+    """Get the tile data of media files, in order."""
+    page_data = describe_media(
+        fs_paths,
+        STATE.sorted_tags,
+        STATE.tags,
+        PATHS['media_path'],
+        'media',
+        STATE.placeholders,
+    )
+    return [
+        media_item(*fields)
+        for fields in zip(
+            page_data['media_paths'],
+            page_data['preview_paths'],
+            page_data['media_tags'],
+            page_data['placeholders'],
+            strict=True,
+        )
+    ]
+
+def media_changes(
+    updated: list[tuple[str | None, str]] = (),
+    removed: list[str] = (),
+    folders: list[tuple[str, str]] = (),
+) -> dict:
+    """Describe what a mutation changed, for the grid to patch its tiles.
+
+    ``updated`` holds (old URL, new file path) pairs of renamed, moved or
+    retagged media, with no old URL for new files; their new tile data is
+    sent. ``removed`` holds URLs of
+    media gone, and ``folders`` (old, new) paths of folders relative to the
+    media folder.
+    """
+    items = media_items([path for _, path in updated])
+    return {
+        'updated': [
+            {'old': old, 'item': item}
+            for (old, _), item in zip(updated, items, strict=True)
+        ],
+        'removed': list(removed),
+        'folders': [
+            {'old': old.replace('\\', '/'), 'path': new.replace('\\', '/')}
+            for old, new in folders
+        ],
+    }
+
+def tag_changes(removed: list[str] = (), tag: str | None = None) -> dict:
+    """Describe changed tag chips: tags gone, and a tag created or grown."""
+    changes = {'removed_tags': [t for t in removed if t != tag]}
+    if tag is not None:
+        changes['tag'] = {
+            'name': tag,
+            'pinyin': get_pinyin(tag),
+            'count': len(STATE.tags.get(tag, ())),
+        }
+    return changes
+
+def publish_changes(changes: dict) -> dict:
+    """Send what a mutation changed to every open page, through /events."""
+    if any(changes.values()):
+        STATE.publish('changes', changes)
+    return changes
+
+def publish_job(status: dict) -> None:
+    """Send the progress of a job to every open page, through /events."""
+    STATE.publish('job', status)
+
+def media_list(fs_paths: list[str]):
+    """Answer one page of a media listing as JSON.
+
+    The page starts after the ``cursor`` arg and holds up to ``limit``
+    items; only those are described. 'next' is the cursor of the
+    following page, null on the last one.
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        page, next_cursor = page_slice(fs_paths, request.args.get('cursor'), limit)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    items = media_items([path for path in page if os.path.isfile(path)])
+    return jsonify({
+        'success': True,
+        'items': items,
+        'next': next_cursor,
+        'total': len(fs_paths),
+    })
+
+@app.route('/api/browse', defaults={'subpath': ''})
+@app.route('/api/browse/<path:subpath>')
+def browse_api(subpath):
+    """Get a page of the media of a folder."""
+    full_path = os.path.join(PATHS['media_path'], subpath)
+    listing = list_directory(full_path, STATE.tags, STATE.hidden_tags)
+    if listing is None:
+        return jsonify({'success': False, 'error': f'Not a folder: {subpath}'}), 404
+    return media_list([os.path.join(full_path, name) for name in listing[1]])
+
+@app.route('/api/tags/<tagname>')
+def tag_api(tagname):
+    """Get a page of the media with a tag."""
+    return media_list(tagged_media(STATE.tags.get(tagname, set()), tagname))
+
+@app.route('/api/search_media/<path:subpath>')
+def search_api(subpath):
+    """Get a page of the media matching the keywords arg."""
+    results = _search_results(subpath)
+    if results is None:
+        return jsonify({'success': False, 'error': f'Not a folder: {subpath}'}), 404
+    return media_list(tagged_media(results, 'search'))
+
+@app.route('/api/tag_catalog')
+def tag_catalog_api():
+    """Get the changes to the tag list since the version a client has.
+
+    Browsers keep the tag list with the version it is current at, and
+    pass it as ``since``; without one, the whole list is sent.
+    """
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid version'}), 400
+    return jsonify({'success': True, **STATE.tag_catalog_since(since)})
+
+@app.route('/api/media_tags')
+def media_tags_api():
+    """Get the tags of one media, given by URL or file name."""
+    media = request.args.get('media', '').split('/')[-1]
+    return jsonify({'success': True, 'tags': STATE.tags_of(media)})
+
+@app.route('/api/filter_media_with_tags')
+def filter_api():
+    """Get a page of the media having all ('and') or any ('or') of the tags."""
+    op = request.args.get('op', 'and')
+    if op not in ('and', 'or'):
+        return jsonify({'success': False, 'error': f'Unknown op: {op}'}), 400
+    selected_tags = request.args.get('tags', '').split('_')
     tagname = f'{op}({",".join(selected_tags)})'
-    return page_for_medias(medias, tagname=tagname)
+    return media_list(tagged_media(_filter_results(op, selected_tags), tagname))
+
+
+def _probe_media_job(options: dict):
+    """Probe every video of the catalog missing from the metadata cache."""
+    videos = get_all_video_files(
+        PATHS['media_path'], STATE.all_media_files, STATE.all_video_files
+    )
+    return probe_media_job(videos, STATE.media_info, options.get('workers'))
+
+
+def _gen_previews_job(options: dict):
+    """Generate sampled previews for every video of the catalog without one."""
+    videos = get_all_video_files(
+        PATHS['media_path'], STATE.all_media_files, STATE.all_video_files
+    )
+    return preview_job(
+        videos,
+        STATE.media_info,
+        STATE.preview_failures,
+        count=int(options.get('segments', 5)),
+        length=float(options.get('segment_length', 2.0)),
+        resolution=int(options.get('resolution', 320)),
+        workers=options.get('workers'),
+    )
+
+
+def _thumbnails_job(options: dict):
+    """Pre-generate thumbnails of every image of the catalog."""
+    images = get_all_media_files(PATHS['media_path'], STATE.all_media_files)
+    sizes = [int(s) for s in options.get('sizes', THUMB_SIZES)]
+    return thumbnail_job(
+        images, THUMBNAILER.cache_dir, sizes, workers=options.get('workers')
+    )
+
+
+def _posters_job(options: dict):
+    """Extract poster frames of every video of the catalog."""
+    videos = get_all_video_files(
+        PATHS['media_path'], STATE.all_media_files, STATE.all_video_files
+    )
+    return poster_job(videos, POSTERS_DIR, STATE.media_info, options.get('workers'))
+
+
+def _convert_images_job(options: dict):
+    """Convert the images of a folder, or matching a search, to another format.
+
+    Tags follow each image to its new filename and are saved once the job
+    finishes.
+    """
+    if options.get('keywords'):
+        images = search_media_files(
+            PATHS['media_path'], options['keywords'].split('_'), STATE.all_media_files
+        )
+    else:
+        folder = safe_join(PATHS['media_path'], options.get('path', ''))
+        images = find_images(folder) if folder else []
+    images = [f for f in images if f.lower().endswith(CONVERT_EXTS)]
+    keep_original = bool(options.get('keep_original', False))
+    
+    def move_tags(task, result):
+        if result['dest'] is not None:
+            rename_media_tags(
+                os.path.basename(result['source']),
+                os.path.basename(result['dest']),
+                STATE.tags,
+                keep_old=keep_original,
+            )
+    
+    def finish():
+        STATE.save_tags()
+        STATE.clear_media_cache()
+    
+    return conversion_job(
+        images,
+        options.get('format', 'webp'),
+        options.get('quality', 'balanced'),
+        keep_original,
+        on_result=move_tags,
+        on_finish=finish,
+        workers=options.get('workers'),
+    )
+
+
+def _import_xmp_job(options: dict):
+    """Import the XMP tags of every file of the catalog not imported yet.
+
+    Tags of the files read are merged into the tag state and saved once the
+    job finishes.
+    """
+    files = get_all_media_files(PATHS['media_path'], STATE.all_media_files)
+    
+    def merge():
+        media_tags = {}
+        for path in job.items:
+            tag_list = STATE.xmp_tags.get(path)
+            if tag_list:
+                media_tags.setdefault(os.path.basename(path), []).extend(tag_list)
+        if import_media_tags(media_tags, STATE.tags):
+            STATE.update_sorted_tags()
+            STATE.save_tags()
+    
+    job = xmp_import_job(
+        files, STATE.xmp_tags, on_finish=merge, workers=options.get('workers')
+    )
+    return job
+
+
+def _image_meta_job(options: dict):
+    """Index size and EXIF of every image of the catalog missing from the cache."""
+    images = get_all_media_files(PATHS['media_path'], STATE.all_media_files)
+    return image_meta_job(images, STATE.image_meta, options.get('workers'))
+
+
+def _placeholders_job(options: dict):
+    """Make inline placeholders of every image, and every video with a poster.
+
+    Videos get theirs from the poster frame, so run the posters job first.
+    """
+    tasks = []
+    for path in get_all_media_files(PATHS['media_path'], STATE.all_media_files):
+        if path.lower().endswith(THUMB_EXTS):
+            tasks.append((path, path))
+            continue
+        try:
+            poster = poster_path(POSTERS_DIR, path)
+        except OSError:
+            continue
+        if os.path.isfile(poster):
+            tasks.append((path, poster))
+    return placeholder_job(tasks, STATE.placeholders, options.get('workers'))
+
+
+def _gif_videos_job(options: dict):
+    """Transcode every animated GIF of the catalog to a video twin."""
+    gifs = get_all_media_files(PATHS['media_path'], STATE.all_media_files)
+    return gif_twin_job(
+        gifs,
+        GIF_TWINS_DIR,
+        STATE.gif_twins,
+        options.get('format', 'mp4'),
+        options.get('workers'),
+    )
+
+
+def _proxies_job(options: dict):
+    """Render the missing proxies of every video of the catalog.
+
+    Videos are only given proxies smaller than themselves, so run the
+    probe_media job first.
+    """
+    videos = get_all_video_files(
+        PATHS['media_path'], STATE.all_media_files, STATE.all_video_files
+    )
+    return proxy_job(
+        videos, PROXIES_DIR, STATE.media_info, PROXY_LADDER, options.get('workers')
+    )
+
+
+def _faststart_scan_job(options: dict):
+    """Find the MP4s of the catalog whose moov box comes after their media data."""
+    videos = get_all_video_files(
+        PATHS['media_path'], STATE.all_media_files, STATE.all_video_files
+    )
+    return faststart_scan_job(videos, STATE.faststart, options.get('workers'))
+
+
+def _faststart_job(options: dict):
+    """Remux the MP4s found by faststart_scan so they can play while downloading."""
+    videos = get_all_video_files(
+        PATHS['media_path'], STATE.all_media_files, STATE.all_video_files
+    )
+    return faststart_job(
+        videos,
+        STATE.faststart,
+        float(options.get('bandwidth_mbps', 50.0)),
+        options.get('workers'),
+    )
+
+
+def _scan_media_job(options: dict):
+    """Walk the media folder again, and publish the files added and removed.
+
+    The catalog is replaced by the new listing, so tag pages and searches
+    see the new files too.
+    """
+    def update_catalog(path, media_files):
+        if STATE.all_media_files:
+            known = set(STATE.all_media_files)
+            found = set(media_files)
+            publish_changes(media_changes(
+                updated=[(None, f) for f in media_files if f not in known],
+                removed=[
+                    fs_to_url(f, PATHS['media_path'], 'media')
+                    for f in STATE.all_media_files if f not in found
+                ],
+            ))
+        STATE.all_media_files[:] = media_files
+        STATE.all_video_files = []
+    
+    return BackgroundJob(
+        'scan_media',
+        scan_media_files,
+        [PATHS['media_path']],
+        on_result=update_catalog,
+        workers=1,
+        processes=False,
+    )
+
+
+# Background jobs that can be started from /jobs/<name>
+JOB_FACTORIES = {
+    'probe_media': _probe_media_job,
+    'gen_previews': _gen_previews_job,
+    'thumbnails': _thumbnails_job,
+    'posters': _posters_job,
+    'convert_images': _convert_images_job,
+    'import_xmp': _import_xmp_job,
+    'image_meta': _image_meta_job,
+    'placeholders': _placeholders_job,
+    'gif_videos': _gif_videos_job,
+    'proxies': _proxies_job,
+    'faststart_scan': _faststart_scan_job,
+    'faststart': _faststart_job,
+    'scan_media': _scan_media_job,
+}
+
+
+@app.route('/jobs', methods=['GET'])
+def jobs_status():
+    """Get progress of background jobs."""
+    return jsonify([job.status() for job in JOBS.values()])
+
+
+@app.route('/jobs/<name>', methods=['POST'])
+def start_background_job(name):
+    """Start a background job by name."""
+    factory = JOB_FACTORIES.get(name)
+    if factory is None:
+        return jsonify({'success': False, 'error': f'Unknown job: {name}'})
+    
+    try:
+        job = factory(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
+    job.on_progress = publish_job
+    if not start_job(job):
+        return jsonify({'success': False, 'error': f'Job {name} already running'})
+    return jsonify({'success': True, 'status': job.status()})
 
 
 if __name__ == '__main__':
@@ -1,4 +1,6 @@
 """Browse and search routes."""
+import base64
+import json
 import os
 
 from natsort import natsorted
@@ -14,17 +16,27 @@ def get_all_media_files(path: str, media_files_cache: list) -> list:
         return media_files_cache
     
     print(f'Caching all media files from {path}...')
+    media_files_cache.extend(scan_media_files(path))
+    print(f'Total {len(media_files_cache)} media files cached.')
+    return media_files_cache
+
+
+def scan_media_files(path: str) -> list:
+    """Walk a folder for media files, skipping previews and hidden entries."""
     media_exts = ('.png', '.jpg', '.jpeg', '.gif', '.mp4', '.webm', '.webp', '.ogg')
-    
+    media_files = []
     for root, dirs, files in os.walk(path):
+        # Skip hidden folders such as .database, which holds generated caches
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
         for name in files:
             f = name.lower()
+            # Hidden files include the temp files of renders in progress
+            if f.startswith('.'):
+                continue
             if f.endswith(media_exts) and 'preview.' not in f:
                 file_path = os.path.join(root, name)
-                media_files_cache.append(file_path.replace('\\', '/'))
-    
-    print(f'Total {len(media_files_cache)} media files cached.')
-    return media_files_cache
+                media_files.append(file_path.replace('\\', '/'))
+    return media_files
 
 
 def get_all_video_files(path: str, all_media: list, video_files_cache: list) -> list:
@@ -49,11 +61,18 @@ def search_media_files(
     keywords: list[str],
     all_media: list,
 ) -> list:
-    """Search for media files by keyword."""
+    """Search for media files by keyword.
+
+    ``all_media`` may be the catalog of a parent folder; only files under
+    ``search_path`` are searched.
+    """
     all_files = get_all_media_files(search_path, all_media)
+    prefix = search_path.replace('\\', '/').rstrip('/') + '/'
     
     results = []
     for file_path in all_files:
+        if not file_path.startswith(prefix):
+            continue
         filename = os.path.basename(file_path)
         filename_pinyin = get_pinyin(file_path).lower()
         
@@ -78,58 +97,138 @@ def filter_hidden_media(
     ]
 
 
-def prepare_media_page(
+def list_directory(
     directory_path: str,
-    subpath: str,
-    tags_sorted: list,
     tags_state: dict,
     hidden_tags: set,
-    static_dir: str,
-    media_url: str,
-    endpoint: str,
-) -> dict:
-    """Prepare data for rendering media browse page."""
+) -> tuple[list[str], list[str]] | None:
+    """Get the sub-folders and the sorted, visible media names of a folder."""
     if not os.path.isdir(directory_path):
         return None
     
     items = os.listdir(directory_path)
     directories = [d for d in items if os.path.isdir(os.path.join(directory_path, d))]
     
-    # Get media files
     media_exts = ('.png', '.jpg', '.jpeg', '.gif', '.mp4', '.webm', '.webp', '.ogg')
     media_files = natsorted([
         f for f in items
         if f.lower().endswith(media_exts)
     ])
-    
-    # Filter hidden media
-    media_files = filter_hidden_media(media_files, tags_state, hidden_tags)
-    
-    # Prepare URLs and metadata
-    media_paths = [
-        '/' + '/'.join([media_url, *subpath.split('/'), mf])
-        for mf in media_files
-    ]  if subpath else [
-        '/' + '/'.join([media_url, mf])
-        for mf in media_files
-    ]
-    
-    media_tags = [
-        " ".join([tag for tag, _ in tags_sorted if tag in tags_state and mf in tags_state[tag]])
-        for mf in media_files
-    ]
-    
-    preview_paths = [
-        fs_to_url(get_media_preview(os.path.join(directory_path, mf)), static_dir, media_url)
-        for mf in media_files
-    ]
-    
-    breadcrumb_paths = subpath.split('/') if subpath else []
+    return directories, filter_hidden_media(media_files, tags_state, hidden_tags)
+
+
+def describe_media(
+    fs_paths: list[str],
+    tags_sorted: list,
+    tags_state: dict,
+    static_dir: str,
+    media_url: str,
+    placeholders=None,
+) -> dict:
+    """Get the URLs, previews, tags and placeholders of media files.
+
+    Only the given files are looked at, so callers pass the page they show
+    rather than the whole listing.
+    """
+    media_paths = []
+    media_tags = []
+    preview_paths = []
+    media_placeholders = []
+    for fs_path in fs_paths:
+        fs_path = fs_path.replace('\\', '/')
+        name = os.path.basename(fs_path)
+        media_paths.append(fs_to_url(fs_path, static_dir, media_url))
+        media_tags.append([
+            tag for tag, _ in tags_sorted
+            if name in tags_state.get(tag, ())
+        ])
+        preview = get_media_preview(fs_path)
+        preview_paths.append(fs_to_url(preview, static_dir, media_url))
+        media_placeholders.append(
+            placeholders.get(fs_path, '') if placeholders is not None else ''
+        )
     
     return {
-        'directories': directories,
         'media_paths': media_paths,
         'media_tags': media_tags,
         'preview_paths': preview_paths,
-        'breadcrumb_paths': breadcrumb_paths,
+        'placeholders': media_placeholders,
     }
+
+
+def encode_cursor(offset: int, name: str) -> str:
+    """Make an opaque cursor pointing after ``name``, found at ``offset``."""
+    data = json.dumps([offset, name], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def page_slice(
+    items: list[str],
+    cursor: str | None,
+    limit: int,
+) -> tuple[list[str], str | None]:
+    """Get the page of a listing after ``cursor``, and the cursor of the next.
+
+    The cursor remembers the last item sent, so a page still starts at the
+    right item after files before it are added or removed; the offset is
+    only used to find it quickly, or when it is gone. Raises ValueError for
+    a malformed cursor.
+    """
+    start = 0
+    if cursor:
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            offset, name = json.loads(base64.urlsafe_b64decode(padded))
+            offset = int(offset)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f'Invalid cursor: {cursor}') from e
+        names = [os.path.basename(item) for item in items]
+        if 0 < offset <= len(items) and names[offset - 1] == name:
+            start = offset
+        elif name in names:
+            start = names.index(name) + 1
+        else:
+            start = min(max(offset, 0), len(items))
+    
+    page = items[start:start + limit]
+    end = start + len(page)
+    if end >= len(items) or not page:
+        return page, None
+    return page, encode_cursor(end, os.path.basename(page[-1]))
+
+
+def prepare_media_page(
+    directory_path: str,
+    subpath: str,
+    tags_sorted: list,
+    tags_state: dict,
+    hidden_tags: set,
+    static_dir: str,
+    media_url: str,
+    endpoint: str,
+    placeholders=None,
+    limit: int | None = None,
+) -> dict:
+    """Prepare data for rendering media browse page.
+
+    ``placeholders`` is an optional cache of inline placeholder images by
+    media path, returned for the media that have one. With ``limit``, only
+    the first page of media is described, and 'next_cursor' gets the rest.
+    """
+    listing = list_directory(directory_path, tags_state, hidden_tags)
+    if listing is None:
+        return None
+    directories, media_files = listing
+    
+    fs_paths = [os.path.join(directory_path, mf) for mf in media_files]
+    next_cursor = None
+    if limit is not None:
+        fs_paths, next_cursor = page_slice(fs_paths, None, limit)
+    
+    page_data = describe_media(
+        fs_paths, tags_sorted, tags_state, static_dir, media_url, placeholders
+    )
+    page_data['directories'] = directories
+    page_data['breadcrumb_paths'] = subpath.split('/') if subpath else []
+    page_data['next_cursor'] = next_cursor
+    return page_data
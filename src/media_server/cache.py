@@ -0,0 +1,174 @@
+"""Persistent per-file caches invalidated by file fingerprint."""
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+def file_fingerprint(path: str) -> tuple[int, int] | None:
+    """Get (size, mtime_ns) of a file, or None if it can't be stat'ed."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def sharded_path(cache_dir: str, source: str, extension: str) -> str:
+    """Get the path of a file generated from ``source`` in a sharded cache dir.
+
+    The name hashes the source path and mtime, so a changed source gets a
+    new entry. Files are spread over two levels of sub-folders by hash
+    prefix, so no folder holds more than a few hundred files.
+    """
+    mtime = os.stat(source).st_mtime_ns
+    digest = hashlib.sha1(f'{source}:{mtime}'.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, digest[:2], digest[2:4], f'{digest}{extension}')
+
+
+class FileCache:
+    """Cache of values computed from files, stored in a pickle file.
+
+    Entries are kept as ``path -> (fingerprint, value)``; an entry is only
+    returned while the file still has the same size and mtime.
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = Path(cache_file)
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        """Load entries from disk on first access."""
+        if self._entries is None:
+            try:
+                with open(self.cache_file, 'rb') as f:
+                    self._entries = pickle.load(f)
+            except Exception:
+                self._entries = {}
+        return self._entries
+
+    def get(self, path: str, default=None):
+        """Get the cached value for a file if it is still fresh."""
+        with self._lock:
+            entry = self._load().get(path)
+        if entry is None or entry[0] != file_fingerprint(path):
+            return default
+        return entry[1]
+
+    def set(self, path: str, value) -> None:
+        """Cache a value for the current version of a file."""
+        fingerprint = file_fingerprint(path)
+        if fingerprint is None:
+            return
+        with self._lock:
+            self._load()[path] = (fingerprint, value)
+
+    def peek(self, path: str, default=None):
+        """Get the cached value for a file even if the file has changed."""
+        with self._lock:
+            entry = self._load().get(path)
+        return default if entry is None else entry[1]
+
+    def get_or_compute(self, path: str, func, save: bool = True):
+        """Get a fresh value for a file, computing and caching it if needed."""
+        value = self.get(path)
+        if value is None:
+            value = func(path)
+            self.set(path, value)
+            if save:
+                self.save()
+        return value
+
+    def pop(self, path: str, default=None):
+        """Remove a file's entry and return its value."""
+        with self._lock:
+            entry = self._load().pop(path, None)
+        return default if entry is None else entry[1]
+
+    def paths(self) -> list[str]:
+        """Get all cached paths, fresh or not."""
+        with self._lock:
+            return list(self._load())
+
+    def save(self) -> None:
+        """Write the cache to disk atomically."""
+        with self._lock:
+            entries = dict(self._load())
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_name(
+            f'{self.cache_file.name}.{os.getpid()}.{threading.get_ident()}.tmp'
+        )
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(entries, f)
+        os.replace(tmp_file, self.cache_file)
+
+
+class LRUDiskCache:
+    """Size-capped directory of generated files, evicting least recently used.
+
+    Files are tracked by access order from ``touch`` and ``add``; on start
+    the order is restored from file mtimes, which ``touch`` updates.
+    """
+
+    def __init__(self, cache_dir, max_bytes: int):
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        self._files = None
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def _load(self) -> OrderedDict:
+        """Index files already in the cache dir on first access."""
+        if self._files is None:
+            found = []
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((st.st_mtime_ns, path, st.st_size))
+            self._files = OrderedDict(
+                (path, size) for _, path, size in sorted(found)
+            )
+            self._total = sum(self._files.values())
+        return self._files
+
+    def touch(self, path: str) -> None:
+        """Mark a cached file as just used."""
+        with self._lock:
+            files = self._load()
+            if path in files:
+                files.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def add(self, path: str) -> None:
+        """Track a new file, evicting old ones while the cache is too big."""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            files = self._load()
+            self._total += size - files.pop(path, 0)
+            files[path] = size
+            while self._total > self.max_bytes and len(files) > 1:
+                old_path, old_size = files.popitem(last=False)
+                self._total -= old_size
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            self._load()
+            return self._total
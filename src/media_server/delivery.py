@@ -0,0 +1,246 @@
+"""File delivery, optionally offloaded to a front proxy, and compression."""
+import gzip
+import hashlib
+import mimetypes
+import os
+import zlib
+from urllib.parse import quote
+
+from flask import Response, send_file
+from werkzeug.datastructures import Accept
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Offload modes: nginx's X-Accel-Redirect, or X-Sendfile (Apache, lighttpd, Caddy)
+OFFLOAD_MODES = ('x-accel', 'x-sendfile')
+
+
+def offload_header(
+    path: str,
+    mode: str,
+    locations: dict[str, str],
+) -> tuple[str, str] | None:
+    """Get the header telling the front proxy to send a file itself.
+
+    X-Sendfile takes the file path. X-Accel-Redirect takes a URI under an
+    internal nginx location; ``locations`` maps folders to those URIs, and
+    the longest folder containing the file is used. None if the file isn't
+    under any of them.
+    """
+    path = os.path.abspath(path)
+    if mode == 'x-sendfile':
+        return 'X-Sendfile', path
+    if mode != 'x-accel':
+        return None
+
+    for folder in sorted(locations, key=len, reverse=True):
+        root = os.path.abspath(folder)
+        if path == root or not path.startswith(root + os.sep):
+            continue
+        rel = os.path.relpath(path, root).replace(os.sep, '/')
+        return 'X-Accel-Redirect', f"{locations[folder].rstrip('/')}/{quote(rel)}"
+    return None
+
+
+def send_media(
+    path: str,
+    mimetype: str | None = None,
+    offload: str | None = None,
+    locations: dict[str, str] | None = None,
+    max_age: int | None = None,
+) -> Response:
+    """Send a file, or let the front proxy send it when offloading is set up.
+
+    Flask answers conditional and range requests from the file's strong
+    ETag and Last-Modified. With offloading, the response has no body: the
+    proxy reads the file and handles them, so no worker is held while it
+    streams. ``max_age`` sets how long browsers may reuse the file.
+    """
+    header = offload_header(path, offload, locations or {}) if offload else None
+    if header is None:
+        return send_file(path, mimetype=mimetype, conditional=True, max_age=max_age)
+
+    response = Response(
+        mimetype=mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    )
+    response.headers[header[0]] = header[1]
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
+
+
+def prefetch_links(urls: list[str]) -> str:
+    """Get a Link header value asking browsers to prefetch URLs when idle.
+
+    The URLs must already be percent-encoded.
+    """
+    return ', '.join(f'<{url}>; rel=prefetch' for url in urls)
+
+
+_digests = {}
+
+
+def file_digest(path: str) -> str:
+    """Get a short hash of a file's content, recomputed when its mtime changes."""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _digests.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = (mtime, hashlib.sha1(f.read()).hexdigest()[:12])
+        _digests[path] = cached
+    return cached[1]
+
+
+# Types worth compressing; media is already compressed
+COMPRESSIBLE_TYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+)
+# Assets precompressed next to the original, as name.gz / name.br
+PRECOMPRESS_EXTS = ('.js', '.css', '.svg', '.json')
+# Bodies smaller than this gain little and fit a packet or two anyway
+MIN_COMPRESS_SIZE = 1024
+
+
+def choose_encoding(accept: Accept) -> str | None:
+    """Get the best content coding the client accepts: 'br', 'gzip' or None."""
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accept.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def compress_bytes(data: bytes, encoding: str, level: int = 6) -> bytes:
+    """Compress a whole body; ``level`` is gzip's 1-9, or brotli's quality 0-11."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks, encoding: str, level: int = 6):
+    """Compress a streamed body chunk by chunk.
+
+    Each chunk is flushed, so the client can decode it as it arrives
+    instead of waiting for the compressor's buffer to fill.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.process(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(
+    response: Response,
+    accept: Accept,
+    min_size: int = MIN_COMPRESS_SIZE,
+    level: int = 6,
+) -> Response:
+    """Compress an HTML, JSON or text response if the client accepts it.
+
+    Files sent by ``send_file`` are left alone: assets have precompressed
+    copies and media is already compressed. Streamed bodies are compressed
+    as they go; others only when at least ``min_size`` bytes.
+    """
+    if (
+        response.mimetype not in COMPRESSIBLE_TYPES
+        or response.direct_passthrough
+        or 'Content-Encoding' in response.headers
+    ):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(accept)
+    if encoding is None or response.status_code != 200:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(compress_bytes(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    # The encoded bytes differ, so a strong validator no longer holds
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def precompress_assets(folder: str) -> int:
+    """Write .gz (and .br with brotli) copies of text assets, at maximum level.
+
+    Copies older than their original are rewritten. Returns the number of
+    files written; a read-only folder is skipped, and assets are then sent
+    uncompressed.
+    """
+    written = 0
+    encodings = ('gzip', 'br') if brotli is not None else ('gzip',)
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if not name.endswith(PRECOMPRESS_EXTS):
+                continue
+            path = os.path.join(root, name)
+            for encoding in encodings:
+                dest = path + ('.br' if encoding == 'br' else '.gz')
+                try:
+                    fresh = os.path.exists(dest) and (
+                        os.path.getmtime(dest) >= os.path.getmtime(path)
+                    )
+                    if fresh:
+                        continue
+                    level = 11 if encoding == 'br' else 9
+                    with open(path, 'rb') as f:
+                        data = compress_bytes(f.read(), encoding, level)
+                    with open(dest, 'wb') as f:
+                        f.write(data)
+                    written += 1
+                except OSError as e:
+                    print(f"Can't precompress {path}: {e}")
+    return written
+
+
+def send_asset(path: str, accept: Accept, max_age: int | None = None) -> Response:
+    """Send an asset, or its precompressed copy if the client accepts it.
+
+    A copy is only used while it is newer than the original, so an edited
+    asset is never answered with stale content.
+    """
+    mimetype = mimetypes.guess_type(path)[0]
+    for encoding in ('br', 'gzip'):
+        dest = path + ('.br' if encoding == 'br' else '.gz')
+        if accept.quality(encoding) <= 0 or not os.path.isfile(dest):
+            continue
+        if os.path.getmtime(dest) < os.path.getmtime(path):
+            continue
+        response = send_file(dest, mimetype=mimetype, conditional=True, max_age=max_age)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=max_age)
+    if mimetype in COMPRESSIBLE_TYPES:
+        response.vary.add('Accept-Encoding')
+    return response
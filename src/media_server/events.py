@@ -0,0 +1,212 @@
+"""Server-sent change feed, served from one asyncio thread."""
+import asyncio
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+# Path of the stream; the front proxy forwards it to the event server
+STREAM_PATH = '/events/stream'
+# Seconds between comments keeping idle connections (and proxies) open
+HEARTBEAT = 25.0
+# Events queued for a slow client before it is dropped; it then
+# reconnects and catches up from the backlog
+CLIENT_QUEUE_SIZE = 256
+# Milliseconds browsers wait before reconnecting
+RETRY_MS = 3000
+# Seconds start() waits for the server to listen
+STARTUP_TIMEOUT = 5.0
+
+
+def format_event(event: dict) -> bytes:
+    """Encode a state event as a server-sent event message."""
+    data = json.dumps(event['data'], ensure_ascii=False, separators=(',', ':'))
+    message = f"id: {event['version']}\nevent: {event['type']}\ndata: {data}\n\n"
+    return message.encode('utf-8')
+
+
+def parse_since(target: str, headers: dict[str, str]) -> int | None:
+    """Get the version a client saw last: its Last-Event-ID, or the since arg."""
+    query = parse_qs(urlsplit(target).query)
+    since = headers.get('last-event-id') or query.get('since', [''])[0]
+    try:
+        return int(since)
+    except ValueError:
+        return None
+
+
+def replay(state, since: int | None, retry_ms: int = RETRY_MS) -> tuple[bytes, int]:
+    """Encode the events a client missed, and get the version it is then at.
+
+    A client whose version the backlog no longer covers is sent a reset
+    event, telling it to reload; one with no version starts from now.
+    """
+    message = f'retry: {retry_ms}\n\n'.encode()
+    if since is None:
+        return message, state.version
+    backlog = state.events_since(since)
+    if backlog is None:
+        reset = {'version': state.version, 'type': 'reset', 'data': {}}
+        return message + format_event(reset), state.version
+    seen = since
+    for event in backlog:
+        message += format_event(event)
+        seen = event['version']
+    return message, seen
+
+
+async def read_request(reader) -> tuple[str, str, dict[str, str]]:
+    """Read the method, target and lowercased headers of an HTTP request."""
+    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+    request_line, *lines = head.decode('latin-1').split('\r\n')
+    method, target = request_line.split(' ')[:2]
+    headers = {}
+    for line in lines:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+
+class EventServer:
+    """Stream the events published by a ``MediaState`` to browsers.
+
+    Flask holds a worker thread for the whole life of a streamed response,
+    so the feed is served by its own asyncio loop instead: an idle client
+    costs a socket and a queue, however many are connected. Events are
+    encoded once and copied to every client's queue.
+
+    The server listens on localhost only: browsers reach it through the
+    front proxy, which forwards ``STREAM_PATH`` to it on the app's origin.
+    """
+
+    def __init__(self, state, host: str = '127.0.0.1', port: int = 5001,
+                 heartbeat: float = HEARTBEAT):
+        self.state = state
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        self.clients = set()
+        self._loop = None
+        self._server = None
+        self._started = None
+        self._lock = threading.Lock()
+
+    def start(self, timeout: float = STARTUP_TIMEOUT) -> int | None:
+        """Start serving in a daemon thread, once; returns the port bound.
+
+        None when the server couldn't listen within ``timeout`` seconds,
+        for example as the port is taken; the next call tries again.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._started = threading.Event()
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._run, args=(self._loop, self._started), daemon=True
+                ).start()
+            started = self._started
+        if not started.wait(timeout) or self._server is None:
+            return None
+        return self.port
+
+    def stop(self) -> None:
+        """Close every connection and stop the loop."""
+        with self._lock:
+            loop = self._loop
+            if loop is None or self._server is None:
+                return
+            self.state.unsubscribe(self._publish)
+            asyncio.run_coroutine_threadsafe(self._close(), loop).result(
+                STARTUP_TIMEOUT
+            )
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop = self._server = None
+
+    def _run(self, loop, started: threading.Event) -> None:
+        asyncio.set_event_loop(loop)
+        try:
+            self._server = loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port)
+            )
+        except OSError as e:
+            print(f"Can't serve change events on port {self.port}: {e}")
+            with self._lock:
+                if self._loop is loop:
+                    self._loop = None
+            started.set()
+            loop.close()
+            return
+        # Port 0 asks for any free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        self.state.subscribe(self._publish)
+        print(f'Serving change events on {self.host}:{self.port}')
+        started.set()
+        loop.run_forever()
+
+    async def _close(self) -> None:
+        self._server.close()
+        for queue in list(self.clients):
+            queue.put_nowait(None)
+
+    def _publish(self, event: dict) -> None:
+        """Hand an event over from the thread that published it."""
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(
+                self._broadcast, event['version'], format_event(event)
+            )
+
+    def _broadcast(self, version: int, message: bytes) -> None:
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait((version, message))
+            except asyncio.QueueFull:
+                self.clients.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def _handle(self, reader, writer) -> None:
+        queue = None
+        try:
+            method, target, headers = await read_request(reader)
+            if method != 'GET' or urlsplit(target).path.rstrip('/') != STREAM_PATH:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+                await writer.drain()
+                return
+
+            writer.write(
+                b'HTTP/1.1 200 OK\r\n'
+                b'Content-Type: text/event-stream; charset=utf-8\r\n'
+                b'Cache-Control: no-cache\r\n'
+                b'X-Accel-Buffering: no\r\n\r\n'
+            )
+            # Listen before replaying, so nothing published meanwhile is lost
+            queue = asyncio.Queue(CLIENT_QUEUE_SIZE)
+            self.clients.add(queue)
+            message, seen = replay(self.state, parse_since(target, headers))
+            writer.write(message)
+            await writer.drain()
+            await self._stream(queue, writer, seen)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError,
+                asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            if queue is not None:
+                self.clients.discard(queue)
+            writer.close()
+
+    async def _stream(self, queue, writer, seen: int) -> None:
+        """Write the events queued after version ``seen`` until told to stop."""
+        while True:
+            try:
+                entry = await asyncio.wait_for(queue.get(), self.heartbeat)
+            except asyncio.TimeoutError:
+                writer.write(b': ping\n\n')
+                await writer.drain()
+                continue
+            if entry is None:
+                return
+            version, message = entry
+            if version > seen:
+                writer.write(message)
+                await writer.drain()
+                seen = version
@@ -1,7 +1,14 @@
 """Contains image processing utilities."""
+import base64
+import io
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from PIL import Image
+from PIL import Image, ImageOps, ImageSequence
+
+from src.media_server.cache import sharded_path
+from src.media_server.jobs import BackgroundJob
 
 
 def get_file_list(full_path, extensions=('.png',)):
@@ -17,20 +24,74 @@ def get_file_list(full_path, extensions=('.png',)):
 
 def convert_to_jpg(file_path):
     """Find an image and convert to jpg."""
-    img = Image.open(file_path)
-    rgb_im = img.convert('RGB')
-    rgb_im.save(file_path[:-3] + 'jpg')
+    return convert_image(file_path, 'jpeg', keep_original=True, only_smaller=False)
 
 # Extract XMP Data
-def get_xmp_tags(file_path):
-    """Extract XMP tags from an image file."""
+XMP_START = b'<x:xmpmeta'
+XMP_END = b'</x:xmpmeta>'
+XMP_CHUNK_SIZE = 1 << 16
+
+
+def _read_jpeg_xmp(f):
+    """Find the XMP packet in the APP1 segments of a JPEG.
+
+    Only segment headers are read, and the scan stops at the image data,
+    since metadata segments always come before it.
+    """
+    f.seek(2)
+    while True:
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        kind = marker[1]
+        length = int.from_bytes(marker[2:4], 'big') - 2
+        if kind == 0xDA or length < 0:
+            # Start of scan: no more metadata
+            return None
+        if kind == 0xE1:
+            data = f.read(length)
+            start = data.find(XMP_START)
+            end = data.find(XMP_END, start)
+            if start != -1 and end != -1:
+                return data[start:end + len(XMP_END)]
+        else:
+            f.seek(length, os.SEEK_CUR)
+
+
+def read_xmp_packet(file_path, chunk_size=XMP_CHUNK_SIZE):
+    """Read the ``<x:xmpmeta>`` packet of a file, or None if it has none.
+
+    The file is read in chunks only until the end of the packet, so memory
+    stays bounded for large images and videos.
+    """
     with open(file_path, 'rb') as f:
-        d = f.read()
-    xmp_start = d.find(b'<x:xmpmeta')
-    xmp_end = d.find(b'</x:xmpmeta')
-    if xmp_start == -1 or xmp_end == -1:
-        return []
-    xmp_str = d[xmp_start:xmp_end+12].decode(errors='ignore')
+        if f.read(2) == b'\xff\xd8':
+            return _read_jpeg_xmp(f)
+        f.seek(0)
+
+        buffer = b''
+        found = False
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return None
+            buffer += chunk
+            if not found:
+                start = buffer.find(XMP_START)
+                if start == -1:
+                    # Keep the tail in case the marker is split across chunks
+                    buffer = buffer[-len(XMP_START):]
+                    continue
+                buffer = buffer[start:]
+                found = True
+            end = buffer.find(XMP_END)
+            if end != -1:
+                return buffer[:end + len(XMP_END)]
+
+
+def parse_xmp_tags(xmp):
+    """Get the tags in the ``rdf:Bag`` of an XMP packet."""
+    xmp_str = xmp.decode(errors='ignore')
 
     if '<rdf:Bag>' in xmp_str:
         rdf_bag_str = xmp_str[xmp_str.find('<rdf:Bag>')+9:xmp_str.find('</rdf:Bag>')]
@@ -46,47 +107,407 @@ def get_xmp_tags(file_path):
         tags.append(tag[i:])
 
     return tags
-"""Contains image processing utilities."""
 
-def get_file_list(full_path, extensions=('.png',)):
-    """Get all files under given folder"""
-    print(f"Python getting file list from {full_path}")
-    files = []
-    if os.path.isdir(full_path):
-        items = os.listdir(full_path)
-        directories = [item for item in items if os.path.isdir(os.path.join(full_path, item))]
-        files = [item for item in items if item.lower().endswith(extensions)]
-        
-    return files
 
-def convert_to_jpg(file_path):
-    """Find an image and convert to jpg."""
-    img = Image.open(file_path)
-    rgb_im = img.convert('RGB')
-    rgb_im.save(file_path[:-3] + 'jpg')
-
-# Extract XMP Data
 def get_xmp_tags(file_path):
     """Extract XMP tags from an image file."""
-    with open(file_path, 'rb') as f:
-        d = f.read()
-    xmp_start = d.find(b'<x:xmpmeta')
-    xmp_end = d.find(b'</x:xmpmeta')
-    if xmp_start == -1 or xmp_end == -1:
+    xmp = read_xmp_packet(file_path)
+    if xmp is None:
         return []
-    xmp_str = d[xmp_start:xmp_end+12].decode(errors='ignore')
+    return parse_xmp_tags(xmp)
 
-    if '<rdf:Bag>' in xmp_str:
-        rdf_bag_str = xmp_str[xmp_str.find('<rdf:Bag>')+9:xmp_str.find('</rdf:Bag>')]
-    else:
-        rdf_bag_str = ''
 
-    raw_tags = [item[8:-9] for item in rdf_bag_str.split() if len(item)>16]
-    tags = []
-    for tag in raw_tags:
-        for i, c in enumerate(tag):
-            if not (c>='a' and c<='z'):
-                break
-        tags.append(tag[i:])
+def xmp_import_job(files, imported, on_finish=None, workers=None):
+    """Create a background job reading the XMP tags of files.
 
-    return tags
+    Files whose tags are already in the ``imported`` FileCache for their
+    current size and mtime are skipped; the tags read are added to it as
+    ``path -> [tag, ...]`` for ``on_finish`` to merge in one go.
+    """
+    todo = [f for f in files if imported.get(f) is None]
+
+    def finish():
+        imported.save()
+        if on_finish is not None:
+            on_finish()
+
+    return BackgroundJob(
+        'import_xmp', get_xmp_tags, todo,
+        on_result=imported.set, on_finish=finish, workers=workers,
+    )
+
+
+# Image metadata
+EXIF_IFD = 0x8769
+EXIF_TAGS = {'orientation': 0x0112, 'make': 0x010F, 'model': 0x0110, 'datetime': 0x0132}
+EXIF_DATETIME_ORIGINAL = 0x9003
+
+
+def _exif_datetime(value):
+    """Convert an EXIF ``YYYY:MM:DD HH:MM:SS`` date to ISO format."""
+    if not isinstance(value, str) or len(value) < 19:
+        return None
+    date, _, time = value[:19].partition(' ')
+    return f"{date.replace(':', '-')}T{time}" if time else None
+
+
+def read_image_meta(path):
+    """Read display size, orientation, capture time and camera of an image.
+
+    Only the header is parsed; pixels aren't decoded. Width and height are
+    swapped for EXIF orientations that rotate the image by 90 degrees.
+    """
+    with Image.open(path) as img:
+        width, height = img.size
+        exif = img.getexif()
+    orientation = exif.get(EXIF_TAGS['orientation'], 1)
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    taken = (
+        exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL)
+        or exif.get(EXIF_TAGS['datetime'])
+    )
+    make, model = (
+        str(exif.get(EXIF_TAGS[key], '')).strip('\x00 ') for key in ('make', 'model')
+    )
+    camera = model if model.startswith(make) else f'{make} {model}'.strip()
+    return {
+        'width': width,
+        'height': height,
+        'orientation': orientation,
+        'taken': _exif_datetime(taken),
+        'camera': camera or None,
+    }
+
+
+def image_meta_job(images, cache, workers=None):
+    """Create a background job indexing images missing from the metadata cache.
+
+    The cache is saved every 100 images, so an interrupted run keeps its
+    progress.
+    """
+    missing = [
+        p for p in images if p.lower().endswith(THUMB_EXTS) and cache.get(p) is None
+    ]
+    indexed = 0
+
+    def on_result(path, meta):
+        nonlocal indexed
+        cache.set(path, meta)
+        indexed += 1
+        if indexed % 100 == 0:
+            cache.save()
+
+    return BackgroundJob(
+        'image_meta', read_image_meta, missing,
+        on_result=on_result, on_finish=cache.save, workers=workers,
+    )
+
+
+# Thumbnails
+THUMB_SIZES = (240, 480, 960)
+THUMB_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+THUMB_QUALITY = 80
+
+
+def thumb_path(cache_dir, source, size):
+    """Get the cache path of a thumbnail, keyed by source path and mtime."""
+    return sharded_path(os.path.join(cache_dir, str(size)), source, '.webp')
+
+
+def fit_short_side(image_size, size):
+    """Scale (w, h) down so the short side is at most ``size``."""
+    w, h = image_size
+    scale = min(1.0, size / max(1, min(w, h)))
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def _save_webp(img, dest, **params):
+    """Save an image as WebP, moving it into place once complete."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp_dest = f'{dest}.{os.getpid()}.{threading.get_ident()}.tmp'
+    img.save(tmp_dest, 'WEBP', quality=THUMB_QUALITY, method=4, **params)
+    os.replace(tmp_dest, dest)
+
+
+def _save_animated_thumbnail(img, dest, size):
+    """Save every frame of an animated image, resized, as animated WebP."""
+    frames = []
+    durations = []
+    for frame in ImageSequence.Iterator(img):
+        durations.append(frame.info.get('duration', 100))
+        frame = frame.convert('RGBA')
+        frames.append(frame.resize(
+            fit_short_side(frame.size, size), Image.Resampling.LANCZOS, reducing_gap=3.0
+        ))
+    _save_webp(
+        frames[0], dest,
+        save_all=True, append_images=frames[1:], duration=durations, loop=0,
+    )
+
+
+def make_thumbnails(source, dests):
+    """Write WebP thumbnails of an image for every ``{size: dest}``.
+
+    The image is decoded once: JPEGs at reduced scale with ``Image.draft``,
+    then each size is resized from the previous one, using ``Image.reduce``
+    for the bulk of the shrinking. Animated GIFs give animated thumbnails.
+    """
+    with Image.open(source) as img:
+        if getattr(img, 'is_animated', False):
+            for size, dest in dests.items():
+                img.seek(0)
+                _save_animated_thumbnail(img, dest, size)
+            return
+
+        img.draft('RGB', fit_short_side(img.size, max(dests)))
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        for size in sorted(dests, reverse=True):
+            new_size = fit_short_side(img.size, size)
+            if img.size != new_size:
+                img = img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+            _save_webp(img, dests[size])
+
+
+def make_thumbnail(source, dest, size):
+    """Write one WebP thumbnail whose short side is at most ``size`` pixels."""
+    make_thumbnails(source, {size: dest})
+    return dest
+
+
+def generate_thumbnails(task):
+    """Write the missing thumbnails of one image (process pool worker)."""
+    source, dests = task
+    make_thumbnails(source, dests)
+
+
+def thumbnail_job(images, cache_dir, sizes=THUMB_SIZES, workers=None):
+    """Create a background job writing missing thumbnails of images.
+
+    Thumbnails are keyed by source mtime and written atomically, so a rerun
+    resumes after an interruption and only picks up new or changed files.
+    """
+    tasks = []
+    for source in images:
+        if not source.lower().endswith(THUMB_EXTS):
+            continue
+        try:
+            dests = {size: thumb_path(cache_dir, source, size) for size in sizes}
+        except OSError:
+            continue
+        missing = {
+            size: dest for size, dest in dests.items() if not os.path.isfile(dest)
+        }
+        if missing:
+            tasks.append((source, missing))
+    return BackgroundJob('thumbnails', generate_thumbnails, tasks, workers=workers)
+
+
+class Thumbnailer:
+    """Serve generated files from a disk cache, made in a bounded worker pool.
+
+    Concurrent requests for the same file share one job.
+    """
+
+    def __init__(self, cache_dir, workers=2):
+        self.cache_dir = str(cache_dir)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumb')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, source, size):
+        """Get the path of a thumbnail, generating it if it isn't cached."""
+        dest = thumb_path(self.cache_dir, source, size)
+        return self.render(dest, make_thumbnail, source, dest, size)
+
+    def render(self, dest, func, *args):
+        """Run ``func(*args)`` in the pool unless ``dest`` exists, and return it."""
+        if os.path.isfile(dest):
+            return dest
+
+        with self._lock:
+            future = self._pending.get(dest)
+            submitted = future is None
+            if submitted:
+                future = self._pool.submit(func, *args)
+                self._pending[dest] = future
+        if submitted:
+            # Outside the lock, as a finished future runs the callback here
+            future.add_done_callback(lambda f: self._forget(dest, f))
+        future.result()
+        return dest
+
+    def _forget(self, dest, future):
+        with self._lock:
+            if self._pending.get(dest) is future:
+                del self._pending[dest]
+
+
+# Placeholders
+PLACEHOLDER_SIZE = 16
+
+
+def make_placeholder(source, size=PLACEHOLDER_SIZE):
+    """Get a WebP data URI of an image scaled to fit ``size`` pixels.
+
+    Stretched over a tile by the browser, it gives a blurred preview that
+    can be inlined in the page.
+    """
+    with Image.open(source) as img:
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img).convert('RGB')
+        img.thumbnail((size, size), Image.Resampling.BOX)
+    buffer = io.BytesIO()
+    img.save(buffer, 'WEBP', quality=40)
+    data = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return 'data:image/webp;base64,' + data
+
+
+def generate_placeholder(task):
+    """Make the placeholder of one media from its image (process pool worker)."""
+    media, source = task
+    return make_placeholder(source)
+
+
+def placeholder_job(tasks, cache, workers=None):
+    """Create a background job making placeholders missing from the cache.
+
+    ``tasks`` are ``(media, source)`` pairs, where ``source`` is the media
+    itself for images and its poster frame for videos. Placeholders are
+    cached by media, so they follow changes to the media file.
+    """
+    missing = [task for task in tasks if cache.get(task[0]) is None]
+    made = 0
+
+    def on_result(task, placeholder):
+        nonlocal made
+        cache.set(task[0], placeholder)
+        made += 1
+        if made % 100 == 0:
+            cache.save()
+
+    return BackgroundJob(
+        'placeholders', generate_placeholder, missing,
+        on_result=on_result, on_finish=cache.save, workers=workers,
+    )
+
+
+# Format conversion
+CONVERT_EXTS = ('.png', '.bmp', '.tif', '.tiff', '.jpg', '.jpeg', '.webp')
+CONVERT_FORMATS = {
+    # name: (extension, Pillow format, save options)
+    'jpeg': ('.jpg', 'JPEG', {'optimize': True, 'progressive': True}),
+    'webp': ('.webp', 'WEBP', {'method': 6}),
+    'webp_lossless': ('.webp', 'WEBP', {'lossless': True, 'method': 6}),
+}
+QUALITY_PRESETS = {'high': 90, 'balanced': 80, 'small': 65}
+
+
+def converted_path(source, fmt):
+    """Get the path an image is converted to."""
+    return os.path.splitext(source)[0] + CONVERT_FORMATS[fmt][0]
+
+
+def convert_image(source, fmt='webp', quality='balanced', keep_original=False,
+                  only_smaller=True):
+    """Convert an image to ``fmt`` next to the source, moved into place when done.
+
+    ``quality`` is a preset name or a number (for lossless WebP, the
+    compression effort). EXIF, ICC profile and mtime are kept. The source
+    is deleted unless ``keep_original``; with ``only_smaller`` a result that
+    isn't smaller than the source is discarded. A file already at the
+    destination, from an earlier conversion, is replaced. Returns
+    ``{'source', 'dest', 'old_size', 'new_size'}``, with ``dest`` None when
+    the result was discarded.
+    """
+    extension, pil_format, options = CONVERT_FORMATS[fmt]
+    dest = converted_path(source, fmt)
+
+    options = dict(options, quality=QUALITY_PRESETS.get(quality, quality))
+    tmp_dest = f'{dest}.{os.getpid()}.{threading.get_ident()}.tmp'
+    st = os.stat(source)
+    with Image.open(source) as img:
+        for key in ('exif', 'icc_profile'):
+            if img.info.get(key):
+                options[key] = img.info[key]
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha and pil_format == 'WEBP' else 'RGB')
+        try:
+            img.save(tmp_dest, pil_format, **options)
+        except BaseException:
+            if os.path.exists(tmp_dest):
+                os.remove(tmp_dest)
+            raise
+
+    new_size = os.path.getsize(tmp_dest)
+    result = {
+        'source': source, 'dest': dest, 'old_size': st.st_size, 'new_size': new_size
+    }
+    if only_smaller and new_size >= st.st_size:
+        os.remove(tmp_dest)
+        result['dest'] = None
+        return result
+
+    os.utime(tmp_dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp_dest, dest)
+    if not keep_original:
+        os.remove(source)
+    return result
+
+
+def convert_image_task(task):
+    """Convert one image (process pool worker)."""
+    source, fmt, quality, keep_original = task
+    return convert_image(source, fmt, quality, keep_original)
+
+
+def find_images(directory, extensions=CONVERT_EXTS):
+    """Get all images under a folder recursively, skipping hidden folders."""
+    images = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        images.extend(
+            os.path.join(root, name) for name in files
+            if name.lower().endswith(extensions)
+        )
+    return images
+
+
+def conversion_job(images, fmt='webp', quality='balanced', keep_original=False,
+                   on_result=None, on_finish=None, workers=None):
+    """Create a background job converting images to ``fmt``.
+
+    Images already in the target format are skipped. Bytes saved are summed
+    into the job's ``stats`` and reported in its status.
+    """
+    if fmt not in CONVERT_FORMATS:
+        raise ValueError(f'Unknown image format: {fmt}')
+    same_format = ('.jpg', '.jpeg') if fmt == 'jpeg' else (CONVERT_FORMATS[fmt][0],)
+    tasks = [
+        (source, fmt, quality, keep_original) for source in images
+        if source.lower().endswith(CONVERT_EXTS)
+        and not source.lower().endswith(same_format)
+    ]
+    job = None
+
+    def record(task, result):
+        if result['dest'] is None:
+            job.stats['skipped'] += 1
+        else:
+            job.stats['bytes_saved'] += result['old_size'] - result['new_size']
+        if on_result is not None:
+            on_result(task, result)
+
+    def finish():
+        print(f"Converted images to {fmt}, {job.stats['bytes_saved']} bytes saved")
+        if on_finish is not None:
+            on_finish()
+
+    job = BackgroundJob(
+        'convert_images', convert_image_task, tasks,
+        on_result=record, on_finish=finish, workers=workers,
+    )
+    job.stats.update(bytes_saved=0, skipped=0)
+    return job
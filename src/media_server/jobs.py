@@ -0,0 +1,181 @@
+"""Background batch jobs running over a process pool."""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+# Running and finished jobs by name
+JOBS = {}
+_jobs_lock = threading.Lock()
+
+
+class BackgroundJob:
+    """Run ``func(item)`` for every item in a pool from a background thread.
+
+    At most ``2 * workers`` items are in flight at once, so memory stays
+    bounded however many items there are. Results are handed to
+    ``on_result(item, result)`` and exceptions to ``on_error(item, error)``
+    in the job thread, and ``on_finish()`` runs once all items are
+    processed or the job is cancelled. Progress is printed every
+    ``report_every`` items, and handed to ``on_progress(status)`` then,
+    when the job starts and when it ends.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func,
+        items: list,
+        on_result=None,
+        on_finish=None,
+        workers: int | None = None,
+        processes: bool = True,
+        on_error=None,
+        report_every: int = 100,
+        on_progress=None,
+    ):
+        self.name = name
+        self.func = func
+        self.items = list(items)
+        self.on_result = on_result
+        self.on_finish = on_finish
+        self.on_error = on_error
+        self.report_every = report_every
+        self.on_progress = on_progress
+        self.workers = workers or max(1, (os.cpu_count() or 2) - 1)
+        self.processes = processes
+        self.done = 0
+        self.failed = 0
+        self.stats = {}
+        self.state = 'pending'
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        """Start processing items in a daemon thread."""
+        self.state = 'running'
+        self.started_at = time.time()
+        self._report()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def cancel(self) -> None:
+        """Stop submitting new items."""
+        self._cancel.set()
+
+    def join(self, timeout: float | None = None) -> None:
+        """Wait for the job thread to finish."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self.state == 'running'
+
+    def _run(self) -> None:
+        if self.processes:
+            # Forking a multi-threaded server can deadlock, so spawn workers
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        else:
+            pool = ThreadPoolExecutor(max_workers=self.workers)
+        items = iter(self.items)
+        pending = {}
+        try:
+            with pool:
+                while True:
+                    while len(pending) < 2 * self.workers and not self._cancel.is_set():
+                        item = next(items, None)
+                        if item is None:
+                            break
+                        pending[pool.submit(self.func, item)] = item
+                    if not pending:
+                        break
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self._collect(pending.pop(future), future)
+            self.state = 'cancelled' if self._cancel.is_set() else 'finished'
+            print(f"Job {self.name} {self.state}: {self.status()}")
+        except Exception as e:
+            print(f"Error in job {self.name}: {e}")
+            self.state = 'error'
+        finally:
+            self.finished_at = time.time()
+            if self.on_finish is not None:
+                try:
+                    self.on_finish()
+                except Exception as e:
+                    print(f"Error finishing job {self.name}: {e}")
+            self._report()
+
+    def _collect(self, item, future) -> None:
+        """Record the result of one item."""
+        try:
+            result = future.result()
+            if self.on_result is not None:
+                self.on_result(item, result)
+            self.done += 1
+        except Exception as e:
+            print(f"Error in job {self.name}: {e}")
+            self.failed += 1
+            if self.on_error is not None:
+                self.on_error(item, e)
+
+        processed = self.done + self.failed
+        if self.report_every and processed % self.report_every == 0:
+            status = self.status()
+            print(
+                f"Job {self.name}: {processed}/{status['total']} "
+                f"({status['rate']} items/s, ETA {status['eta']}s)"
+            )
+            self._report(status)
+
+    def _report(self, status: dict | None = None) -> None:
+        """Hand the job status to ``on_progress``."""
+        if self.on_progress is None:
+            return
+        try:
+            self.on_progress(status or self.status())
+        except Exception as e:
+            print(f"Error reporting job {self.name}: {e}")
+
+    def status(self) -> dict:
+        """Get progress, throughput (items/s) and ETA (s) of the job."""
+        total = len(self.items)
+        processed = self.done + self.failed
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        eta = (total - processed) / rate if rate > 0 and self.running else None
+        return {
+            'name': self.name,
+            'state': self.state,
+            'total': total,
+            'done': self.done,
+            'failed': self.failed,
+            'elapsed': round(elapsed, 1),
+            'rate': round(rate, 2),
+            'eta': round(eta, 1) if eta is not None else None,
+            'stats': dict(self.stats),
+        }
+
+
+def start_job(job: BackgroundJob) -> bool:
+    """Register and start a job unless one with the same name is running."""
+    with _jobs_lock:
+        current = JOBS.get(job.name)
+        if current is not None and current.running:
+            return False
+        JOBS[job.name] = job
+    job.start()
+    return True
@@ -3,6 +3,7 @@ import os
 import shutil
 
 from src.media_server.config import fs_to_url, url_to_fs
+from src.media_server.tag_handlers import rename_media_tags
 
 
 def get_media_preview(file_path: str, check_exist: bool = True) -> str:
@@ -93,12 +94,7 @@ def rename_media_file(
             os.rename(old_preview, new_preview)
         
         # Update tags
-        changed_tags = []
-        for tag_name, medias in tags_state.items():
-            if old_filename in medias:
-                medias.remove(old_filename)
-                medias.add(new_filename)
-                changed_tags.append(tag_name)
+        rename_media_tags(old_filename, new_filename, tags_state)
         
         # Update clips data
         old_url = fs_to_url(media_path, static_dir, media_url)
@@ -118,8 +114,12 @@ def move_items(
     destination: str,
     static_dir: str,
     media_url: str,
+    on_moved=None,
 ) -> tuple[bool, str]:
-    """Move media files to destination."""
+    """Move media files to destination.
+
+    ``on_moved(old_path, new_path)`` is called for each file or folder moved.
+    """
     try:
         dest_dir = os.path.join(static_dir, destination)
         if not os.path.exists(dest_dir):
@@ -128,7 +128,10 @@ def move_items(
         for item in items:
             fs_item = url_to_fs(item, static_dir, media_url)
             if os.path.exists(fs_item):
-                shutil.move(fs_item, os.path.join(dest_dir, os.path.basename(fs_item)))
+                new_path = os.path.join(dest_dir, os.path.basename(fs_item))
+                shutil.move(fs_item, new_path)
+                if on_moved is not None:
+                    on_moved(fs_item, new_path)
         
         return True, 'Success'
     
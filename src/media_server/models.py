@@ -1,8 +1,12 @@
 """Global state management for media server."""
 import pickle
+import threading
+import time
+from collections import deque
 from pathlib import Path
 
 from src.hanzi_sort.hanzi_sort import pinyin_index, pinyin_order
+from src.media_server.cache import FileCache
 
 
 def _get_media_root(root_path: str) -> Path:
@@ -24,6 +28,10 @@ def _get_media_root(root_path: str) -> Path:
     return Path(root_path) / 'static'
 
 
+# Events kept for clients catching up on the change feed
+EVENT_BACKLOG = 1000
+
+
 class MediaState:
     """Manages global state for media, tags, and clips."""
     
@@ -39,6 +47,32 @@ class MediaState:
         self.all_media_files = []
         self.all_video_files = []
         self.medias_in_clipboard = []
+        # Bumped on every change to tags, clips or media files. It starts
+        # from the clock, so versions seen before a restart are older than
+        # any of this run.
+        self.version = self._base_version = time.time_ns() // 1_000_000
+        # Recent changes published to the /events feed, oldest first
+        self.events = deque(maxlen=EVENT_BACKLOG)
+        self._events_lock = threading.Lock()
+        self._listeners = []
+        # Version of the last event pushed out of the backlog
+        self._dropped_version = 0
+        # Versions at which tags last entered or left sorted_tags
+        self.tag_added = {}
+        self.tag_removed = {}
+        # Media name → its tags in sorted_tags order, rebuilt when tags change
+        self._tag_index = {}
+        self._tag_index_of = None
+        self._tags_saved = 0
+        self.keyframes = FileCache(self.db_dir / 'keyframes.pkl')
+        self.media_info = FileCache(self.db_dir / 'media_info.pkl')
+        self.preview_failures = FileCache(self.db_dir / 'preview_failures.pkl')
+        self.clip_outputs = FileCache(self.db_dir / 'clip_outputs.pkl')
+        self.xmp_tags = FileCache(self.db_dir / 'xmp_tags.pkl')
+        self.image_meta = FileCache(self.db_dir / 'image_meta.pkl')
+        self.placeholders = FileCache(self.db_dir / 'placeholders.pkl')
+        self.gif_twins = FileCache(self.db_dir / 'gif_twins.pkl')
+        self.faststart = FileCache(self.db_dir / 'faststart.pkl')
         
         self._load_tags()
         self._load_clips()
@@ -89,8 +123,63 @@ class MediaState:
             print(f"Can't load saved clip data: {e}")
             self.clips_data = {}
     
+    def bump_version(self):
+        """Mark the state as changed."""
+        self.version += 1
+    
+    def publish(self, kind: str, data: dict) -> dict:
+        """Record a change for the /events feed and hand it to listeners.
+
+        The event is stamped with the state version it brings, so clients
+        can ask for what happened after the last version they saw.
+        """
+        with self._events_lock:
+            self.bump_version()
+            event = {'version': self.version, 'type': kind, 'data': data}
+            if len(self.events) == self.events.maxlen:
+                self._dropped_version = self.events[0]['version']
+            self.events.append(event)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Error notifying change listener: {e}")
+        return event
+    
+    def events_since(self, version: int) -> list[dict] | None:
+        """Get the events published after ``version``, oldest first.
+
+        None if some of them were already dropped from the backlog, or the
+        version is unknown; the client must then reload instead of patching.
+        """
+        with self._events_lock:
+            if version == self.version:
+                return []
+            if (
+                version > self.version
+                or version < self._base_version
+                or self._dropped_version > version
+            ):
+                # Seen by an earlier run of the server, or no longer kept
+                return None
+            return [event for event in self.events if event['version'] > version]
+    
+    def subscribe(self, listener) -> None:
+        """Call ``listener(event)`` on every published event."""
+        with self._events_lock:
+            self._listeners.append(listener)
+    
+    def unsubscribe(self, listener) -> None:
+        """Stop calling a listener added by ``subscribe``."""
+        with self._events_lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+    
     def save_tags(self):
         """Save tags to pickle file in .database subfolder."""
+        self.bump_version()
+        self._tags_saved += 1
         # Ensure .database subfolder exists
         self.db_dir.mkdir(parents=True, exist_ok=True)
         
@@ -107,6 +196,7 @@ class MediaState:
     
     def save_clips(self):
         """Save clip data to pickle file in .database subfolder."""
+        self.bump_version()
         # Ensure .database subfolder exists
         self.db_dir.mkdir(parents=True, exist_ok=True)
         clips_file = self.db_dir / 'clip_data.pkl'
@@ -114,17 +204,78 @@ class MediaState:
             pickle.dump(self.clips_data, f)
     
     def update_sorted_tags(self):
-        """Update sorted tag list."""
+        """Update sorted tag list.
+
+        Tags entering or leaving the list are stamped with a new version,
+        for clients keeping a copy of it.
+        """
         sorted_tags = sorted(self.tags.keys(), key=pinyin_order)
         tags_pinyin = [get_pinyin(tag) for tag in sorted_tags]
         
+        old_tags = {tag for tag, _ in self.sorted_tags}
         self.sorted_tags = [
             (tag, pinyin) for tag, pinyin in zip(sorted_tags, tags_pinyin)
             if len(self.tags[tag]) > 0 and tag.isalnum()
         ]
+        
+        new_tags = {tag for tag, _ in self.sorted_tags}
+        if new_tags != old_tags:
+            self.bump_version()
+            for tag in new_tags - old_tags:
+                self.tag_added[tag] = self.version
+                self.tag_removed.pop(tag, None)
+            for tag in old_tags - new_tags:
+                self.tag_removed[tag] = self.version
+                self.tag_added.pop(tag, None)
+    
+    def tag_catalog_since(self, version: int) -> dict:
+        """Get the changes to the sorted tag list after ``version``.
+
+        'tags' holds the [tag, pinyin, previous tag] of tags added, in
+        order, so they can be inserted after their neighbour; 'removed' the
+        tags gone. With 'full', the whole list is sent instead, for a
+        version from another run of the server.
+        """
+        full = version < self._base_version or version > self.version
+        tags = []
+        previous = None
+        for tag, pinyin in self.sorted_tags:
+            if full or self.tag_added.get(tag, 0) > version:
+                tags.append([tag, pinyin, previous])
+            previous = tag
+        return {
+            'version': self.version,
+            'full': full,
+            'tags': tags,
+            'removed': [] if full else [
+                tag for tag, removed in self.tag_removed.items() if removed > version
+            ],
+        }
+    
+    def tags_of(self, media: str) -> list[str]:
+        """Get the tags of a media file name, in sorted_tags order.
+
+        They come from a reverse index of the tags, rebuilt only when the
+        tags were saved or resorted since the last lookup.
+        """
+        built_for = self._tag_index_of
+        if (
+            built_for is None
+            or built_for[0] != self._tags_saved
+            or built_for[1] is not self.tags
+            or built_for[2] is not self.sorted_tags
+        ):
+            index = {}
+            for tag, _ in self.sorted_tags:
+                for name in self.tags.get(tag, ()):
+                    index.setdefault(name, []).append(tag)
+            self._tag_index = index
+            self._tag_index_of = (self._tags_saved, self.tags, self.sorted_tags)
+        return list(self._tag_index.get(media, ()))
     
     def clear_media_cache(self):
         """Clear cached media file lists."""
+        self.bump_version()
         self.all_media_files = []
         self.all_video_files = []
 
@@ -57,3 +57,37 @@ def merge_tags(
         tags_state.pop(tag, None)
     
     tags_state[dest_tag] = medias
+
+
+def rename_media_tags(
+    old_media: str,
+    new_media: str,
+    tags_state: dict,
+    keep_old: bool = False,
+) -> list[str]:
+    """Move (or copy with ``keep_old``) the tags of a media to a new name."""
+    changed_tags = []
+    for tag_name, medias in tags_state.items():
+        if old_media in medias:
+            if not keep_old:
+                medias.remove(old_media)
+            medias.add(new_media)
+            changed_tags.append(tag_name)
+    return changed_tags
+
+
+def import_media_tags(
+    media_tags: dict[str, list[str]],
+    tags_state: dict,
+) -> bool:
+    """Add tags read from files, as ``{media: [tag, ...]}``, to the tag state."""
+    changed = False
+    for media, tag_list in media_tags.items():
+        for tag in tag_list:
+            if not tag or ' ' in tag:
+                continue
+            medias = tags_state.setdefault(tag, set())
+            if media not in medias:
+                medias.add(media)
+                changed = True
+    return changed
@@ -0,0 +1,1041 @@
+"""Video processing utilities built on ffprobe and ffmpeg."""
+import json
+import os
+import struct
+import subprocess
+import tempfile
+import threading
+from bisect import bisect_left, bisect_right
+
+from PIL import Image
+
+from src.media_server.cache import file_fingerprint, sharded_path
+from src.media_server.jobs import BackgroundJob
+from src.media_server.media_handlers import get_media_preview
+
+# Cut modes accepted by render_clip
+CUT_MODES = ('snap', 'smart', 'reencode')
+
+# Encoders used to re-encode partial GOPs in smart cut mode
+SMART_CUT_ENCODERS = {
+    'h264': 'libx264',
+    'hevc': 'libx265',
+    'vp8': 'libvpx',
+    'vp9': 'libvpx-vp9',
+    'av1': 'libaom-av1',
+}
+
+# ffprobe profile names as the encoders expect them
+SMART_CUT_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Baseline': 'baseline',
+    'Main': 'main',
+    'Extended': 'extended',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+    'Main 10': 'main10',
+}
+
+# Containers whose video track time scale can be set by the muxer
+TIMESCALE_EXTS = ('.mp4', '.m4v', '.mov')
+
+# Tolerance (seconds) when comparing timestamps with keyframes
+TIME_EPSILON = 0.01
+
+
+def run_ffprobe(args: list[str], video: str) -> str:
+    """Run ffprobe on a video and return its stdout."""
+    cmd = ['ffprobe', '-v', 'error', *args, video]
+    try:
+        return subprocess.run(
+            cmd,
+            check=False,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        ).stdout
+    except OSError as e:
+        print(f"Error running ffprobe: {e}")
+        return ''
+
+
+def read_keyframes(video: str) -> list[float]:
+    """Read keyframe timestamps of the first video stream.
+
+    Only packet headers are read, so no frame is decoded.
+    """
+    output = run_ffprobe(
+        ['-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+         '-of', 'csv=p=0'],
+        video,
+    )
+    keyframes = []
+    for line in output.splitlines():
+        pts, _, flags = line.strip().partition(',')
+        if 'K' not in flags:
+            continue
+        try:
+            keyframes.append(float(pts))
+        except ValueError:
+            continue
+    return sorted(keyframes)
+
+
+def get_keyframes(video: str, cache) -> list[float]:
+    """Get keyframe timestamps of a video, reading them once per file version."""
+    return cache.get_or_compute(video, read_keyframes)
+
+
+def _to_number(value, cast=float):
+    """Convert an ffprobe field to a number, 0 if missing."""
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return cast(0)
+
+
+def probe_media(path: str) -> dict:
+    """Read stream and container metadata of a media file with ffprobe."""
+    output = run_ffprobe(['-show_streams', '-show_format', '-of', 'json'], path)
+    try:
+        data = json.loads(output) if output else {}
+    except ValueError:
+        data = {}
+
+    streams = [
+        {
+            'type': s.get('codec_type', ''),
+            'codec': s.get('codec_name', ''),
+            'width': _to_number(s.get('width'), int),
+            'height': _to_number(s.get('height'), int),
+            'bit_rate': _to_number(s.get('bit_rate'), int),
+            'duration': _to_number(s.get('duration')),
+            'profile': s.get('profile', ''),
+            'level': _to_number(s.get('level'), int),
+            'pix_fmt': s.get('pix_fmt', ''),
+            'time_base': s.get('time_base', ''),
+        }
+        for s in data.get('streams', [])
+    ]
+    video_stream = next((s for s in streams if s['type'] == 'video'), None)
+    container = data.get('format', {})
+    return {
+        'streams': streams,
+        'format': container.get('format_name', ''),
+        'duration': _to_number(container.get('duration')),
+        'bit_rate': _to_number(container.get('bit_rate'), int),
+        'width': video_stream['width'] if video_stream else 0,
+        'height': video_stream['height'] if video_stream else 0,
+        'codec': video_stream['codec'] if video_stream else '',
+        'keyframe_count': len(read_keyframes(path)) if video_stream else 0,
+    }
+
+
+def get_media_info(path: str, cache) -> dict:
+    """Get ffprobe metadata of a media file, probing once per file version."""
+    return cache.get_or_compute(path, probe_media)
+
+
+def get_video_resolution(video: str, cache) -> tuple[int, int]:
+    """Get (width, height) of a video, (0, 0) if unknown."""
+    info = get_media_info(video, cache)
+    return info['width'], info['height']
+
+
+def scaled_size(width: int, height: int, resolution: int) -> str:
+    """Get the ffmpeg ``w:h`` size scaling the short side to ``resolution``."""
+    if width == 0 or height == 0:
+        return f'{resolution}:{resolution}'
+    if width > height:
+        w = int(width * resolution / height) // 2 * 2
+        return f'{w}:{resolution}'
+    h = int(height * resolution / width) // 2 * 2
+    return f'{resolution}:{h}'
+
+
+def probe_media_job(paths: list[str], cache, workers: int | None = None):
+    """Create a background job probing files missing from the metadata cache."""
+    missing = [p for p in paths if cache.get(p) is None]
+    probed = 0
+
+    def on_result(path, info):
+        nonlocal probed
+        cache.set(path, info)
+        probed += 1
+        if probed % 100 == 0:
+            cache.save()
+
+    return BackgroundJob(
+        'probe_media',
+        probe_media,
+        missing,
+        on_result=on_result,
+        on_finish=cache.save,
+        workers=workers,
+    )
+
+
+def smart_cut_args(info: dict, extension: str) -> list[str] | None:
+    """Get the ffmpeg args re-encoding boundary GOPs like the source video.
+
+    The parts are joined to stream-copied ones, so they keep the profile,
+    level, pixel format and time scale of the first video stream of
+    ``info``, as read by ``probe_media``. Audio is copied, or dropped when
+    there is none. None if the codec has no known encoder.
+    """
+    streams = info.get('streams', [])
+    video = next((s for s in streams if s['type'] == 'video'), None)
+    encoder = SMART_CUT_ENCODERS.get(video['codec']) if video else None
+    if encoder is None:
+        return None
+
+    args = ['-c:v', encoder]
+    profile = SMART_CUT_PROFILES.get(video.get('profile', ''))
+    if profile and encoder in ('libx264', 'libx265'):
+        args += ['-profile:v', profile]
+    level = video.get('level', 0)
+    if level > 0 and encoder == 'libx264':
+        args += ['-level:v', f'{level / 10:g}']
+    elif level > 0 and encoder == 'libx265':
+        # HEVC levels are stored times 30
+        args += ['-x265-params', f'level-idc={level / 30:g}']
+    if video.get('pix_fmt'):
+        args += ['-pix_fmt', video['pix_fmt']]
+    if video.get('bit_rate'):
+        args += ['-b:v', str(video['bit_rate'])]
+    _, _, timescale = video.get('time_base', '').partition('/')
+    if timescale.isdigit() and extension.lower() in TIMESCALE_EXTS:
+        args += ['-video_track_timescale', timescale]
+    has_audio = any(s['type'] == 'audio' for s in streams)
+    return args + (['-c:a', 'copy'] if has_audio else ['-an'])
+
+
+def decodes_cleanly(path: str) -> bool:
+    """Check a video decodes from start to end without any error."""
+    cmd = ['ffmpeg', '-v', 'error', '-i', path, '-f', 'null', '-']
+    result = subprocess.run(cmd, stderr=subprocess.PIPE, text=True)
+    return result.returncode == 0 and not (result.stderr or '').strip()
+
+
+def plan_cut(
+    start: float,
+    stop: float,
+    keyframes: list[float],
+    mode: str = 'snap',
+) -> list[tuple[float, float, bool]]:
+    """Split a clip into (start, stop, copy) segments.
+
+    - ``snap``: move the start back to the previous keyframe and copy.
+    - ``smart``: re-encode the partial GOPs at both ends, copy the middle.
+    - ``reencode``: re-encode the whole clip.
+    """
+    if mode == 'reencode' or not keyframes or stop <= start:
+        return [(start, stop, False)]
+
+    if mode == 'snap':
+        i = bisect_right(keyframes, start + TIME_EPSILON) - 1
+        snapped = keyframes[i] if i >= 0 else start
+        return [(snapped, stop, True)]
+
+    # Smart cut: copy between the first and last keyframe inside the clip
+    i = bisect_left(keyframes, start - TIME_EPSILON)
+    j = bisect_right(keyframes, stop + TIME_EPSILON) - 1
+    if i >= len(keyframes) or j < 0 or keyframes[i] >= keyframes[j]:
+        return [(start, stop, False)]
+
+    head, tail = keyframes[i], keyframes[j]
+    segments = []
+    if head - start > TIME_EPSILON:
+        segments.append((start, head, False))
+    segments.append((head, tail, True))
+    if stop - tail > TIME_EPSILON:
+        segments.append((tail, stop, False))
+    return segments
+
+
+def concat_list_line(path: str) -> str:
+    """Format a path as a line of an ffmpeg concat list."""
+    escaped = path.replace('\\', '/').replace("'", "'\\''")
+    return f"file '{escaped}'\n"
+
+
+def segment_command(
+    video: str,
+    start: float,
+    stop: float,
+    output: str,
+    copy: bool,
+    encode_args: list[str],
+) -> list[str]:
+    """Build the ffmpeg command writing one segment of a video."""
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y', '-ss', f'{start:.3f}', '-i', video,
+        '-t', f'{stop - start:.3f}',
+    ]
+    if copy:
+        cmd += ['-c', 'copy', '-avoid_negative_ts', 'make_zero']
+    else:
+        cmd += encode_args
+    return cmd + [output]
+
+
+def render_clip(
+    video: str,
+    start: float,
+    stop: float,
+    output: str,
+    keyframes: list[float],
+    mode: str = 'snap',
+    encode_args: list[str] | None = None,
+    info: dict | None = None,
+) -> bool:
+    """Render a clip of a video following the cut plan for ``mode``.
+
+    In smart mode the re-encoded parts are matched to the source from its
+    metadata ``info`` (probed when missing or cached by an older version),
+    and the joined clip must decode without errors; otherwise the clip is
+    re-encoded whole.
+    """
+    encode_args = encode_args or []
+    extension = os.path.splitext(output)[1]
+    if mode == 'smart':
+        streams = (info or {}).get('streams', [])
+        if not streams or any('pix_fmt' not in s for s in streams):
+            info = probe_media(video)
+        smart_args = smart_cut_args(info, extension)
+        if smart_args is None:
+            return render_clip(
+                video, start, stop, output, keyframes, 'reencode', encode_args
+            )
+        if not _render_segments(
+            video, plan_cut(start, stop, keyframes, mode), output, smart_args
+        ):
+            return False
+        if decodes_cleanly(output):
+            return True
+        print(f"Smart cut of {output} doesn't decode cleanly, re-encoding it")
+        return render_clip(
+            video, start, stop, output, keyframes, 'reencode', encode_args
+        )
+
+    return _render_segments(
+        video, plan_cut(start, stop, keyframes, mode), output, encode_args
+    )
+
+
+def _render_segments(
+    video: str,
+    segments: list[tuple[float, float, bool]],
+    output: str,
+    encode_args: list[str],
+) -> bool:
+    """Render the segments of a cut plan and join them into ``output``."""
+
+    if len(segments) == 1:
+        seg_start, seg_stop, copy = segments[0]
+        cmd = segment_command(
+            video, seg_start, seg_stop, output, copy, encode_args
+        )
+        return subprocess.run(cmd).returncode == 0
+
+    # Render the parts into a private temp dir, then concat without re-encoding
+    extension = os.path.splitext(output)[1]
+    # Hidden, so the media scan never catalogs parts left by a crash
+    with tempfile.TemporaryDirectory(
+        prefix='.tmp_', dir=os.path.dirname(output) or None
+    ) as tmp_dir:
+        list_file = os.path.join(tmp_dir, 'segments.txt')
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for i, (seg_start, seg_stop, copy) in enumerate(segments):
+                part = os.path.join(tmp_dir, f'part{i}{extension}')
+                cmd = segment_command(
+                    video, seg_start, seg_stop, part, copy, encode_args
+                )
+                if subprocess.run(cmd).returncode != 0:
+                    return False
+                f.write(concat_list_line(part))
+
+        cmd = [
+            'ffmpeg', '-v', 'error', '-y', '-f', 'concat', '-safe', '0',
+            '-i', list_file, '-c', 'copy', output,
+        ]
+        return subprocess.run(cmd).returncode == 0
+
+
+def clip_manifest(video: str, manifests, requested=()) -> dict:
+    """Get the manifest of outputs rendered from the current version of a video.
+
+    The manifest maps output paths to the parameters they were rendered
+    with. When the video has changed since (a faststart remux is enough),
+    its old outputs are deleted, except the ``requested`` ones about to be
+    rendered again over themselves, and an empty manifest is returned.
+    """
+    manifest = manifests.get(video)
+    if manifest is not None:
+        return manifest
+
+    stale = dict(manifests.peek(video, {}))
+    remove_outputs(stale, [output for output in stale if output not in requested])
+    return {}
+
+
+def remove_outputs(manifest: dict, outputs) -> None:
+    """Delete outputs from disk and from a manifest."""
+    for output in outputs:
+        manifest.pop(output, None)
+        if os.path.isfile(output):
+            print(f"Removing stale output {output}")
+            os.remove(output)
+
+
+def is_output_current(manifest: dict, output: str, params) -> bool:
+    """Check whether an output exists, unchanged, with the same parameters."""
+    entry = manifest.get(output)
+    return (
+        entry is not None
+        and entry['params'] == params
+        and entry['fingerprint'] == file_fingerprint(output)
+    )
+
+
+def record_output(manifest: dict, output: str, params) -> None:
+    """Record a freshly rendered output in a manifest."""
+    manifest[output] = {'params': params, 'fingerprint': file_fingerprint(output)}
+
+
+def has_audio_stream(video: str) -> bool:
+    """Check whether a video has an audio stream."""
+    output = run_ffprobe(
+        ['-select_streams', 'a:0', '-show_entries', 'stream=index', '-of', 'csv=p=0'],
+        video,
+    )
+    return bool(output.strip())
+
+
+def preview_command(
+    video: str,
+    ranges: list[tuple[float, float]],
+    output: str,
+    with_audio: bool = True,
+    scale: str = '',
+) -> list[str]:
+    """Build one ffmpeg command concatenating time ranges of a video.
+
+    Each range is opened as its own input with input seeking, so only the
+    requested parts of the source are decoded, then joined by the concat
+    filter without any intermediate file.
+    """
+    cmd = ['ffmpeg', '-v', 'error', '-y']
+    streams = ''
+    for i, (start, stop) in enumerate(ranges):
+        cmd += ['-ss', f'{start:.3f}', '-t', f'{stop - start:.3f}', '-i', video]
+        streams += f'[{i}:v:0][{i}:a:0]' if with_audio else f'[{i}:v:0]'
+
+    audio = 1 if with_audio else 0
+    graph = f'{streams}concat=n={len(ranges)}:v=1:a={audio}[vc]'
+    graph += '[a]' if with_audio else ''
+    graph += f';[vc]scale={scale}[v]' if scale else ';[vc]null[v]'
+    cmd += ['-filter_complex', graph, '-map', '[v]']
+    if with_audio:
+        cmd += ['-map', '[a]']
+    return cmd + [output]
+
+
+def render_preview(
+    video: str,
+    ranges: list[tuple[float, float]],
+    output: str,
+    scale: str = '',
+) -> bool:
+    """Render a preview made of time ranges of a video in one ffmpeg run.
+
+    The preview is written to a unique hidden temp file next to ``output``
+    and moved into place once complete, so concurrent renders never clash
+    and the media scan skips files left by a crashed render.
+    """
+    if not ranges:
+        return False
+    folder, filename = os.path.split(output)
+    os.makedirs(folder or '.', exist_ok=True)
+    fd, tmp_output = tempfile.mkstemp(
+        prefix='.tmp_', suffix=os.path.splitext(filename)[1], dir=folder or None
+    )
+    os.close(fd)
+    try:
+        cmd = preview_command(video, ranges, tmp_output, has_audio_stream(video), scale)
+        if subprocess.run(cmd).returncode != 0:
+            return False
+        os.replace(tmp_output, output)
+        return True
+    finally:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+
+
+def sample_ranges(
+    duration: float,
+    count: int,
+    length: float,
+) -> list[tuple[float, float]]:
+    """Pick ``count`` ranges of ``length`` seconds spread evenly over a video."""
+    if duration <= 0:
+        return []
+    if duration <= count * length:
+        return [(0.0, duration)]
+    step = duration / count
+    ranges = []
+    for i in range(count):
+        start = max(0.0, step * (i + 0.5) - length / 2)
+        ranges.append((round(start, 3), round(min(start + length, duration), 3)))
+    return ranges
+
+
+def generate_preview(task: tuple) -> dict | None:
+    """Render the sampled preview of one video (process pool worker).
+
+    ``task`` is ``(video, info, count, length, resolution)`` where ``info``
+    is the cached metadata of the video or None to probe it here.
+    Returns the metadata of the video if the preview was written.
+    """
+    video, info, count, length, resolution = task
+    if info is None:
+        info = probe_media(video)
+    ranges = sample_ranges(info['duration'], count, length)
+    scale = scaled_size(info['width'], info['height'], resolution) if resolution else ''
+    preview = get_media_preview(video, check_exist=False)
+    if not render_preview(video, ranges, preview, scale):
+        raise RuntimeError(f'Preview generation failed for {video}')
+    return info
+
+
+def preview_job(
+    videos: list[str],
+    media_info,
+    failures,
+    count: int = 5,
+    length: float = 2.0,
+    resolution: int = 320,
+    workers: int | None = None,
+):
+    """Create a background job generating previews for videos without one.
+
+    The job is resumable: previews are moved into place only once complete,
+    so a rerun after an interruption skips every finished video. Videos
+    that failed are recorded in ``failures`` and skipped until they change.
+    """
+    tasks = [
+        (video, media_info.get(video), count, length, resolution)
+        for video in videos
+        if not os.path.isfile(get_media_preview(video, check_exist=False))
+        and failures.get(video) is None
+    ]
+
+    def on_result(task, info):
+        media_info.set(task[0], info)
+
+    def on_error(task, error):
+        failures.set(task[0], str(error))
+
+    def on_finish():
+        media_info.save()
+        failures.save()
+
+    return BackgroundJob(
+        'gen_previews',
+        generate_preview,
+        tasks,
+        on_result=on_result,
+        on_error=on_error,
+        on_finish=on_finish,
+        workers=workers,
+    )
+
+
+# Poster frames
+POSTER_SIZE = 480
+
+
+def poster_path(cache_dir: str, video: str) -> str:
+    """Get the cache path of a video's poster frame."""
+    return sharded_path(cache_dir, video, '.jpg')
+
+
+def poster_offset(info: dict | None) -> float:
+    """Pick the time of the poster frame: 10% in, at most 10 seconds."""
+    if info and info.get('duration', 0) > 0:
+        return round(min(info['duration'] * 0.1, 10.0), 3)
+    return 1.0
+
+
+def short_side_scale(size: int) -> str:
+    """Get an ffmpeg scale filter bringing the short side down to ``size``.
+
+    Both sides stay even, as 4:2:0 encoders require.
+    """
+    return (
+        f"scale='if(gt(iw,ih),-2,trunc(min(iw,{size})/2)*2)'"
+        f":'if(gt(iw,ih),trunc(min(ih,{size})/2)*2,-2)'"
+    )
+
+
+def make_poster(video: str, dest: str, offset: float = 1.0) -> str:
+    """Extract one frame of a video as a JPEG whose short side is POSTER_SIZE.
+
+    Falls back to the first frame when the video is shorter than ``offset``.
+    """
+    scale = short_side_scale(POSTER_SIZE)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp_dest = (
+        f'{os.path.splitext(dest)[0]}.{os.getpid()}.{threading.get_ident()}.tmp.jpg'
+    )
+    try:
+        for seek in dict.fromkeys([offset, 0.0]):
+            cmd = [
+                'ffmpeg', '-v', 'error', '-y', '-ss', f'{seek:.3f}', '-i', video,
+                '-frames:v', '1', '-vf', scale, '-q:v', '4', tmp_dest,
+            ]
+            if (
+                subprocess.run(cmd).returncode == 0
+                and os.path.isfile(tmp_dest)
+                and os.path.getsize(tmp_dest) > 0
+            ):
+                os.replace(tmp_dest, dest)
+                return dest
+        raise RuntimeError(f'No frame could be extracted from {video}')
+    finally:
+        if os.path.exists(tmp_dest):
+            os.remove(tmp_dest)
+
+
+def generate_poster(task: tuple) -> str:
+    """Extract the poster frame of one video (process pool worker)."""
+    video, dest, offset = task
+    return make_poster(video, dest, offset)
+
+
+def poster_job(
+    videos: list[str],
+    cache_dir: str,
+    media_info,
+    workers: int | None = None,
+):
+    """Create a background job extracting missing poster frames."""
+    tasks = []
+    for video in videos:
+        try:
+            dest = poster_path(cache_dir, video)
+        except OSError:
+            continue
+        if not os.path.isfile(dest):
+            tasks.append((video, dest, poster_offset(media_info.get(video))))
+    return BackgroundJob('posters', generate_poster, tasks, workers=workers)
+
+
+# Video twins of animated GIFs
+GIF_TWIN_FORMATS = {
+    'mp4': ('.mp4', ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23',
+                     '-movflags', '+faststart']),
+    'webm': ('.webm', ['-c:v', 'libvpx-vp9', '-crf', '35', '-b:v', '0',
+                       '-row-mt', '1']),
+}
+
+
+def gif_twin_path(cache_dir: str, gif: str, fmt: str = 'mp4') -> str:
+    """Get the cache path of the video twin of a GIF."""
+    return sharded_path(cache_dir, gif, GIF_TWIN_FORMATS[fmt][0])
+
+
+def make_gif_twin(gif: str, dest: str, fmt: str = 'mp4') -> str | None:
+    """Transcode an animated GIF to a silent looping video.
+
+    Returns None, writing nothing, for GIFs with a single frame.
+    """
+    with Image.open(gif) as img:
+        if not getattr(img, 'is_animated', False):
+            return None
+
+    extension, codec_args = GIF_TWIN_FORMATS[fmt]
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    base = os.path.splitext(dest)[0]
+    tmp_dest = f'{base}.{os.getpid()}.{threading.get_ident()}.tmp{extension}'
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y', '-i', gif, '-an',
+        # 4:2:0 video needs even dimensions
+        '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', '-pix_fmt', 'yuv420p',
+        *codec_args, tmp_dest,
+    ]
+    try:
+        if subprocess.run(cmd).returncode != 0 or not os.path.isfile(tmp_dest):
+            raise RuntimeError(f'ffmpeg failed to transcode {gif}')
+        os.replace(tmp_dest, dest)
+        return dest
+    finally:
+        if os.path.exists(tmp_dest):
+            os.remove(tmp_dest)
+
+
+def generate_gif_twin(task: tuple) -> str | None:
+    """Transcode one GIF (process pool worker)."""
+    gif, dest, fmt = task
+    return make_gif_twin(gif, dest, fmt)
+
+
+def gif_twin_job(
+    gifs: list[str],
+    cache_dir: str,
+    twins,
+    fmt: str = 'mp4',
+    workers: int | None = None,
+):
+    """Create a background job transcoding GIFs without a known video twin.
+
+    ``twins`` caches each GIF's twin path, or '' for still GIFs, so a GIF is
+    only looked at again once it changes.
+    """
+    if fmt not in GIF_TWIN_FORMATS:
+        raise ValueError(f'Unknown video format: {fmt}')
+
+    tasks = []
+    for gif in gifs:
+        if not gif.lower().endswith('.gif'):
+            continue
+        twin = twins.get(gif)
+        if twin == '' or (twin and os.path.isfile(twin)):
+            continue
+        try:
+            tasks.append((gif, gif_twin_path(cache_dir, gif, fmt), fmt))
+        except OSError:
+            continue
+
+    return BackgroundJob(
+        'gif_videos', generate_gif_twin, tasks,
+        on_result=lambda task, twin: twins.set(task[0], twin or ''),
+        on_finish=twins.save, workers=workers,
+    )
+
+
+# Low-resolution proxies
+# (short side, video kbps) of each proxy rendered per video
+PROXY_LADDER = ((360, 800), (720, 2500))
+
+
+def proxy_path(cache_dir: str, video: str, height: int) -> str:
+    """Get the cache path of a video's proxy, keyed by source path and mtime."""
+    return sharded_path(os.path.join(cache_dir, str(height)), video, '.mp4')
+
+
+def proxy_rungs(info: dict | None, ladder=PROXY_LADDER) -> list[tuple[int, int]]:
+    """Get the rungs of a ladder smaller than the video, all if its size is unknown."""
+    short_side = min(info['width'], info['height']) if info and info.get('width') else 0
+    return [
+        (int(height), int(kbps)) for height, kbps in ladder
+        if not short_side or height < short_side
+    ]
+
+
+def make_proxy(video: str, dest: str, height: int, kbps: int) -> str:
+    """Render an H.264/AAC proxy whose short side is ``height`` pixels."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    base = os.path.splitext(dest)[0]
+    tmp_dest = f'{base}.{os.getpid()}.{threading.get_ident()}.tmp.mp4'
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y', '-i', video,
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-vf', short_side_scale(height), '-pix_fmt', 'yuv420p',
+        '-c:v', 'libx264', '-preset', 'veryfast',
+        '-b:v', f'{kbps}k', '-maxrate', f'{kbps * 3 // 2}k', '-bufsize', f'{kbps * 2}k',
+        '-c:a', 'aac', '-b:a', '128k', '-ac', '2',
+        '-movflags', '+faststart', tmp_dest,
+    ]
+    try:
+        if subprocess.run(cmd).returncode != 0 or not os.path.isfile(tmp_dest):
+            raise RuntimeError(f'ffmpeg failed to render {height}p proxy of {video}')
+        os.replace(tmp_dest, dest)
+        return dest
+    finally:
+        if os.path.exists(tmp_dest):
+            os.remove(tmp_dest)
+
+
+def generate_proxy(task: tuple) -> str:
+    """Render one proxy (process pool worker)."""
+    return make_proxy(*task)
+
+
+def proxy_job(
+    videos: list[str],
+    cache_dir: str,
+    media_info,
+    ladder=PROXY_LADDER,
+    workers: int | None = None,
+):
+    """Create a background job rendering the missing proxies of videos."""
+    tasks = []
+    for video in videos:
+        for height, kbps in proxy_rungs(media_info.get(video), ladder):
+            try:
+                dest = proxy_path(cache_dir, video, height)
+            except OSError:
+                break
+            if not os.path.isfile(dest):
+                tasks.append((video, dest, height, kbps))
+    return BackgroundJob('proxies', generate_proxy, tasks, workers=workers)
+
+
+def choose_proxy(
+    proxies: list[tuple[int, int, str]],
+    requested: str,
+    info: dict | None = None,
+    downlink_kbps: float | None = None,
+    save_data: bool = False,
+) -> str | None:
+    """Pick which of the rendered ``(height, kbps, path)`` proxies to play.
+
+    ``requested`` is a proxy height, which gets the largest proxy at most
+    that tall unless the original is no taller, or ``auto``, which picks
+    from client hints: the smallest proxy to save data, else the largest
+    one fitting in the downlink when the original doesn't. None means the
+    original should be played.
+    """
+    if not proxies:
+        return None
+    proxies = sorted(proxies)
+    if requested != 'auto':
+        try:
+            height = int(requested)
+        except ValueError:
+            return None
+        if info and info.get('width') and height >= min(info['width'], info['height']):
+            return None
+        fitting = [p for p in proxies if p[0] <= height]
+        return fitting[-1][2] if fitting else proxies[0][2]
+
+    if save_data:
+        return proxies[0][2]
+    source_kbps = (info or {}).get('bit_rate', 0) / 1000
+    if not downlink_kbps or not source_kbps or source_kbps <= downlink_kbps * 0.8:
+        return None
+    fitting = [p for p in proxies if p[1] <= downlink_kbps * 0.8]
+    return fitting[-1][2] if fitting else proxies[0][2]
+
+
+# HLS streaming
+HLS_SEGMENT_TARGET = 6.0
+
+# Codecs HLS players accept in MPEG-TS, so segments can be stream copied
+HLS_COPY_VIDEO_CODECS = ('h264', 'hevc')
+HLS_COPY_AUDIO_CODECS = ('aac', 'mp3')
+
+
+def hls_segments(
+    keyframes: list[float],
+    duration: float,
+    target: float = HLS_SEGMENT_TARGET,
+) -> list[tuple[float, float]]:
+    """Split a video into ``(start, duration)`` segments starting on keyframes.
+
+    Each segment runs from a keyframe to the first keyframe at least
+    ``target`` seconds later, so it can be cut by stream copy. A tail
+    shorter than half the target is merged into the last segment.
+    """
+    if duration <= 0:
+        return []
+    starts = [0.0]
+    for t in keyframes:
+        if t - starts[-1] >= target and duration - t >= target / 2:
+            starts.append(t)
+    ends = starts[1:] + [duration]
+    return [
+        (start, round(end - start, 3))
+        for start, end in zip(starts, ends, strict=True)
+    ]
+
+
+def hls_playlist(segments: list[tuple[float, float]], segment_url: str) -> str:
+    """Build a VOD playlist; ``segment_url`` is formatted with each index."""
+    target = max((d for _, d in segments), default=HLS_SEGMENT_TARGET)
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        f'#EXT-X-TARGETDURATION:{int(target + 0.999)}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+    ]
+    for index, (_, duration) in enumerate(segments):
+        lines.append(f'#EXTINF:{duration:.3f},')
+        lines.append(segment_url.format(index))
+    lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def hls_can_copy(info: dict | None) -> bool:
+    """Check if a video's streams can be copied into HLS segments as they are."""
+    if not info or info.get('codec') not in HLS_COPY_VIDEO_CODECS:
+        return False
+    return all(
+        s['codec'] in HLS_COPY_AUDIO_CODECS
+        for s in info.get('streams', []) if s.get('type') == 'audio'
+    )
+
+
+def hls_segment_path(cache_dir: str, video: str, index: int) -> str:
+    """Get the cache path of one HLS segment of a video."""
+    return sharded_path(cache_dir, video, f'_{index}.ts')
+
+
+def make_hls_segment(
+    video: str,
+    dest: str,
+    start: float,
+    duration: float,
+    copy: bool = True,
+) -> str:
+    """Cut one MPEG-TS segment, by stream copy or by re-encoding to H.264/AAC.
+
+    Source timestamps are kept so consecutive segments play seamlessly.
+    """
+    codec_args = (
+        ['-c', 'copy'] if copy else [
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23',
+            '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '128k', '-ac', '2',
+        ]
+    )
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    base = os.path.splitext(dest)[0]
+    tmp_dest = f'{base}.{os.getpid()}.{threading.get_ident()}.tmp.ts'
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y',
+        # Exact keyframe time, so the input seek doesn't land on the previous one
+        '-ss', f'{start:.6f}', '-i', video, '-t', f'{duration:.3f}',
+        '-map', '0:v:0', '-map', '0:a:0?', *codec_args,
+        '-copyts', '-muxdelay', '0', '-f', 'mpegts', tmp_dest,
+    ]
+    try:
+        if subprocess.run(cmd).returncode != 0 or not os.path.isfile(tmp_dest):
+            raise RuntimeError(f'ffmpeg failed to cut segment at {start}s of {video}')
+        os.replace(tmp_dest, dest)
+        return dest
+    finally:
+        if os.path.exists(tmp_dest):
+            os.remove(tmp_dest)
+
+
+# Faststart MP4s
+FASTSTART_EXTS = ('.mp4', '.m4v', '.mov')
+
+
+def read_mp4_boxes(path: str) -> list[tuple[str, int, int]]:
+    """List the top-level boxes of an MP4 as ``(type, offset, size)``.
+
+    Only the 8 or 16 byte box headers are read, seeking over box bodies.
+    """
+    boxes = []
+    file_size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            size, kind = struct.unpack('>I4s', f.read(8))
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+            elif size == 0:
+                size = file_size - offset
+            if size < 8:
+                break
+            boxes.append((kind.decode('latin-1'), offset, size))
+            offset += size
+    return boxes
+
+
+def scan_faststart(path: str) -> dict:
+    """Check whether an MP4 has its ``moov`` box before its media data.
+
+    ``faststart`` is None when the file has no ``moov`` or ``mdat`` box.
+    ``first_frame_bytes`` is how much of the file a progressive download
+    needs before playback can start: everything up to the end of ``moov``.
+    """
+    boxes = {
+        kind: (offset, size)
+        for kind, offset, size in reversed(read_mp4_boxes(path))
+    }
+    if 'moov' not in boxes or 'mdat' not in boxes:
+        return {'faststart': None, 'first_frame_bytes': 0}
+    moov_offset, moov_size = boxes['moov']
+    return {
+        'faststart': moov_offset < boxes['mdat'][0],
+        'first_frame_bytes': moov_offset + moov_size,
+    }
+
+
+def faststart_scan_job(videos: list[str], cache, workers: int | None = None):
+    """Create a background job scanning MP4s missing from the faststart cache."""
+    missing = [
+        v for v in videos if v.lower().endswith(FASTSTART_EXTS) and cache.get(v) is None
+    ]
+    return BackgroundJob(
+        'faststart_scan', scan_faststart, missing,
+        on_result=cache.set, on_finish=cache.save,
+        # Reads a few bytes per file, threads are enough
+        workers=workers or 8, processes=False, report_every=1000,
+    )
+
+
+def remux_faststart(video: str) -> dict:
+    """Move the ``moov`` box of an MP4 to the front by remuxing without re-encoding.
+
+    The new file replaces the original once complete and keeps its mtime.
+    Returns the scan results before and after.
+    """
+    before = scan_faststart(video)
+    st = os.stat(video)
+    base, extension = os.path.splitext(video)
+    tmp_dest = f'{base}.{os.getpid()}.{threading.get_ident()}.tmp{extension}'
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y', '-i', video,
+        '-map', '0', '-c', 'copy', '-movflags', '+faststart', tmp_dest,
+    ]
+    try:
+        if subprocess.run(cmd).returncode != 0 or not os.path.isfile(tmp_dest):
+            raise RuntimeError(f'ffmpeg failed to remux {video}')
+        after = scan_faststart(tmp_dest)
+        if not after['faststart']:
+            raise RuntimeError(f'Remuxed {video} is still not faststart')
+        os.utime(tmp_dest, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_dest, video)
+    finally:
+        if os.path.exists(tmp_dest):
+            os.remove(tmp_dest)
+    return {'before': before, 'after': after}
+
+
+def faststart_job(
+    videos: list[str],
+    cache,
+    bandwidth_mbps: float = 50.0,
+    workers: int | None = None,
+):
+    """Create a background job remuxing MP4s scanned as not faststart.
+
+    The job's stats report the bytes browsers no longer need to fetch before
+    the first frame, and the time that saves at ``bandwidth_mbps``.
+    """
+    tasks = [v for v in videos if (cache.get(v) or {}).get('faststart') is False]
+    job = None
+
+    def on_result(video, result):
+        cache.set(video, result['after'])
+        before, after = result['before'], result['after']
+        saved = before['first_frame_bytes'] - after['first_frame_bytes']
+        job.stats['first_frame_bytes_saved'] += saved
+        job.stats['first_frame_seconds_saved'] = round(
+            job.stats['first_frame_bytes_saved'] * 8 / (bandwidth_mbps * 1e6), 1
+        )
+
+    job = BackgroundJob(
+        'faststart', remux_faststart, tasks,
+        on_result=on_result, on_finish=cache.save, workers=workers, report_every=10,
+    )
+    job.stats.update(first_frame_bytes_saved=0, first_frame_seconds_saved=0.0)
+    return job
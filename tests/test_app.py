@@ -1,10 +1,15 @@
 """Tests for Flask app routes."""
+import gzip
+import importlib
 import json
+import os
+import threading
 from unittest.mock import patch
 
 import pytest
 
 from src.media_server.app import app
+from src.media_server.cache import FileCache
 
 
 @pytest.fixture
@@ -198,6 +203,16 @@ class TestSettingsRoute:
             assert response.status_code in [200, 302, 404, 500]
 
 
+class TestPerfRoute:
+    """Test the grid measurement page."""
+    
+    def test_perf_page(self, client):
+        """Test the page loads a grid page in a frame to measure it."""
+        response = client.get("/perf")
+        assert response.status_code == 200
+        assert b'<iframe id="frame">' in response.data
+
+
 class TestStaticRoute:
     """Test serving static files."""
     
@@ -260,3 +275,820 @@ class TestResponseFormats:
             
             # POST to file operations may redirect or return error
             assert response.status_code in [302, 200, 404, 415, 500]
+
+
+class TestJobsRoute:
+    """Test background job routes."""
+    
+    def test_jobs_status(self, client):
+        """Test job status list is JSON."""
+        response = client.get("/jobs")
+        assert response.status_code == 200
+        assert isinstance(response.get_json(), list)
+    
+    def test_unknown_job(self, client):
+        """Test starting an unknown job fails."""
+        response = client.post("/jobs/unknown", json={})
+        assert response.get_json()['success'] is False
+    
+    def test_convert_images_unknown_format(self, client):
+        """Test converting images to an unknown format fails."""
+        response = client.post("/jobs/convert_images", json={'format': 'bmp'})
+        assert response.get_json()['success'] is False
+
+
+class TestGenClipsRoute:
+    """Test clip generation reuses rendered outputs."""
+    
+    def test_gen_clips_twice_renders_once(self, client, tmp_path, monkeypatch):
+        """Test regenerating unchanged clips doesn't run ffmpeg again."""
+        app_module = importlib.import_module("src.media_server.app")
+        
+        media_dir = tmp_path / "media"
+        (media_dir / "video.mp4").write_bytes(b"video")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(media_dir))
+        monkeypatch.setattr(
+            app_module.STATE, 'clip_outputs', FileCache(tmp_path / "clip_outputs.pkl")
+        )
+        
+        def fake_render(video, start, stop, output, *args, **kwargs):
+            with open(output, 'wb') as f:
+                f.write(b"clip")
+            return True
+        
+        body = {"clips": [{"start": 1, "stop": 2}], "resolution": 1,
+                "cut_mode": "reencode", "gen_preview": False}
+        with patch(
+            "src.media_server.app.render_clip", side_effect=fake_render
+        ) as mock_render:
+            client.post("/gen_clips?video=/media/video.mp4", json=body)
+            client.post("/gen_clips?video=/media/video.mp4", json=body)
+            body["clips"].append({"start": 3, "stop": 4})
+            response = client.post("/gen_clips?video=/media/video.mp4", json=body)
+        
+        assert response.get_json()["status"] == "success"
+        assert mock_render.call_count == 2
+        assert (media_dir / "video_3_4.mp4").exists()
+
+    def test_gen_clips_removes_superseded(self, client, tmp_path, monkeypatch):
+        """Test clips dropped from the clip list are deleted, the preview kept."""
+        app_module = importlib.import_module("src.media_server.app")
+
+        media_dir = tmp_path / "media"
+        video = media_dir / "video.mp4"
+        video.write_bytes(b"video")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(media_dir))
+        clip_outputs = FileCache(tmp_path / "clip_outputs.pkl")
+        monkeypatch.setattr(app_module.STATE, 'clip_outputs', clip_outputs)
+
+        def fake_render(video, start, stop, output, *args, **kwargs):
+            with open(output, 'wb') as f:
+                f.write(b"clip")
+            return True
+
+        def fake_preview(video, ranges, output, scale):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, 'wb') as f:
+                f.write(b"preview")
+            return True
+
+        def post(start, **options):
+            body = {"clips": [{"start": start, "stop": start + 1}],
+                    "resolution": 1, "cut_mode": "reencode", **options}
+            return client.post("/gen_clips?video=/media/video.mp4", json=body)
+
+        with patch("src.media_server.app.render_clip", side_effect=fake_render), \
+             patch("src.media_server.app.render_preview", side_effect=fake_preview):
+            post(1)
+            post(1, gen_preview=True)
+            response = post(3)
+
+        assert response.get_json()["status"] == "success"
+        assert not (media_dir / "video_1_2.mp4").exists()
+        assert (media_dir / "video_3_4.mp4").exists()
+        preview = media_dir / "previews" / "video preview.mp4"
+        assert preview.exists()
+        assert set(clip_outputs.get(str(video))) == {
+            str(media_dir / "video_3_4.mp4"), str(preview).replace('\\', '/')
+        }
+
+    def test_concurrent_gen_clips_keep_outputs(self, client, tmp_path, monkeypatch):
+        """Test clips rendered by overlapping requests are all recorded."""
+        app_module = importlib.import_module("src.media_server.app")
+
+        media_dir = tmp_path / "media"
+        video = media_dir / "video.mp4"
+        video.write_bytes(b"video")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(media_dir))
+        clip_outputs = FileCache(tmp_path / "clip_outputs.pkl")
+        monkeypatch.setattr(app_module.STATE, 'clip_outputs', clip_outputs)
+        both_rendering = threading.Barrier(2, timeout=5)
+
+        def fake_render(video, start, stop, output, *args, **kwargs):
+            both_rendering.wait()
+            with open(output, 'wb') as f:
+                f.write(b"clip")
+            return True
+
+        def post(start):
+            body = {"clips": [{"start": start, "stop": start + 1}],
+                    "resolution": 1, "cut_mode": "reencode"}
+            with app.test_client() as other:
+                other.post("/gen_clips?video=/media/video.mp4", json=body)
+
+        with patch("src.media_server.app.render_clip", side_effect=fake_render):
+            threads = [threading.Thread(target=post, args=(s,)) for s in (1, 3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+
+        saved = FileCache(tmp_path / "clip_outputs.pkl").get(str(video))
+        assert set(saved) == {
+            str(media_dir / "video_1_2.mp4"), str(media_dir / "video_3_4.mp4")
+        }
+    
+    def test_gen_preview_publishes_tile(self, client, tmp_path, monkeypatch):
+        """Test a new preview changes the state version and updates the tile."""
+        app_module = importlib.import_module("src.media_server.app")
+        
+        media_dir = tmp_path / "media"
+        (media_dir / "video.mp4").write_bytes(b"video")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(media_dir))
+        monkeypatch.setattr(
+            app_module.STATE, 'clip_outputs', FileCache(tmp_path / "clip_outputs.pkl")
+        )
+        published = []
+        monkeypatch.setattr(app_module, 'publish_changes', published.append)
+        
+        def fake_preview(video, ranges, output, scale):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            with open(output, 'wb') as f:
+                f.write(b"preview")
+            return True
+        
+        body = {"clips": [{"start": 1, "stop": 2}], "resolution": 1,
+                "gen_preview": True}
+        with patch("src.media_server.app.render_preview", side_effect=fake_preview):
+            response = client.post("/gen_clips?video=/media/video.mp4", json=body)
+        
+        assert response.get_json()["status"] == "success"
+        [change] = published[-1]['updated']
+        assert change['old'] == "/media/video.mp4"
+        assert change['item']['preview'] == "/media/previews/video preview.mp4"
+
+
+class TestMediaMetadataRoute:
+    """Test metadata routes only probe files in the media folder."""
+
+    def test_keyframes_stays_in_media(self, client, tmp_path, monkeypatch):
+        """Test keyframes are served for media files and 404 elsewhere."""
+        app_module = importlib.import_module("src.media_server.app")
+        media_dir = tmp_path / "media"
+        (media_dir / "v.mp4").write_bytes(b"video")
+        (tmp_path / "outside.mp4").write_bytes(b"video")
+        keyframes = FileCache(tmp_path / "keyframes.pkl")
+        keyframes.set(str(media_dir / "v.mp4"), [0.0, 2.5])
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(media_dir))
+        monkeypatch.setattr(app_module.STATE, 'keyframes', keyframes)
+
+        assert client.get("/keyframes?video=/media/v.mp4").get_json() == [0.0, 2.5]
+        with patch("src.media_server.app.get_keyframes") as probe:
+            for video in ("/media/../outside.mp4", str(tmp_path / "outside.mp4"),
+                          "/media/missing.mp4"):
+                response = client.get("/keyframes", query_string={'video': video})
+                assert response.status_code == 404
+        probe.assert_not_called()
+
+    def test_media_info_stays_in_media(self, client, tmp_path, monkeypatch):
+        """Test metadata is served for media files and 404 elsewhere."""
+        app_module = importlib.import_module("src.media_server.app")
+        media_dir = tmp_path / "media"
+        (media_dir / "v.mp4").write_bytes(b"video")
+        (tmp_path / "outside.mp4").write_bytes(b"video")
+        media_info = FileCache(tmp_path / "media_info.pkl")
+        media_info.set(str(media_dir / "v.mp4"), {'duration': 3.0})
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(media_dir))
+        monkeypatch.setattr(app_module.STATE, 'media_info', media_info)
+
+        response = client.get("/media_info?path=/media/v.mp4")
+        assert response.get_json() == {'duration': 3.0}
+        with patch("src.media_server.app.get_media_info") as probe:
+            for path in ("/media/../outside.mp4", str(tmp_path / "outside.mp4"),
+                         "/media/missing.mp4"):
+                response = client.get("/media_info", query_string={'path': path})
+                assert response.status_code == 404
+        probe.assert_not_called()
+        assert media_info.paths() == [str(media_dir / "v.mp4")]
+
+
+class TestThumbnailRoute:
+    """Test image thumbnail route."""
+    
+    def test_thumb_filter(self):
+        """Test thumbnail URLs are only made for images."""
+        from src.media_server.app import thumb_url
+        
+        assert thumb_url("/media/a/photo.jpg", 240) == "/thumb/240/a/photo.jpg"
+        assert thumb_url("/media/a b/é.png", 480) == "/thumb/480/a%20b/%C3%A9.png"
+        assert thumb_url("/media/a/anim.gif") == "/thumb/480/a/anim.gif"
+        assert thumb_url("/media/a/video.mp4") == "/media/a/video.mp4"
+    
+    def test_media_size_filter(self, tmp_path, monkeypatch):
+        """Test indexed sizes of images and videos."""
+        app_module = importlib.import_module("src.media_server.app")
+        (tmp_path / "a.jpg").write_bytes(b"jpg")
+        (tmp_path / "v.mp4").write_bytes(b"mp4")
+        image_meta = FileCache(tmp_path / "image_meta.pkl")
+        image_meta.set(str(tmp_path / "a.jpg"), {'width': 40, 'height': 30})
+        media_info = FileCache(tmp_path / "media_info.pkl")
+        media_info.set(str(tmp_path / "v.mp4"), {'width': 1920, 'height': 1080})
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(tmp_path))
+        monkeypatch.setattr(app_module.STATE, 'image_meta', image_meta)
+        monkeypatch.setattr(app_module.STATE, 'media_info', media_info)
+        
+        assert app_module.media_size("/media/a.jpg") == (40, 30)
+        assert app_module.media_size("/media/v.mp4") == (1920, 1080)
+        assert app_module.media_size("/media/missing.png") is None
+        assert app_module.media_size("/media/../a.jpg") is None
+    
+    def test_gif_video(self, client, tmp_path, monkeypatch):
+        """Test GIFs with a video twin are served as video."""
+        app_module = importlib.import_module("src.media_server.app")
+        (tmp_path / "a b.gif").write_bytes(b"GIF89a")
+        (tmp_path / "still.gif").write_bytes(b"GIF89a")
+        twin = tmp_path / "twin.mp4"
+        twin.write_bytes(b"mp4")
+        twins = FileCache(tmp_path / "gif_twins.pkl")
+        twins.set(str(tmp_path / "a b.gif"), str(twin))
+        twins.set(str(tmp_path / "still.gif"), '')
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(tmp_path))
+        monkeypatch.setattr(app_module.STATE, 'gif_twins', twins)
+        
+        assert app_module.gif_video_url("/media/a b.gif") == "/gif_video/a%20b.gif"
+        assert app_module.gif_video_url("/media/still.gif") == ""
+        assert app_module.gif_video_url("/media/a.png") == ""
+        
+        response = client.get("/gif_video/a b.gif")
+        assert response.data == b"mp4"
+        assert response.mimetype == "video/mp4"
+        assert client.get("/gif_video/still.gif").data == b"GIF89a"
+    
+    def test_media_proxy(self, client, tmp_path, monkeypatch):
+        """Test videos are served from a proxy when asked for one."""
+        app_module = importlib.import_module("src.media_server.app")
+        video = tmp_path / "v.mp4"
+        video.write_bytes(b"original")
+        proxies_dir = str(tmp_path / "proxies")
+        proxy = app_module.proxy_path(proxies_dir, str(video), 360)
+        os.makedirs(os.path.dirname(proxy))
+        with open(proxy, 'wb') as f:
+            f.write(b"proxy")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(tmp_path))
+        monkeypatch.setattr(app_module, 'PROXIES_DIR', proxies_dir)
+        monkeypatch.setattr(app_module, 'PROXY_LADDER', [(360, 800)])
+        monkeypatch.setattr(
+            app_module.STATE, 'media_info', FileCache(tmp_path / "i.pkl")
+        )
+        
+        assert client.get("/media/v.mp4").data == b"original"
+        assert client.get("/media/v.mp4?proxy=720").data == b"proxy"
+        assert client.get("/media/v.mp4?proxy=auto").data == b"original"
+        response = client.get("/media/v.mp4?proxy=auto", headers={'Save-Data': 'on'})
+        assert response.data == b"proxy"
+        assert 'Save-Data' in response.headers['Vary']
+    
+    def test_hls(self, client, tmp_path, monkeypatch):
+        """Test HLS playlist and cached segments of a video."""
+        app_module = importlib.import_module("src.media_server.app")
+        video = tmp_path / "v.mp4"
+        video.write_bytes(b"video")
+        keyframes = FileCache(tmp_path / "keyframes.pkl")
+        keyframes.set(str(video), [0.0, 6.0, 12.0])
+        media_info = FileCache(tmp_path / "media_info.pkl")
+        media_info.set(str(video), {'duration': 15.0, 'codec': 'h264', 'streams': []})
+        hls_dir = str(tmp_path / "hls")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(tmp_path))
+        monkeypatch.setattr(app_module.STATE, 'keyframes', keyframes)
+        monkeypatch.setattr(app_module.STATE, 'media_info', media_info)
+        monkeypatch.setattr(app_module, 'HLS_DIR', hls_dir)
+        monkeypatch.setattr(
+            app_module, 'HLS_SEGMENTS', app_module.LRUDiskCache(hls_dir, 1024)
+        )
+        cuts = []
+        
+        def fake_segment(video, dest, start, duration, copy):
+            cuts.append((start, duration, copy))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, 'wb') as f:
+                f.write(b"ts")
+            return dest
+        
+        monkeypatch.setattr(app_module, 'make_hls_segment', fake_segment)
+        
+        response = client.get("/hls/v.mp4/index.m3u8")
+        assert response.mimetype == 'application/vnd.apple.mpegurl'
+        assert response.get_data(as_text=True).count('.ts') == 3
+        
+        assert client.get("/hls/v.mp4/1.ts").data == b"ts"
+        assert client.get("/hls/v.mp4/1.ts").data == b"ts"
+        assert cuts == [(6.0, 6.0, True)]
+        assert client.get("/hls/v.mp4/3.ts").status_code == 404
+        assert client.get("/hls/missing.mp4/index.m3u8").status_code == 404
+    
+    def test_poster_filter(self):
+        """Test poster URL of a video."""
+        from src.media_server.app import poster_url
+        
+        assert poster_url("/media/a b/v.mp4") == "/poster/a%20b/v.mp4"
+        assert poster_url("") == ""
+    
+    def test_thumb_route(self, client, tmp_path, monkeypatch):
+        """Test a thumbnail is generated and served."""
+        from PIL import Image
+        app_module = importlib.import_module("src.media_server.app")
+        
+        media_dir = tmp_path / "media"
+        Image.new("RGB", (1000, 800)).save(media_dir / "photo.jpg")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(media_dir))
+        monkeypatch.setattr(
+            app_module, 'THUMBNAILER', app_module.Thumbnailer(tmp_path / "thumbs")
+        )
+        
+        response = client.get("/thumb/200/photo.jpg")
+        assert response.status_code == 200
+        assert response.mimetype == "image/webp"
+        assert len(response.data) < (media_dir / "photo.jpg").stat().st_size
+        
+        assert client.get("/thumb/240/missing.jpg").status_code == 404
+        assert client.get("/thumb/240/../secret.jpg").status_code == 404
+
+
+class TestOffload:
+    """Test media routes hand files to the front proxy when offloading."""
+    
+    @pytest.fixture
+    def offload(self, tmp_path, monkeypatch):
+        app_module = importlib.import_module("src.media_server.app")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(tmp_path))
+        monkeypatch.setattr(app_module, 'OFFLOAD', 'x-accel')
+        monkeypatch.setattr(
+            app_module, 'OFFLOAD_LOCATIONS', {str(tmp_path): '/_media/'}
+        )
+        return app_module
+    
+    def test_media_and_previews(self, client, tmp_path, offload):
+        """Test media and previews are offloaded."""
+        (tmp_path / "previews").mkdir()
+        (tmp_path / "v.mp4").write_bytes(b"video")
+        (tmp_path / "previews" / "v preview.mp4").write_bytes(b"preview")
+        
+        response = client.get("/media/v.mp4")
+        assert response.headers['X-Accel-Redirect'] == '/_media/v.mp4'
+        assert response.mimetype == 'video/mp4'
+        assert response.data == b''
+        response = client.get("/media/previews/v preview.mp4")
+        redirect = response.headers['X-Accel-Redirect']
+        assert redirect == '/_media/previews/v%20preview.mp4'
+        assert client.get("/media/missing.mp4").status_code == 404
+    
+    def test_thumbnails(self, client, tmp_path, offload, monkeypatch):
+        """Test cached thumbnails are offloaded from the cache folder."""
+        (tmp_path / "a.jpg").write_bytes(b"jpg")
+        thumb = tmp_path / ".database" / "thumbs" / "a.webp"
+        monkeypatch.setattr(offload.THUMBNAILER, 'get', lambda source, size: str(thumb))
+        
+        response = client.get("/thumb/240/a.jpg")
+        assert response.headers['X-Accel-Redirect'] == '/_media/.database/thumbs/a.webp'
+        assert response.mimetype == 'image/webp'
+    
+    def test_x_sendfile(self, client, tmp_path, offload, monkeypatch):
+        """Test X-Sendfile mode sends the file path."""
+        monkeypatch.setattr(offload, 'OFFLOAD', 'x-sendfile')
+        (tmp_path / "clip_1_2.mp4").write_bytes(b"clip")
+        
+        response = client.get("/media/clip_1_2.mp4")
+        assert response.headers['X-Sendfile'] == str(tmp_path / "clip_1_2.mp4")
+
+
+class TestCaching:
+    """Test asset fingerprints and cache validation of pages and media."""
+    
+    @pytest.fixture
+    def app_module(self, tmp_path, monkeypatch):
+        app_module = importlib.import_module("src.media_server.app")
+        (tmp_path / "assets").mkdir()
+        (tmp_path / "assets" / "index.js").write_text("let a = 1;")
+        monkeypatch.setattr(app, 'static_folder', str(tmp_path / "assets"))
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(tmp_path))
+        return app_module
+    
+    def test_fingerprinted_assets(self, client, tmp_path, app_module):
+        """Test asset URLs change with their content and are cached forever."""
+        with app.test_request_context():
+            stale_url = app_module.url_for('static', filename='index.js')
+            assert '?v=' in stale_url
+            (tmp_path / "assets" / "index.js").write_text("let a = 2;")
+            os.utime(tmp_path / "assets" / "index.js", ns=(1, 1))
+            url = app_module.url_for('static', filename='index.js')
+            assert url != stale_url
+        
+        response = client.get(url)
+        assert response.cache_control.immutable
+        assert response.cache_control.max_age == app_module.ASSET_MAX_AGE
+        assert not client.get("/assets/index.js").cache_control.immutable
+    
+    def test_stale_fingerprint_revalidated(self, client, tmp_path, app_module):
+        """Test a URL whose hash isn't the asset's current one isn't pinned."""
+        for v in ('0123456789ab', 'made-up', ''):
+            response = client.get("/assets/index.js", query_string={'v': v})
+            assert response.status_code == 200
+            assert not response.cache_control.immutable
+            assert response.cache_control.max_age != app_module.ASSET_MAX_AGE
+    
+    def test_page_not_modified(self, client, tmp_path, app_module, monkeypatch):
+        """Test pages answer 304 until the state changes."""
+        monkeypatch.setattr(app_module.STATE, 'version', 0)
+        response = client.get("/tags")
+        etag = response.headers['ETag']
+        assert response.status_code == 200
+        assert response.cache_control.no_cache
+        
+        response = client.get("/tags", headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        
+        app_module.STATE.bump_version()
+        response = client.get("/tags", headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+    
+    def test_page_etag_hashes_assets_once(self, client, app_module, monkeypatch):
+        """Test pages don't hash the assets folder on every request."""
+        etag = client.get("/tags").headers['ETag']
+        digested = []
+        monkeypatch.setattr(app_module, 'file_digest', digested.append)
+        
+        response = client.get("/tags", headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert digested == []
+    
+    def test_media_max_age(self, client, tmp_path, app_module, monkeypatch):
+        """Test media is sent with the configured max-age and a strong ETag."""
+        monkeypatch.setattr(app_module, 'MEDIA_MAX_AGE', 600)
+        (tmp_path / "a.jpg").write_bytes(b"jpg")
+        
+        response = client.get("/media/a.jpg")
+        assert response.cache_control.max_age == 600
+        assert response.last_modified is not None
+        etag, weak = response.get_etag()
+        assert etag and not weak
+        headers = {'If-None-Match': response.headers['ETag']}
+        assert client.get("/media/a.jpg", headers=headers).status_code == 304
+    
+    def test_compression(self, client, tmp_path, app_module, monkeypatch):
+        """Test pages are gzipped and assets sent from their precompressed copy."""
+        monkeypatch.setattr(app_module, 'COMPRESS_MIN_SIZE', 0)
+        response = client.get("/tags", headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert b'<html' in gzip.decompress(response.data).lower()
+        
+        app_module.precompress_assets(str(tmp_path / "assets"))
+        response = client.get("/assets/index.js", headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.data) == b"let a = 1;"
+        assert client.get("/assets/index.js").data == b"let a = 1;"
+        assert client.get("/assets/missing.js").status_code == 404
+
+
+class TestMediaListApi:
+    """Test the JSON paging API and first-page rendering."""
+    
+    @pytest.fixture
+    def app_module(self, tmp_path, monkeypatch):
+        app_module = importlib.import_module("src.media_server.app")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(tmp_path))
+        monkeypatch.setitem(app_module.PATHS, 'trash_dir', str(tmp_path / "deleted"))
+        monkeypatch.setattr(app_module.STATE, 'all_media_files', [])
+        monkeypatch.setattr(
+            app_module.STATE, 'tags', {"red": {"a.jpg", "c.jpg", "v.mp4"}}
+        )
+        monkeypatch.setattr(app_module.STATE, 'sorted_tags', [("red", "red")])
+        monkeypatch.setattr(app_module.STATE, 'hidden_tags', set())
+        monkeypatch.setattr(app_module, 'PAGE_SIZE', 2)
+        for name in ("a.jpg", "b.jpg", "c.jpg", "v.mp4"):
+            (tmp_path / name).write_bytes(b"media")
+        return app_module
+    
+    def _all_pages(self, client, url):
+        items = []
+        data = client.get(url).get_json()
+        items += data['items']
+        while data['next']:
+            sep = '&' if '?' in url else '?'
+            data = client.get(f"{url}{sep}cursor={data['next']}").get_json()
+            items += data['items']
+        return items, data['total']
+    
+    def test_browse_pages(self, client, app_module):
+        """Test a folder is listed page by page with tile data."""
+        items, total = self._all_pages(client, "/api/browse")
+        
+        assert total == 4
+        assert [item['url'] for item in items] == [
+            '/media/a.jpg', '/media/b.jpg', '/media/c.jpg', '/media/v.mp4'
+        ]
+        assert items[0]['tags'] == ['red']
+        assert items[0]['kind'] == 'image'
+        assert items[0]['srcset'].startswith('/thumb/')
+        assert items[3]['kind'] == 'video'
+        assert items[3]['poster'].startswith('/poster/')
+        assert client.get("/api/browse/missing").status_code == 404
+    
+    def test_tag_and_filter_pages(self, client, app_module):
+        """Test tag and filter listings are paged the same way."""
+        items, total = self._all_pages(client, "/api/tags/red")
+        assert total == 3
+        assert {item['url'] for item in items} == {
+            '/media/a.jpg', '/media/c.jpg', '/media/v.mp4'
+        }
+        
+        items, _ = self._all_pages(client, "/api/filter_media_with_tags?op=or&tags=red")
+        assert len(items) == 3
+        response = client.get("/api/filter_media_with_tags?op=hide&tags=red")
+        assert response.status_code == 400
+        assert client.get("/api/tags/red?cursor=bad").status_code == 400
+    
+    def test_page_renders_first_page(self, client, app_module):
+        """Test pages only render the first page and link the rest."""
+        html = client.get("/").get_data(as_text=True)
+        
+        assert '/media/a.jpg' in html and '/media/b.jpg' in html
+        assert 'data-full="/media/c.jpg"' not in html
+        assert 'var list_api = "/api/browse"' in html
+        assert 'var next_cursor = null' not in html
+        
+        html = client.get("/tags/red").get_data(as_text=True)
+        assert 'var list_api = "/api/tags/red"' in html
+    
+    def test_tagged_listing_reused(self, client, app_module, monkeypatch):
+        """Test tag pages sort their listing once until the state changes."""
+        index = app_module._media_path_index
+        calls = []
+        monkeypatch.setattr(
+            app_module, '_media_path_index', lambda: calls.append(1) or index()
+        )
+        
+        items, total = self._all_pages(client, "/api/tags/red")
+        listing = app_module.tagged_media(app_module.STATE.tags["red"], "red")
+        assert total == 3
+        assert app_module.tagged_media({"c.jpg", "v.mp4", "a.jpg"}, "red") is listing
+        assert len(calls) == 1
+        
+        app_module.STATE.bump_version()
+        assert app_module.tagged_media(app_module.STATE.tags["red"], "red") == listing
+        assert len(calls) == 2
+    
+    def test_prefetch_hint(self, client, app_module, monkeypatch):
+        """Test tag pages suggest their first media, posters for videos."""
+        monkeypatch.setattr(app_module, 'PAGE_SIZE', 10)
+        monkeypatch.setattr(app_module, 'PREFETCH_HINT', 3)
+        response = client.get("/tags/red")
+        
+        assert response.headers['Link'] == (
+            '</media/a.jpg>; rel=prefetch, </media/c.jpg>; rel=prefetch, '
+            '</poster/v.mp4>; rel=prefetch'
+        )
+        assert 'Save-Data' in response.headers['Vary']
+        
+        response = client.get("/tags/red", headers={"Save-Data": "on"})
+        assert 'Link' not in response.headers
+        response = client.get("/tags/red", headers={"Downlink": "0.5"})
+        assert 'Link' not in response.headers
+
+
+class TestMutationChanges:
+    """Test mutation routes return exactly what changed."""
+    
+    @pytest.fixture
+    def app_module(self, tmp_path, monkeypatch):
+        app_module = importlib.import_module("src.media_server.app")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(tmp_path))
+        monkeypatch.setitem(app_module.PATHS, 'trash_dir', str(tmp_path / "deleted"))
+        monkeypatch.setattr(app_module.STATE, 'all_media_files', [])
+        monkeypatch.setattr(
+            app_module.STATE, 'tags', {"red": {"a.jpg"}, "blue": {"b.jpg"}}
+        )
+        monkeypatch.setattr(
+            app_module.STATE, 'sorted_tags', [("blue", "blue"), ("red", "red")]
+        )
+        monkeypatch.setattr(app_module.STATE, 'last_used_tags', [])
+        monkeypatch.setattr(app_module.STATE, 'clips_data', {})
+        monkeypatch.setattr(app_module.STATE, 'medias_in_clipboard', [])
+        monkeypatch.setattr(app_module.STATE, 'save_tags', lambda: None)
+        monkeypatch.setattr(app_module.STATE, 'save_clips', lambda: None)
+        (tmp_path / "deleted").mkdir()
+        (tmp_path / "sub").mkdir()
+        (tmp_path / "a.jpg").write_bytes(b"a")
+        (tmp_path / "b.jpg").write_bytes(b"b")
+        return app_module
+    
+    def test_rename(self, client, tmp_path, app_module):
+        """Test a rename returns the new tile of the renamed media only."""
+        data = client.post(
+            "/rename", json={"path": "/media/a.jpg", "new_name": "c"}
+        ).get_json()
+        
+        assert data['success']
+        [change] = data['changes']['updated']
+        assert change['old'] == '/media/a.jpg'
+        assert change['item']['url'] == '/media/c.jpg'
+        assert change['item']['tags'] == ['red']
+        assert data['changes']['removed'] == []
+    
+    def test_rename_multiple(self, client, tmp_path, app_module):
+        """Test a batch rename returns renamed media and folders."""
+        data = client.post("/rename_multiple", json={
+            "items": ["/media/a.jpg", "/media/b.jpg"],
+            "endpoint": "Home",
+            "new_name": "x_#",
+        }).get_json()
+        
+        assert [c['item']['url'] for c in data['changes']['updated']] == [
+            '/media/x_a.jpg', '/media/x_b.jpg'
+        ]
+        
+        data = client.post("/rename_multiple", json={
+            "items": ["/media/sub"], "endpoint": "Home", "new_name": "sub2",
+        }).get_json()
+        assert data['changes']['folders'] == [{'old': 'sub', 'path': 'sub2'}]
+    
+    def test_paste(self, client, tmp_path, app_module):
+        """Test pasting returns the moved media with their new URLs."""
+        client.post("/cut_multiple", json={"items": ["/media/a.jpg"]})
+        data = client.post("/paste_multiple", json={"destination": "sub"}).get_json()
+        
+        [change] = data['changes']['updated']
+        assert change['old'] == '/media/a.jpg'
+        assert change['item']['url'] == '/media/sub/a.jpg'
+    
+    def test_delete_multiple(self, client, tmp_path, app_module):
+        """Test deleting returns the removed media, or removed tag chips."""
+        data = client.post(
+            "/delete_multiple", json={"items": ["/media/b.jpg"]}
+        ).get_json()
+        assert data['changes']['removed'] == ['/media/b.jpg']
+        
+        data = client.post(
+            "/delete_multiple", json={"items": ["blue"], "endpoint": "Tags"}
+        ).get_json()
+        assert data['changes']['removed_tags'] == ['blue']
+    
+    def test_merge_tags(self, client, tmp_path, app_module):
+        """Test merging tags returns the merged chips and the resulting tag."""
+        data = client.post("/rename_multiple", json={
+            "items": ["red", "blue"], "endpoint": "Tags", "new_name": "red",
+        }).get_json()
+        
+        assert data['changes']['removed_tags'] == ['blue']
+        assert data['changes']['tag']['name'] == 'red'
+        assert data['changes']['tag']['count'] == 2
+    
+    def test_save_tags(self, client, tmp_path, app_module):
+        """Test tagging returns the tagged media with their new tags."""
+        data = client.post(
+            "/save_tags", json={"media": ["/media/b.jpg"], "tags": ["red"]}
+        ).get_json()
+        
+        [change] = data['changes']['updated']
+        assert change['old'] == '/media/b.jpg'
+        assert change['item']['tags'] == ['blue', 'red']
+    
+    def test_changes_published(self, client, tmp_path, app_module):
+        """Test mutations are published to the change feed as sent back."""
+        data = client.post("/delete", json={"path": "/media/a.jpg"}).get_json()
+        
+        event = app_module.STATE.events[-1]
+        assert event['type'] == 'changes'
+        assert event['version'] == app_module.STATE.version
+        assert event['data'] == data['changes']
+
+
+class TestChangeFeed:
+    """Test the /events change feed and what is published to it."""
+    
+    def test_events_poll(self, client, monkeypatch):
+        """Test /events answers the missed events from the app and ends."""
+        app_module = importlib.import_module("src.media_server.app")
+        started = []
+        monkeypatch.setattr(app_module.EVENTS, 'start', lambda: started.append(1))
+        since = app_module.STATE.version
+        app_module.STATE.publish('job', {'name': 'scan_media'})
+        
+        response = client.get(f"/events?since={since}")
+        assert started
+        assert response.mimetype == 'text/event-stream'
+        assert response.cache_control.no_cache
+        assert 'Access-Control-Allow-Origin' not in response.headers
+        body = response.get_data(as_text=True)
+        assert body.startswith(f'retry: {app_module.EVENTS_POLL_MS}\n\n')
+        assert f'id: {app_module.STATE.version}\nevent: job' in body
+        
+        headers = {"Last-Event-ID": str(app_module.STATE.version)}
+        response = client.get(f"/events?since={since}", headers=headers)
+        assert 'event:' not in response.get_data(as_text=True)
+    
+    def test_page_has_version(self, client):
+        """Test pages carry the version the change feed starts from."""
+        app_module = importlib.import_module("src.media_server.app")
+        html = client.get("/tags").get_data(as_text=True)
+        assert f"var state_version = {app_module.STATE.version};" in html
+    
+    def test_scan_media_publishes_new_files(self, tmp_path, monkeypatch):
+        """Test the scan job publishes files added and removed since the catalog."""
+        app_module = importlib.import_module("src.media_server.app")
+        monkeypatch.setitem(app_module.PATHS, 'media_path', str(tmp_path))
+        monkeypatch.setattr(app_module.STATE, 'tags', {})
+        (tmp_path / "new.jpg").write_bytes(b"n")
+        gone = str(tmp_path / "gone.jpg").replace('\\', '/')
+        monkeypatch.setattr(app_module.STATE, 'all_media_files', [gone])
+        
+        job = app_module.JOB_FACTORIES['scan_media']({})
+        job.start()
+        job.join(5)
+        
+        event = app_module.STATE.events[-1]
+        updated = event['data']['updated']
+        assert [c['item']['url'] for c in updated] == ['/media/new.jpg']
+        assert event['data']['updated'][0]['old'] is None
+        assert event['data']['removed'] == ['/media/gone.jpg']
+        assert app_module.STATE.all_media_files == [str(tmp_path / "new.jpg")]
+
+
+class TestTagCatalogApi:
+    """Test the tag catalog deltas and the per-media tag lookup."""
+    
+    @pytest.fixture
+    def app_module(self, monkeypatch):
+        app_module = importlib.import_module("src.media_server.app")
+        monkeypatch.setattr(
+            app_module.STATE, 'tags', {"red": {"a.jpg"}, "blue": {"a.jpg", "b.jpg"}}
+        )
+        monkeypatch.setattr(app_module.STATE, 'sorted_tags', [])
+        app_module.STATE.update_sorted_tags()
+        return app_module
+    
+    def test_catalog_deltas(self, client, app_module):
+        """Test the full list is sent first, then only what changed."""
+        data = client.get("/api/tag_catalog").get_json()
+        assert data['full']
+        assert [tag for tag, _, _ in data['tags']] == ["blue", "red"]
+        
+        app_module.STATE.tags["green"] = {"c.jpg"}
+        app_module.STATE.update_sorted_tags()
+        delta = client.get(f"/api/tag_catalog?since={data['version']}").get_json()
+        assert not delta['full']
+        assert delta['tags'] == [["green", "green", "blue"]]
+        assert delta['removed'] == []
+        
+        assert client.get("/api/tag_catalog?since=x").status_code == 400
+    
+    def test_media_tags(self, client, app_module):
+        """Test the tags of one media are looked up by URL."""
+        data = client.get("/api/media_tags?media=/media/sub/a.jpg").get_json()
+        assert data['tags'] == ["blue", "red"]
+        
+        data = client.post("/get_tags", json={"media": "b.jpg"}).get_json()
+        assert data == [["blue", True], ["red", False]]
+
+
+class TestVideoQuality:
+    """Test the video quality setting offered by the players."""
+    
+    def test_clip_marker_quality_select(self, client):
+        """Test the clip marker loads the player and offers every proxy height."""
+        app_module = importlib.import_module("src.media_server.app")
+        html = client.get(
+            "/video_clip_marker?video=/media/video.mp4"
+        ).get_data(as_text=True)
+        
+        assert 'player.js' in html
+        assert 'setVideoSource(video, videoFile)' in html
+        for height, _ in app_module.PROXY_LADDER:
+            assert f'<option value="{height}">{height}p</option>' in html
+        assert '<option value="hls">' in html
+    
+    def test_hls_js_served_from_assets(self, client, tmp_path, monkeypatch):
+        """Test players load hls.js from the fingerprinted assets, not a CDN."""
+        player = os.path.join(os.path.dirname(__file__), '..', 'assets', 'player.js')
+        with open(player, encoding='utf-8') as f:
+            assert 'https://' not in f.read()
+        assets = tmp_path / "assets"
+        assets.mkdir()
+        (assets / "hls.min.js").write_text("/* hls.js */")
+        monkeypatch.setattr(app, 'static_folder', str(assets))
+        html = client.get(
+            "/video_clip_marker?video=/media/video.mp4"
+        ).get_data(as_text=True)
+        
+        assert 'data-hls-js="/assets/hls.min.js?v=' in html
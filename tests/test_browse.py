@@ -1,10 +1,14 @@
 """Tests for browse module."""
 from pathlib import Path
 
+import pytest
+
 from src.media_server.browse import (
+    describe_media,
     filter_hidden_media,
     get_all_media_files,
     get_all_video_files,
+    page_slice,
     prepare_media_page,
     search_media_files,
 )
@@ -73,6 +77,19 @@ class TestGetAllMediaFiles:
         file_names = [Path(f).name for f in files]
         assert "photo1.jpg" in file_names
         assert "photo2.jpg" in file_names
+    
+    def test_get_all_media_files_skips_hidden(self, tmp_path):
+        """Test temp files of unfinished renders are not cataloged."""
+        static_dir = tmp_path / "static"
+        (static_dir / "previews").mkdir(parents=True)
+        (static_dir / "video.mp4").write_text("video")
+        (static_dir / "previews" / ".tmp_k2j4.mp4").write_text("partial")
+        (static_dir / ".tmp_x8q1").mkdir()
+        (static_dir / ".tmp_x8q1" / "part0.mp4").write_text("part")
+        
+        files = get_all_media_files(str(static_dir), [])
+        
+        assert [Path(f).name for f in files] == ["video.mp4"]
 
 
 class TestGetAllVideoFiles:
@@ -184,6 +201,17 @@ class TestSearchMediaFiles:
         assert len(results) == 0
 
 
+    def test_search_only_under_path(self, tmp_path):
+        """Test a catalog of the parent folder is limited to the searched folder."""
+        (tmp_path / "sub").mkdir()
+        (tmp_path / "cat.jpg").write_text("image")
+        (tmp_path / "sub" / "cat2.jpg").write_text("image")
+        catalog = get_all_media_files(str(tmp_path), [])
+        
+        found = search_media_files(str(tmp_path / "sub"), ["cat"], catalog)
+        assert found == ["cat2.jpg"]
+
+
 class TestFilterHiddenMedia:
     """Test filtering hidden media."""
     
@@ -313,6 +341,30 @@ class TestPrepareMediaPage:
         
         assert page_data is not None
     
+    def test_prepare_media_page_placeholders(self, tmp_path):
+        """Test cached placeholders are returned in media order."""
+        from src.media_server.cache import FileCache
+        static_dir = tmp_path / "static"
+        static_dir.mkdir()
+        (static_dir / "a.jpg").write_text("image")
+        (static_dir / "b.jpg").write_text("image")
+        placeholders = FileCache(tmp_path / "placeholders.pkl")
+        placeholders.set(str(static_dir / "b.jpg"), "data:image/webp;base64,AAAA")
+        
+        page_data = prepare_media_page(
+            str(static_dir),
+            "",
+            [],
+            {},
+            set(),
+            str(static_dir),
+            "files",
+            "browse",
+            placeholders,
+        )
+        
+        assert page_data['placeholders'] == ['', 'data:image/webp;base64,AAAA']
+    
     def test_prepare_media_page_invalid_path(self, tmp_path):
         """Test with invalid directory path."""
         page_data = prepare_media_page(
@@ -327,3 +379,73 @@ class TestPrepareMediaPage:
         )
         
         assert page_data is None
+    
+    def test_prepare_media_page_limit(self, tmp_path):
+        """Test only the first page is described, with a cursor for the rest."""
+        for i in range(5):
+            (tmp_path / f"{i}.jpg").write_text("image")
+        
+        page_data = prepare_media_page(
+            str(tmp_path), "", [], {}, set(), str(tmp_path), "files", "browse", limit=2
+        )
+        
+        assert page_data['media_paths'] == ['/files/0.jpg', '/files/1.jpg']
+        assert len(page_data['media_tags']) == 2
+        assert page_data['next_cursor']
+
+
+class TestPaging:
+    """Test cursor pagination and describing a page of media."""
+    
+    def test_pages_cover_listing(self):
+        """Test following the cursors returns every item once."""
+        items = [f'/m/{i}.jpg' for i in range(7)]
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = page_slice(items, cursor, 3)
+            seen += page
+            if cursor is None:
+                break
+        assert seen == items
+    
+    def test_cursor_survives_changes(self):
+        """Test a page starts after the last item sent when earlier items change."""
+        items = ['/m/a.jpg', '/m/b.jpg', '/m/c.jpg', '/m/d.jpg']
+        page, cursor = page_slice(items, None, 2)
+        assert page == ['/m/a.jpg', '/m/b.jpg']
+        
+        assert page_slice(items[1:], cursor, 2)[0] == ['/m/c.jpg', '/m/d.jpg']
+        page = page_slice(['/m/0.jpg'] + items, cursor, 2)[0]
+        assert page == ['/m/c.jpg', '/m/d.jpg']
+        # The last item sent is gone: fall back to the offset
+        page = page_slice(['/m/a.jpg', '/m/c.jpg', '/m/d.jpg'], cursor, 2)[0]
+        assert page == ['/m/d.jpg']
+    
+    def test_invalid_cursor(self):
+        """Test a malformed cursor raises ValueError."""
+        with pytest.raises(ValueError):
+            page_slice(['/m/a.jpg'], 'not a cursor', 2)
+    
+    def test_describe_media(self, tmp_path):
+        """Test URLs, previews and tags of the given files."""
+        (tmp_path / "previews").mkdir()
+        (tmp_path / "v.mp4").write_text("video")
+        (tmp_path / "previews" / "v preview.mp4").write_text("preview")
+        (tmp_path / "a.jpg").write_text("image")
+        tags = {"nature": {"a.jpg"}, "city": {"a.jpg", "v.mp4"}}
+        
+        data = describe_media(
+            [str(tmp_path / "v.mp4"), str(tmp_path / "a.jpg")],
+            [("city", "city"), ("nature", "nature")],
+            tags,
+            str(tmp_path),
+            "files",
+        )
+        
+        assert data['media_paths'] == ['/files/v.mp4', '/files/a.jpg']
+        assert data['preview_paths'] == [
+            '/files/previews/v preview.mp4', '/files/a.jpg'
+        ]
+        assert data['media_tags'] == [['city'], ['city', 'nature']]
+        assert data['placeholders'] == ['', '']
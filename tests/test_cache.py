@@ -0,0 +1,114 @@
+"""Tests for cache module."""
+import os
+
+from src.media_server.cache import FileCache, LRUDiskCache, file_fingerprint
+
+
+class TestFileFingerprint:
+    """Test file fingerprinting."""
+    
+    def test_fingerprint_existing_file(self, tmp_path):
+        """Test fingerprint holds file size."""
+        f = tmp_path / "video.mp4"
+        f.write_bytes(b"12345")
+        
+        size, mtime = file_fingerprint(str(f))
+        assert size == 5
+        assert mtime > 0
+    
+    def test_fingerprint_missing_file(self, tmp_path):
+        """Test fingerprint of missing file is None."""
+        assert file_fingerprint(str(tmp_path / "missing.mp4")) is None
+
+
+class TestFileCache:
+    """Test fingerprint-keyed file cache."""
+    
+    def test_get_set(self, tmp_path):
+        """Test cached value is returned for unchanged file."""
+        f = tmp_path / "video.mp4"
+        f.write_bytes(b"data")
+        cache = FileCache(tmp_path / "cache.pkl")
+        
+        cache.set(str(f), [0.0, 2.0])
+        assert cache.get(str(f)) == [0.0, 2.0]
+    
+    def test_changed_file_invalidates(self, tmp_path):
+        """Test entry is stale once the file changes."""
+        f = tmp_path / "video.mp4"
+        f.write_bytes(b"data")
+        cache = FileCache(tmp_path / "cache.pkl")
+        cache.set(str(f), [0.0])
+        
+        f.write_bytes(b"new data")
+        assert cache.get(str(f)) is None
+        assert cache.get(str(f), 'default') == 'default'
+    
+    def test_set_missing_file_ignored(self, tmp_path):
+        """Test values for missing files are not cached."""
+        cache = FileCache(tmp_path / "cache.pkl")
+        cache.set(str(tmp_path / "missing.mp4"), [0.0])
+        assert cache.paths() == []
+    
+    def test_save_and_reload(self, tmp_path):
+        """Test cache persists across instances."""
+        f = tmp_path / "video.mp4"
+        f.write_bytes(b"data")
+        cache_file = tmp_path / "db" / "cache.pkl"
+        
+        cache = FileCache(cache_file)
+        cache.set(str(f), {"duration": 3.5})
+        cache.save()
+        
+        assert cache_file.exists()
+        assert not [n for n in os.listdir(cache_file.parent) if n.endswith('.tmp')]
+        assert FileCache(cache_file).get(str(f)) == {"duration": 3.5}
+    
+    def test_corrupt_cache_file(self, tmp_path):
+        """Test corrupt cache file loads as empty."""
+        cache_file = tmp_path / "cache.pkl"
+        cache_file.write_bytes(b"not a pickle")
+        assert FileCache(cache_file).paths() == []
+    
+    def test_pop(self, tmp_path):
+        """Test removing an entry."""
+        f = tmp_path / "video.mp4"
+        f.write_bytes(b"data")
+        cache = FileCache(tmp_path / "cache.pkl")
+        cache.set(str(f), 1)
+        
+        assert cache.pop(str(f)) == 1
+        assert cache.get(str(f)) is None
+
+
+class TestLRUDiskCache:
+    """Test size-capped file cache."""
+    
+    def _write(self, path, size, mtime):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * size)
+        os.utime(path, ns=(mtime, mtime))
+        return str(path)
+    
+    def test_evicts_least_recently_used(self, tmp_path):
+        """Test oldest untouched files are removed over the cap."""
+        a = self._write(tmp_path / "a" / "0.ts", 40, 1)
+        b = self._write(tmp_path / "b" / "1.ts", 40, 2)
+        cache = LRUDiskCache(tmp_path, 100)
+        assert cache.total_bytes == 80
+        
+        cache.touch(a)
+        c = self._write(tmp_path / "c" / "2.ts", 40, 3)
+        cache.add(c)
+        
+        assert os.path.exists(a)
+        assert not os.path.exists(b)
+        assert os.path.exists(c)
+        assert cache.total_bytes == 80
+    
+    def test_keeps_newest_file_over_cap(self, tmp_path):
+        """Test a file bigger than the cap is still kept."""
+        cache = LRUDiskCache(tmp_path, 10)
+        big = self._write(tmp_path / "big.ts", 40, 1)
+        cache.add(big)
+        assert os.path.exists(big)
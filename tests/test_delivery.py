@@ -0,0 +1,160 @@
+"""Tests for delivery module."""
+import gzip
+import os
+
+from flask import Flask, Response
+from werkzeug.datastructures import Accept
+
+from src.media_server.delivery import (
+    compress_response,
+    offload_header,
+    precompress_assets,
+    prefetch_links,
+    send_asset,
+    send_media,
+)
+
+GZIP_ONLY = Accept([('gzip', 1)])
+
+
+class TestOffloadHeader:
+    """Test front proxy offload headers."""
+    
+    def test_x_sendfile(self, tmp_path):
+        """Test X-Sendfile carries the absolute file path."""
+        path = str(tmp_path / "a.mp4")
+        assert offload_header(path, 'x-sendfile', {}) == ('X-Sendfile', path)
+    
+    def test_x_accel_longest_location(self, tmp_path):
+        """Test the most specific location is used and the URI is quoted."""
+        media = str(tmp_path / "media")
+        cache = os.path.join(media, ".database")
+        locations = {media: '/_media/', cache: '/_cache'}
+        
+        video = os.path.join(media, "a b", "v.mp4")
+        assert offload_header(video, 'x-accel', locations) == (
+            'X-Accel-Redirect', '/_media/a%20b/v.mp4'
+        )
+        thumb = os.path.join(cache, "thumbs", "t.webp")
+        assert offload_header(thumb, 'x-accel', locations) == (
+            'X-Accel-Redirect', '/_cache/thumbs/t.webp'
+        )
+    
+    def test_x_accel_outside_locations(self, tmp_path):
+        """Test files outside every location are not offloaded."""
+        locations = {str(tmp_path / "media"): '/_media/'}
+        sibling = str(tmp_path / "mediax" / "a.mp4")
+        assert offload_header(sibling, 'x-accel', locations) is None
+        assert offload_header(str(tmp_path / "a.mp4"), 'none', locations) is None
+
+
+class TestPrefetchLinks:
+    """Test prefetch hints."""
+    
+    def test_prefetch_links(self):
+        """Test URLs become one Link header value."""
+        assert prefetch_links(['/media/a.jpg', '/poster/v.mp4']) == (
+            '</media/a.jpg>; rel=prefetch, </poster/v.mp4>; rel=prefetch'
+        )
+        assert prefetch_links([]) == ''
+
+
+class TestSendMedia:
+    """Test sending files with and without offloading."""
+    
+    def test_offloaded_response_has_no_body(self, tmp_path):
+        """Test the proxy is told to send the file."""
+        f = tmp_path / "v.mp4"
+        f.write_bytes(b"video")
+        with Flask(__name__).test_request_context():
+            response = send_media(
+                str(f), offload='x-accel', locations={str(tmp_path): '/_m'}
+            )
+        
+        assert response.headers['X-Accel-Redirect'] == '/_m/v.mp4'
+        assert response.mimetype == 'video/mp4'
+        assert response.get_data() == b''
+    
+    def test_sent_by_flask_without_offload(self, tmp_path):
+        """Test files are streamed by Flask by default, or when not offloadable."""
+        f = tmp_path / "v.mp4"
+        f.write_bytes(b"video")
+        with Flask(__name__).test_request_context():
+            plain = send_media(str(f))
+            outside = send_media(
+                str(f), offload='x-accel', locations={'/elsewhere': '/_m'}
+            )
+        
+        for response in (plain, outside):
+            response.direct_passthrough = False
+            assert response.get_data() == b"video"
+            assert 'X-Accel-Redirect' not in response.headers
+
+
+class TestCompression:
+    """Test compressing responses and precompressed assets."""
+    
+    def test_compress_large_html(self):
+        """Test big HTML is gzipped, with a weak ETag and Vary."""
+        html = '<div class="grid-item">a</div>' * 200
+        response = Response(html, mimetype='text/html')
+        response.set_etag('abc')
+        
+        response = compress_response(response, GZIP_ONLY)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.get_data()).decode() == html
+        assert response.get_etag() == ('abc', True)
+        assert 'Accept-Encoding' in response.vary
+        assert int(response.headers['Content-Length']) < len(html) // 10
+    
+    def test_skipped(self):
+        """Test small bodies, media and clients without gzip are left alone."""
+        small = compress_response(
+            Response('{}', mimetype='application/json'), GZIP_ONLY
+        )
+        media = compress_response(
+            Response(b'x' * 5000, mimetype='video/mp4'), GZIP_ONLY
+        )
+        plain = compress_response(Response('x' * 5000, mimetype='text/html'), Accept())
+        
+        for response in (small, media, plain):
+            assert 'Content-Encoding' not in response.headers
+        assert 'Accept-Encoding' in plain.vary
+    
+    def test_streamed(self):
+        """Test streamed bodies are compressed chunk by chunk."""
+        chunks = ['{"items": [', '1, ' * 10, '2]}']
+        response = compress_response(
+            Response(iter(chunks), mimetype='application/json'),
+            GZIP_ONLY,
+            min_size=10**6,
+        )
+        
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Content-Length' not in response.headers
+        assert gzip.decompress(response.get_data()).decode() == ''.join(chunks)
+    
+    def test_precompressed_assets(self, tmp_path):
+        """Test assets are precompressed once and sent by negotiation."""
+        js = tmp_path / "index.js"
+        js.write_text("function f() {}\n" * 100)
+        (tmp_path / "logo.png").write_bytes(b"png")
+        
+        assert precompress_assets(str(tmp_path)) >= 1
+        assert precompress_assets(str(tmp_path)) == 0
+        assert not (tmp_path / "logo.png.gz").exists()
+        
+        with Flask(__name__).test_request_context():
+            zipped = send_asset(str(js), GZIP_ONLY)
+            plain = send_asset(str(js), Accept())
+            os.utime(tmp_path / "index.js.gz", (1, 1))
+            stale = send_asset(str(js), GZIP_ONLY)
+        
+        for response in (zipped, plain, stale):
+            response.direct_passthrough = False
+            assert 'Accept-Encoding' in response.vary
+        assert zipped.headers['Content-Encoding'] == 'gzip'
+        assert zipped.mimetype == 'text/javascript'
+        assert gzip.decompress(zipped.get_data()) == js.read_bytes()
+        assert plain.get_data() == js.read_bytes()
+        assert 'Content-Encoding' not in stale.headers
@@ -0,0 +1,110 @@
+"""Tests for events module."""
+import socket
+
+import pytest
+
+from src.media_server.events import EventServer, format_event, parse_since, replay
+from src.media_server.models import MediaState
+
+
+def read_until(conn, marker: bytes) -> bytes:
+    """Read from a socket until ``marker`` has been received."""
+    data = b''
+    while marker not in data:
+        chunk = conn.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class TestFormat:
+    """Test encoding events and reading the version a client saw."""
+    
+    def test_format_event(self):
+        """Test an event becomes an SSE message with its version as id."""
+        message = format_event({'version': 7, 'type': 'job', 'data': {'name': '标签'}})
+        assert message == 'id: 7\nevent: job\ndata: {"name":"标签"}\n\n'.encode('utf-8')
+    
+    def test_parse_since(self):
+        """Test Last-Event-ID wins over the since arg."""
+        assert parse_since('/events?since=3', {}) == 3
+        assert parse_since('/events?since=3', {'last-event-id': '9'}) == 9
+        assert parse_since('/events', {}) is None
+        assert parse_since('/events?since=x', {}) is None
+    
+    def test_replay(self, tmp_path):
+        """Test missed events are replayed, and unknown versions reset."""
+        state = MediaState(str(tmp_path))
+        since = state.version
+        state.publish('job', {'name': 'scan_media'})
+        
+        message, seen = replay(state, since, 1000)
+        assert message.startswith(b'retry: 1000\n\n')
+        assert b'event: job' in message
+        assert seen == state.version
+        
+        message, seen = replay(state, state.version + 10)
+        assert f'id: {state.version}\nevent: reset'.encode() in message
+        assert replay(state, None)[0] == b'retry: 3000\n\n'
+
+
+class TestEventServer:
+    """Test streaming state events over a socket."""
+    
+    @pytest.fixture
+    def server(self, tmp_path):
+        state = MediaState(str(tmp_path))
+        server = EventServer(state, port=0, heartbeat=0.2)
+        server.start()
+        yield server
+        server.stop()
+    
+    def connect(self, server, target: str):
+        conn = socket.create_connection(('127.0.0.1', server.port), timeout=5)
+        conn.sendall(f'GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+        return conn
+    
+    def test_replay_and_live_events(self, server):
+        """Test missed events are replayed, then new ones streamed as published."""
+        state = server.state
+        since = state.version
+        state.publish('changes', {'removed': ['/media/a.jpg']})
+        
+        with self.connect(server, f'/events/stream?since={since}') as conn:
+            data = read_until(conn, b'a.jpg')
+            assert b'200 OK' in data
+            assert b'text/event-stream' in data
+            assert b'event: changes' in data
+            
+            # Heartbeats keep the idle connection open
+            assert b': ping' in read_until(conn, b': ping')
+            
+            state.publish('job', {'name': 'scan_media'})
+            assert f'id: {state.version}'.encode() in read_until(conn, b'scan_media')
+    
+    def test_reset_when_too_far_behind(self, server):
+        """Test a client with an unknown version is told to reload."""
+        since = server.state.version + 10
+        with self.connect(server, f'/events/stream?since={since}') as conn:
+            assert b'event: reset' in read_until(conn, b'event: reset')
+    
+    def test_unknown_path(self, server):
+        """Test anything but the stream is not found."""
+        with self.connect(server, '/other') as conn:
+            assert b'404' in read_until(conn, b'\r\n\r\n')
+    
+    def test_localhost_without_cors(self, server):
+        """Test the server is only reachable locally, from the app's origin."""
+        assert server.host == '127.0.0.1'
+        with self.connect(server, '/events/stream') as conn:
+            assert b'Access-Control' not in read_until(conn, b'retry:')
+    
+    def test_start_fails_fast(self, server):
+        """Test a port in use gives no server instead of blocking."""
+        other = EventServer(server.state, port=server.port)
+        assert other.start(timeout=1) is None
+        # The next call tries again
+        other.port = 0
+        assert other.start(timeout=1)
+        other.stop()
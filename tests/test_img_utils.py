@@ -1,3 +1,10 @@
+import base64
+import os
+import random
+import threading
+from concurrent.futures import Future
+from types import SimpleNamespace
+
 from src.media_server import img_utils
 
 
@@ -17,3 +24,364 @@ def test_get_xmp_tags_no_xmp(tmp_path):
     f.write_bytes(b"no xmp here")
     tags = img_utils.get_xmp_tags(str(f))
     assert tags == []
+
+
+def _write_image(path, size=(800, 600), fmt="JPEG"):
+    from PIL import Image
+    Image.new("RGB", size, (200, 100, 50)).save(path, fmt)
+
+
+def test_make_thumbnail_short_side(tmp_path):
+    from PIL import Image
+    src = tmp_path / "photo.jpg"
+    _write_image(src, (800, 600))
+    dest = tmp_path / "cache" / "thumb.webp"
+
+    img_utils.make_thumbnail(str(src), str(dest), 240)
+    with Image.open(dest) as thumb:
+        assert thumb.size == (320, 240)
+        assert thumb.format == "WEBP"
+    assert [p.name for p in dest.parent.iterdir()] == ["thumb.webp"]
+
+
+def test_make_thumbnail_small_png_not_upscaled(tmp_path):
+    from PIL import Image
+    src = tmp_path / "icon.png"
+    Image.new("RGBA", (100, 50)).save(src)
+    dest = tmp_path / "thumb.webp"
+
+    img_utils.make_thumbnail(str(src), str(dest), 480)
+    with Image.open(dest) as thumb:
+        assert thumb.size == (100, 50)
+        assert thumb.mode == "RGBA"
+
+
+def test_thumb_path_keyed_by_mtime(tmp_path):
+    import os
+    src = tmp_path / "photo.jpg"
+    _write_image(src)
+    before = img_utils.thumb_path(str(tmp_path), str(src), 240)
+    os.utime(src, ns=(1, 1))
+    after = img_utils.thumb_path(str(tmp_path), str(src), 240)
+
+    assert before != after
+    digest = os.path.basename(after)[:-len(".webp")]
+    assert os.path.dirname(after) == str(tmp_path / "240" / digest[:2] / digest[2:4])
+
+
+def test_thumbnailer_caches(tmp_path, monkeypatch):
+    src = tmp_path / "photo.jpg"
+    _write_image(src)
+    calls = []
+    make = img_utils.make_thumbnail
+    monkeypatch.setattr(
+        img_utils, "make_thumbnail", lambda *a: calls.append(a) or make(*a)
+    )
+    thumbnailer = img_utils.Thumbnailer(tmp_path / "thumbs", workers=1)
+
+    first = thumbnailer.get(str(src), 240)
+    second = thumbnailer.get(str(src), 240)
+    assert first == second
+    assert len(calls) == 1
+
+
+def test_thumbnailer_task_done_at_once(tmp_path):
+    dest = tmp_path / "out.webp"
+    thumbnailer = img_utils.Thumbnailer(tmp_path / "thumbs", workers=1)
+
+    def submit(func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+    thumbnailer._pool = SimpleNamespace(submit=submit)
+    rendering = threading.Thread(
+        target=thumbnailer.render, args=(str(dest), dest.write_bytes, b"x"),
+        daemon=True,
+    )
+    rendering.start()
+    rendering.join(5)
+
+    assert not rendering.is_alive()
+    assert dest.read_bytes() == b"x"
+    assert thumbnailer._pending == {}
+
+
+def test_make_thumbnails_all_sizes(tmp_path):
+    from PIL import Image
+    src = tmp_path / "photo.png"
+    _write_image(src, (1200, 1000), "PNG")
+    dests = {size: str(tmp_path / f"{size}.webp") for size in (240, 480)}
+
+    img_utils.make_thumbnails(str(src), dests)
+    with Image.open(dests[240]) as small, Image.open(dests[480]) as big:
+        assert small.size == (288, 240)
+        assert big.size == (576, 480)
+
+
+def test_make_thumbnail_animated_gif(tmp_path):
+    from PIL import Image
+    src = tmp_path / "anim.gif"
+    frames = [Image.new("RGB", (400, 300), c) for c in ("red", "blue", "green")]
+    frames[0].save(src, save_all=True, append_images=frames[1:], duration=50)
+    dest = tmp_path / "anim.webp"
+
+    img_utils.make_thumbnail(str(src), str(dest), 240)
+    with Image.open(dest) as thumb:
+        assert thumb.is_animated
+        assert thumb.n_frames == 3
+        assert thumb.size == (320, 240)
+
+
+def test_thumbnail_job_only_missing(tmp_path):
+    cache_dir = tmp_path / "thumbs"
+    done = tmp_path / "done.jpg"
+    todo = tmp_path / "todo.png"
+    _write_image(done)
+    _write_image(todo, fmt="PNG")
+    (tmp_path / "video.mp4").write_bytes(b"v")
+    img_utils.make_thumbnails(
+        str(done),
+        {s: img_utils.thumb_path(str(cache_dir), str(done), s) for s in (240, 480)},
+    )
+
+    job = img_utils.thumbnail_job(
+        [str(done), str(todo), str(tmp_path / "video.mp4")], str(cache_dir), (240, 480)
+    )
+    assert [task[0] for task in job.items] == [str(todo)]
+    assert sorted(job.items[0][1]) == [240, 480]
+
+    img_utils.generate_thumbnails(job.items[0])
+    again = img_utils.thumbnail_job([str(done), str(todo)], str(cache_dir), (240, 480))
+    assert again.items == []
+
+
+def _write_noisy_png(path, size=(200, 150)):
+    from PIL import Image
+    img = Image.new("RGB", size)
+    img.putdata([(random.randrange(256), 80, 40) for _ in range(size[0] * size[1])])
+    img.save(path, "PNG")
+
+
+def test_convert_image_webp_moves_into_place(tmp_path):
+    from PIL import Image
+    src = tmp_path / "shot.png"
+    _write_noisy_png(src)
+    os.utime(src, (1000, 1000))
+
+    result = img_utils.convert_image(str(src), "webp", "small")
+    assert result["dest"] == str(tmp_path / "shot.webp")
+    assert result["new_size"] < result["old_size"]
+    assert not src.exists()
+    assert [p.name for p in tmp_path.iterdir()] == ["shot.webp"]
+    assert os.stat(result["dest"]).st_mtime == 1000
+    with Image.open(result["dest"]) as img:
+        assert img.format == "WEBP"
+
+
+def test_convert_image_replaces_existing_dest(tmp_path):
+    from PIL import Image
+    src = tmp_path / "shot.png"
+    _write_noisy_png(src)
+    (tmp_path / "shot.jpg").write_bytes(b"old conversion")
+
+    result = img_utils.convert_image(str(src), "jpeg", "high", keep_original=True)
+    assert result["dest"] == str(tmp_path / "shot.jpg")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["shot.jpg", "shot.png"]
+    with Image.open(result["dest"]) as img:
+        assert img.format == "JPEG"
+
+
+def test_convert_image_discards_larger_result(tmp_path):
+    src = tmp_path / "dot.png"
+    _write_image(src, (1, 1), fmt="PNG")
+
+    result = img_utils.convert_image(str(src), "jpeg", "high")
+    assert result["dest"] is None
+    assert result["new_size"] > result["old_size"]
+    assert [p.name for p in tmp_path.iterdir()] == ["dot.png"]
+
+
+def test_convert_image_keeps_alpha_for_webp(tmp_path):
+    from PIL import Image
+    src = tmp_path / "alpha.png"
+    Image.new("RGBA", (32, 32), (255, 0, 0, 128)).save(src)
+
+    result = img_utils.convert_image(str(src), "webp_lossless", only_smaller=False)
+    with Image.open(result["dest"]) as img:
+        assert img.mode == "RGBA"
+
+
+def test_convert_to_jpg_keeps_original(tmp_path):
+    src = tmp_path / "shot.png"
+    _write_noisy_png(src)
+
+    img_utils.convert_to_jpg(str(src))
+    assert src.exists()
+    assert (tmp_path / "shot.jpg").exists()
+
+
+def test_conversion_job_reports_bytes_saved(tmp_path):
+    import pytest
+    (tmp_path / "sub").mkdir()
+    _write_noisy_png(tmp_path / "a.png")
+    _write_noisy_png(tmp_path / "sub" / "b.png")
+    _write_image(tmp_path / "c.jpg")
+    moved = []
+
+    images = img_utils.find_images(str(tmp_path))
+    job = img_utils.conversion_job(
+        images, "jpeg", "small", workers=1, on_result=lambda t, r: moved.append(r)
+    )
+    assert sorted(os.path.basename(t[0]) for t in job.items) == ["a.png", "b.png"]
+
+    job.processes = False
+    job.start()
+    job.join(30)
+    status = job.status()
+    assert status["done"] == 2
+    saved = sum(r["old_size"] - r["new_size"] for r in moved)
+    assert status["stats"]["bytes_saved"] == saved
+    assert status["stats"]["bytes_saved"] > 0
+    assert (tmp_path / "sub" / "b.jpg").exists()
+
+    with pytest.raises(ValueError):
+        img_utils.conversion_job(images, "gif")
+
+
+XMP_PACKET = (
+    b'<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF><rdf:Description><dc:subject>'
+    + '<rdf:Bag> <rdf:li>风景</rdf:li> <rdf:li>城市</rdf:li> </rdf:Bag>'.encode()
+    + b'</dc:subject></rdf:Description></rdf:RDF></x:xmpmeta>'
+)
+
+
+def test_get_xmp_tags_jpeg_app1(tmp_path):
+    from PIL import Image
+    f = tmp_path / "tagged.jpg"
+    app1 = b"http://ns.adobe.com/xap/1.0/\x00" + XMP_PACKET
+    Image.new("RGB", (8, 8)).save(f, "JPEG", xmp=app1)
+
+    assert img_utils.read_xmp_packet(str(f)) == XMP_PACKET
+    assert img_utils.get_xmp_tags(str(f)) == ["风景", "城市"]
+
+
+def test_read_xmp_packet_stops_at_jpeg_image_data(tmp_path):
+    f = tmp_path / "late.jpg"
+    _write_image(f, (8, 8))
+    with open(f, "ab") as out:
+        out.write(XMP_PACKET)
+
+    assert img_utils.read_xmp_packet(str(f)) is None
+
+
+def test_read_xmp_packet_split_across_chunks(tmp_path):
+    f = tmp_path / "clip.mp4"
+    f.write_bytes(b"\x00" * 1000 + XMP_PACKET + b"\x00" * 1000)
+
+    for chunk_size in (7, 64, 1 << 16):
+        assert img_utils.read_xmp_packet(str(f), chunk_size) == XMP_PACKET
+    assert img_utils.get_xmp_tags(str(f)) == ["风景", "城市"]
+
+
+def test_xmp_import_job_skips_imported(tmp_path):
+    from src.media_server.cache import FileCache
+    tagged = tmp_path / "tagged.mp4"
+    plain = tmp_path / "plain.png"
+    tagged.write_bytes(XMP_PACKET)
+    plain.write_bytes(b"png")
+    imported = FileCache(tmp_path / "xmp_tags.pkl")
+
+    job = img_utils.xmp_import_job([str(tagged), str(plain)], imported, workers=1)
+    job.processes = False
+    job.start()
+    job.join(10)
+    assert imported.get(str(tagged)) == ["风景", "城市"]
+    assert imported.get(str(plain)) == []
+
+    again = img_utils.xmp_import_job(
+        [str(tagged), str(plain)], FileCache(tmp_path / "xmp_tags.pkl")
+    )
+    assert again.items == []
+    os.utime(plain, ns=(0, 10**9))
+    job = img_utils.xmp_import_job([str(tagged), str(plain)], imported)
+    assert job.items == [str(plain)]
+
+
+def test_read_image_meta_exif(tmp_path):
+    from PIL import Image
+    f = tmp_path / "photo.jpg"
+    img = Image.new("RGB", (40, 30))
+    exif = img.getexif()
+    exif[0x0112] = 6
+    exif[0x010F] = "Canon"
+    exif[0x0110] = "Canon EOS 5D"
+    exif.get_ifd(0x8769)[0x9003] = "2021:05:04 13:14:15"
+    img.save(f, "JPEG", exif=exif)
+
+    assert img_utils.read_image_meta(str(f)) == {
+        "width": 30,
+        "height": 40,
+        "orientation": 6,
+        "taken": "2021-05-04T13:14:15",
+        "camera": "Canon EOS 5D",
+    }
+
+
+def test_read_image_meta_without_exif(tmp_path):
+    f = tmp_path / "shot.png"
+    _write_image(f, (64, 48), fmt="PNG")
+
+    meta = img_utils.read_image_meta(str(f))
+    assert (meta["width"], meta["height"], meta["orientation"]) == (64, 48, 1)
+    assert meta["taken"] is None
+    assert meta["camera"] is None
+
+
+def test_image_meta_job_only_missing(tmp_path):
+    from src.media_server.cache import FileCache
+    done = tmp_path / "done.jpg"
+    todo = tmp_path / "todo.png"
+    _write_image(done)
+    _write_image(todo, fmt="PNG")
+    cache = FileCache(tmp_path / "image_meta.pkl")
+    cache.set(str(done), img_utils.read_image_meta(str(done)))
+
+    job = img_utils.image_meta_job(
+        [str(done), str(todo), str(tmp_path / "v.mp4")], cache
+    )
+    assert job.items == [str(todo)]
+
+
+def test_make_placeholder_data_uri(tmp_path):
+    from PIL import Image
+    f = tmp_path / "photo.jpg"
+    _write_image(f, (800, 600))
+
+    placeholder = img_utils.make_placeholder(str(f))
+    prefix = "data:image/webp;base64,"
+    assert placeholder.startswith(prefix)
+    data = base64.b64decode(placeholder[len(prefix):])
+    assert len(data) < 512
+    import io
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == (16, 12)
+
+
+def test_placeholder_job_only_missing(tmp_path):
+    from src.media_server.cache import FileCache
+    done = tmp_path / "done.jpg"
+    todo = tmp_path / "todo.png"
+    _write_image(done)
+    _write_image(todo, fmt="PNG")
+    cache = FileCache(tmp_path / "placeholders.pkl")
+    cache.set(str(done), "data:image/webp;base64,")
+
+    job = img_utils.placeholder_job(
+        [(str(done), str(done)), (str(todo), str(todo))], cache
+    )
+    assert job.items == [(str(todo), str(todo))]
+    job.processes = False
+    job.start()
+    job.join(10)
+    assert cache.get(str(todo)).startswith("data:image/webp;base64,")
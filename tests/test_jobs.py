@@ -0,0 +1,122 @@
+"""Tests for jobs module."""
+import sys
+
+from src.media_server.jobs import JOBS, BackgroundJob, start_job
+
+
+def square(x):
+    return x * x
+
+
+def app_imported(_):
+    return 'src.media_server.app' in sys.modules
+
+
+def fail_on_three(x):
+    if x == 3:
+        raise ValueError("bad item")
+    return x
+
+
+class TestBackgroundJob:
+    """Test background batch jobs."""
+    
+    def test_job_collects_results(self):
+        """Test every item result reaches on_result."""
+        results = {}
+        finished = []
+        job = BackgroundJob(
+            'square',
+            square,
+            range(10),
+            on_result=results.__setitem__,
+            on_finish=lambda: finished.append(True),
+            workers=2,
+            processes=False,
+        )
+        job.start()
+        job.join(5)
+        
+        assert results == {x: x * x for x in range(10)}
+        assert finished == [True]
+        status = job.status()
+        assert status['state'] == 'finished'
+        assert status['done'] == 10
+        assert status['eta'] is None
+    
+    def test_job_counts_failures(self):
+        """Test failing items are counted and don't stop the job."""
+        results = {}
+        job = BackgroundJob(
+            'fail', fail_on_three, [1, 2, 3, 4],
+            on_result=results.__setitem__, workers=1, processes=False,
+        )
+        job.start()
+        job.join(5)
+        
+        assert job.failed == 1
+        assert sorted(results) == [1, 2, 4]
+    
+    def test_job_process_pool(self):
+        """Test job runs in a process pool."""
+        results = {}
+        job = BackgroundJob(
+            'square_proc', square, [2, 3], results.__setitem__, workers=1
+        )
+        job.start()
+        job.join(30)
+        
+        assert results == {2: 4, 3: 9}
+    
+    def test_process_workers_skip_app_setup(self):
+        """Test spawned workers don't import, and so set up, the app."""
+        results = {}
+        job = BackgroundJob(
+            'no_app', app_imported, [1], results.__setitem__, workers=1
+        )
+        job.start()
+        job.join(30)
+        
+        assert results == {1: False}
+    
+    def test_job_reports_progress(self):
+        """Test on_progress gets the status at start, every report and at the end."""
+        reports = []
+        job = BackgroundJob(
+            'report', square, range(4), workers=1, processes=False,
+            report_every=2, on_progress=reports.append,
+        )
+        job.start()
+        job.join(5)
+        
+        assert [r['state'] for r in reports] == [
+            'running', 'running', 'running', 'finished'
+        ]
+        assert [r['done'] for r in reports] == [0, 2, 4, 4]
+    
+    def test_status_before_start(self):
+        """Test status of a pending job."""
+        status = BackgroundJob('pending', square, [1, 2]).status()
+        assert status['state'] == 'pending'
+        assert status['total'] == 2
+        assert status['rate'] == 0.0
+
+
+class TestStartJob:
+    """Test job registry."""
+    
+    def test_start_job_registers(self):
+        """Test started jobs are registered by name."""
+        job = BackgroundJob('registered', square, [1], workers=1, processes=False)
+        assert start_job(job)
+        job.join(5)
+        assert JOBS['registered'] is job
+    
+    def test_start_job_rejects_duplicate(self):
+        """Test a running job can't be started twice."""
+        running = BackgroundJob('dup', square, [1], workers=1, processes=False)
+        running.state = 'running'
+        JOBS['dup'] = running
+        
+        assert not start_job(BackgroundJob('dup', square, [1], processes=False))
+        JOBS.pop('dup')
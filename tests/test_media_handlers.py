@@ -229,6 +229,25 @@ class TestMoveItems:
         assert success
         assert (static_dir / "new_folder" / "photo.jpg").exists()
     
+    def test_move_reports_moved(self, tmp_path):
+        """Test on_moved gets the old and new path of each moved item."""
+        static_dir = tmp_path / "static"
+        static_dir.mkdir()
+        (static_dir / "photo.jpg").write_text("image")
+        moved = []
+        
+        move_items(
+            ["/static/photo.jpg", "/static/missing.jpg"],
+            "folder",
+            str(static_dir),
+            "static",
+            lambda old, new: moved.append((old, new)),
+        )
+        
+        assert moved == [(
+            str(static_dir / "photo.jpg"), str(static_dir / "folder" / "photo.jpg")
+        )]
+    
     def test_move_multiple_items(self, tmp_path):
         """Test moving multiple items."""
         static_dir = tmp_path / "static"
@@ -1,5 +1,6 @@
 """Tests for models module (MediaState)."""
 import json
+from collections import deque
 from pathlib import Path
 
 from src.media_server.models import MediaState
@@ -218,6 +219,82 @@ class TestMediaStatePersistence:
         assert clips[0]["name"] == "clip1"
 
 
+    def test_version_bumped_on_save(self, tmp_path):
+        """Test saving tags or clips, or clearing the media cache, bumps the version."""
+        state = MediaState(str(tmp_path))
+        version = state.version
+        state.save_tags()
+        state.save_clips()
+        state.clear_media_cache()
+        assert state.version == version + 3
+
+    def test_publish_and_events_since(self, tmp_path):
+        """Test published events are stamped with the version and replayed."""
+        state = MediaState(str(tmp_path))
+        seen = []
+        state.subscribe(seen.append)
+        start = state.version
+        first = state.publish('changes', {'removed': ['/media/a.jpg']})
+        state.save_tags()
+        second = state.publish('job', {'name': 'scan_media'})
+        state.unsubscribe(seen.append)
+        state.publish('job', {'name': 'other'})
+        
+        assert first['version'] == start + 1
+        assert seen == [first, second]
+        assert state.events_since(start) == [first, second, state.events[-1]]
+        assert state.events_since(first['version']) == [second, state.events[-1]]
+        assert state.events_since(state.version) == []
+        # Versions from an earlier run of the server can't be caught up
+        assert state.events_since(state.version + 5) is None
+    
+    def test_events_since_dropped(self, tmp_path, monkeypatch):
+        """Test catching up fails once the events asked for left the backlog."""
+        state = MediaState(str(tmp_path))
+        monkeypatch.setattr(state, 'events', deque(maxlen=2))
+        start = state.version
+        for i in range(3):
+            state.publish('job', {'done': i})
+        
+        assert state.events_since(start) is None
+        assert [e['data']['done'] for e in state.events_since(start + 1)] == [1, 2]
+
+    def test_tag_catalog_since(self, tmp_path):
+        """Test clients get the tags added and removed after their version."""
+        state = MediaState(str(tmp_path))
+        state.tags = {"apple": {"a.jpg"}, "cherry": {"c.jpg"}}
+        state.update_sorted_tags()
+        start = state.version
+        
+        state.tags["banana"] = {"b.jpg"}
+        del state.tags["cherry"]
+        state.update_sorted_tags()
+        
+        delta = state.tag_catalog_since(start)
+        assert delta['version'] == state.version
+        assert not delta['full']
+        assert delta['tags'] == [["banana", "banana", "apple"]]
+        assert delta['removed'] == ["cherry"]
+        assert state.tag_catalog_since(state.version)['tags'] == []
+        
+        # A version from before this run gets the whole list
+        full = state.tag_catalog_since(0)
+        assert full['full']
+        assert [tag for tag, _, _ in full['tags']] == ["apple", "banana"]
+    
+    def test_tags_of(self, tmp_path):
+        """Test the reverse index follows saved tags."""
+        state = MediaState(str(tmp_path))
+        state.tags = {"red": {"a.jpg"}, "blue": {"a.jpg", "b.jpg"}}
+        state.update_sorted_tags()
+        assert state.tags_of("a.jpg") == ["blue", "red"]
+        assert state.tags_of("c.jpg") == []
+        
+        state.tags["red"].add("b.jpg")
+        state.save_tags()
+        assert state.tags_of("b.jpg") == ["blue", "red"]
+
+
 class TestMediaStateDefaults:
     """Test default initialization when no config exists."""
     
@@ -1,7 +1,9 @@
 """Tests for tag_handlers module."""
 
 from src.media_server.tag_handlers import (
+    import_media_tags,
     merge_tags,
+    rename_media_tags,
     update_tag_global_variables,
 )
 
@@ -181,3 +183,44 @@ class TestMergeTags:
         # common.jpg should appear only once (it's a set)
         assert tags['merged'] == {'photo1.jpg', 'photo2.jpg', 'common.jpg'}
         assert len(tags['merged']) == 3
+
+
+class TestRenameMediaTags:
+    """Test moving tags to a new filename."""
+    
+    def test_move_tags(self):
+        """Test tags follow the media to its new name."""
+        tags = {'nature': {'a.png', 'b.png'}, 'city': {'b.png'}, 'best': {'a.png'}}
+        
+        changed = rename_media_tags('a.png', 'a.webp', tags)
+        
+        assert sorted(changed) == ['best', 'nature']
+        assert tags['nature'] == {'a.webp', 'b.png'}
+        assert tags['best'] == {'a.webp'}
+    
+    def test_copy_tags(self):
+        """Test tags are copied when the original is kept."""
+        tags = {'nature': {'a.png'}}
+        
+        rename_media_tags('a.png', 'a.jpg', tags, keep_old=True)
+        
+        assert tags['nature'] == {'a.png', 'a.jpg'}
+
+
+class TestImportMediaTags:
+    """Test merging tags read from files."""
+    
+    def test_import_tags(self):
+        """Test new and existing tags get the media."""
+        tags = {'nature': {'b.jpg'}}
+        
+        changed = import_media_tags({'a.jpg': ['nature', 'city', 'bad tag', '']}, tags)
+        
+        assert changed
+        assert tags == {'nature': {'a.jpg', 'b.jpg'}, 'city': {'a.jpg'}}
+    
+    def test_import_known_tags_unchanged(self):
+        """Test importing tags already present changes nothing."""
+        tags = {'nature': {'a.jpg'}}
+        
+        assert not import_media_tags({'a.jpg': ['nature']}, tags)
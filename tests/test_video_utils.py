@@ -0,0 +1,896 @@
+"""Tests for video_utils module."""
+import shutil
+import subprocess
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from src.media_server.cache import FileCache
+from src.media_server.video_utils import (
+    choose_proxy,
+    clip_manifest,
+    concat_list_line,
+    decodes_cleanly,
+    faststart_job,
+    faststart_scan_job,
+    generate_preview,
+    get_keyframes,
+    get_video_resolution,
+    gif_twin_job,
+    gif_twin_path,
+    hls_can_copy,
+    hls_playlist,
+    hls_segments,
+    is_output_current,
+    make_gif_twin,
+    make_hls_segment,
+    make_poster,
+    make_proxy,
+    plan_cut,
+    poster_job,
+    poster_offset,
+    poster_path,
+    preview_command,
+    preview_job,
+    probe_media,
+    probe_media_job,
+    proxy_job,
+    proxy_path,
+    proxy_rungs,
+    read_keyframes,
+    read_mp4_boxes,
+    record_output,
+    remove_outputs,
+    remux_faststart,
+    render_clip,
+    render_preview,
+    sample_ranges,
+    scaled_size,
+    scan_faststart,
+    segment_command,
+    smart_cut_args,
+)
+
+KEYFRAMES = [0.0, 2.0, 4.0, 6.0, 8.0]
+SMART_INFO = {
+    'streams': [
+        {'type': 'video', 'codec': 'h264', 'profile': 'High', 'level': 40,
+         'pix_fmt': 'yuv420p', 'time_base': '1/15360', 'bit_rate': 4000000},
+        {'type': 'audio', 'codec': 'aac', 'profile': 'LC', 'level': 0,
+         'pix_fmt': '', 'time_base': '1/48000', 'bit_rate': 128000},
+    ],
+}
+
+
+class TestReadKeyframes:
+    """Test keyframe index parsing."""
+    
+    def test_read_keyframes_parses_flags(self):
+        """Test only keyframe packets are kept."""
+        output = "0.000000,K_\n0.033000,__\n2.002000,K_\nN/A,K_\n1.001000,K_\n"
+        with patch("src.media_server.video_utils.run_ffprobe", return_value=output):
+            assert read_keyframes("video.mp4") == [0.0, 1.001, 2.002]
+    
+    def test_read_keyframes_no_output(self):
+        """Test empty ffprobe output gives no keyframes."""
+        with patch("src.media_server.video_utils.run_ffprobe", return_value=""):
+            assert read_keyframes("video.mp4") == []
+    
+    def test_get_keyframes_cached(self, tmp_path):
+        """Test keyframes are only read once per file version."""
+        video = tmp_path / "video.mp4"
+        video.write_bytes(b"data")
+        cache = FileCache(tmp_path / "keyframes.pkl")
+        
+        with patch(
+            "src.media_server.video_utils.read_keyframes", return_value=KEYFRAMES
+        ) as mock_read:
+            assert get_keyframes(str(video), cache) == KEYFRAMES
+            assert get_keyframes(str(video), cache) == KEYFRAMES
+        
+        assert mock_read.call_count == 1
+        assert (tmp_path / "keyframes.pkl").exists()
+
+
+class TestPlanCut:
+    """Test cut planning."""
+    
+    def test_reencode(self):
+        """Test re-encode mode keeps exact boundaries."""
+        assert plan_cut(1.0, 5.0, KEYFRAMES, 'reencode') == [(1.0, 5.0, False)]
+    
+    def test_snap_to_previous_keyframe(self):
+        """Test snap mode moves the start back to a keyframe."""
+        assert plan_cut(3.0, 5.0, KEYFRAMES, 'snap') == [(2.0, 5.0, True)]
+    
+    def test_snap_on_keyframe(self):
+        """Test start already on a keyframe is kept."""
+        assert plan_cut(4.0, 7.0, KEYFRAMES, 'snap') == [(4.0, 7.0, True)]
+    
+    def test_no_keyframes_reencodes(self):
+        """Test unknown keyframes fall back to re-encode."""
+        assert plan_cut(1.0, 5.0, [], 'snap') == [(1.0, 5.0, False)]
+    
+    def test_smart_cut(self):
+        """Test smart cut re-encodes only the partial GOPs."""
+        assert plan_cut(1.0, 7.0, KEYFRAMES, 'smart') == [
+            (1.0, 2.0, False),
+            (2.0, 6.0, True),
+            (6.0, 7.0, False),
+        ]
+    
+    def test_smart_cut_aligned(self):
+        """Test smart cut on keyframes is a pure copy."""
+        assert plan_cut(2.0, 6.0, KEYFRAMES, 'smart') == [(2.0, 6.0, True)]
+    
+    def test_smart_cut_within_gop(self):
+        """Test clip inside a single GOP is re-encoded."""
+        assert plan_cut(2.5, 3.5, KEYFRAMES, 'smart') == [(2.5, 3.5, False)]
+
+
+class TestRenderClip:
+    """Test clip rendering commands."""
+    
+    def test_segment_command_copy(self):
+        """Test copy segment seeks on input."""
+        cmd = segment_command("in.mp4", 2.0, 5.0, "out.mp4", True, [])
+        assert cmd[cmd.index('-ss') + 1] == '2.000'
+        assert cmd.index('-ss') < cmd.index('-i')
+        assert cmd[cmd.index('-t') + 1] == '3.000'
+        assert ['-c', 'copy'] == cmd[cmd.index('-c'):cmd.index('-c') + 2]
+    
+    def test_segment_command_encode(self):
+        """Test re-encoded segment uses encode arguments."""
+        cmd = segment_command("in.mp4", 0, 1, "out.mp4", False, ['-vf', 'scale=2:2'])
+        assert 'copy' not in cmd
+        assert cmd[-3:] == ['-vf', 'scale=2:2', 'out.mp4']
+    
+    def test_concat_list_line_escapes_quotes(self):
+        """Test quotes in paths are escaped for the concat demuxer."""
+        assert concat_list_line("/a/it's.mp4") == "file '/a/it'\\''s.mp4'\n"
+    
+    def test_render_snap_single_command(self, tmp_path):
+        """Test snap mode runs one ffmpeg command."""
+        with patch("src.media_server.video_utils.subprocess.run") as mock_run:
+            mock_run.return_value = SimpleNamespace(returncode=0)
+            ok = render_clip("in.mp4", 3.0, 5.0, str(tmp_path / "out.mp4"), KEYFRAMES)
+        
+        assert ok
+        assert mock_run.call_count == 1
+    
+    def test_render_smart_concats_parts(self, tmp_path):
+        """Test smart mode renders parts, concats them and checks the result."""
+        with patch("src.media_server.video_utils.subprocess.run") as mock_run:
+            mock_run.return_value = SimpleNamespace(returncode=0, stderr="")
+            ok = render_clip(
+                "in.mp4", 1.0, 7.0, str(tmp_path / "out.mp4"), KEYFRAMES, 'smart',
+                info=SMART_INFO,
+            )
+
+        assert ok
+        cmds = [c.args[0] for c in mock_run.call_args_list]
+        assert len(cmds) == 5
+        assert 'libx264' in cmds[0]
+        assert cmds[0][cmds[0].index('-profile:v') + 1] == 'high'
+        assert cmds[0][cmds[0].index('-pix_fmt') + 1] == 'yuv420p'
+        assert 'copy' in cmds[1]
+        assert 'concat' in cmds[3]
+        assert cmds[4][-3:] == ['-f', 'null', '-']
+
+    def test_render_smart_reencodes_when_result_is_broken(self, tmp_path):
+        """Test a smart cut failing to decode is re-encoded whole."""
+        with patch("src.media_server.video_utils.subprocess.run") as mock_run:
+            mock_run.side_effect = (
+                [SimpleNamespace(returncode=0, stderr="")] * 4
+                + [SimpleNamespace(returncode=0, stderr="non-monotonic DTS")]
+                + [SimpleNamespace(returncode=0, stderr="")]
+            )
+            ok = render_clip(
+                "in.mp4", 1.0, 7.0, str(tmp_path / "out.mp4"), KEYFRAMES, 'smart',
+                info=SMART_INFO,
+            )
+
+        assert ok
+        assert mock_run.call_count == 6
+        assert 'copy' not in mock_run.call_args.args[0]
+
+    def test_render_smart_probes_stale_info(self, tmp_path):
+        """Test info cached without the encoder fields is probed again."""
+        stale = {'streams': [{'type': 'video', 'codec': 'h264'}]}
+        with patch("src.media_server.video_utils.subprocess.run") as mock_run, \
+             patch("src.media_server.video_utils.probe_media",
+                   return_value=SMART_INFO) as mock_probe:
+            mock_run.return_value = SimpleNamespace(returncode=0, stderr="")
+            render_clip(
+                "in.mp4", 1.0, 7.0, str(tmp_path / "out.mp4"), KEYFRAMES, 'smart',
+                info=stale,
+            )
+
+        mock_probe.assert_called_once_with("in.mp4")
+
+    def test_render_smart_unknown_codec_reencodes(self, tmp_path):
+        """Test smart mode falls back to re-encode for unknown codecs."""
+        info = {'streams': [{**SMART_INFO['streams'][0], 'codec': 'prores'}]}
+        with patch("src.media_server.video_utils.subprocess.run") as mock_run:
+            mock_run.return_value = SimpleNamespace(returncode=0)
+            render_clip(
+                "in.mp4", 1.0, 7.0, str(tmp_path / "out.mp4"), KEYFRAMES, 'smart',
+                info=info,
+            )
+
+        assert mock_run.call_count == 1
+        assert 'copy' not in mock_run.call_args.args[0]
+
+    def test_smart_cut_args_match_source(self):
+        """Test re-encoded parts keep the source's stream parameters."""
+        args = smart_cut_args(SMART_INFO, '.mp4')
+        assert args == [
+            '-c:v', 'libx264', '-profile:v', 'high', '-level:v', '4',
+            '-pix_fmt', 'yuv420p', '-b:v', '4000000',
+            '-video_track_timescale', '15360', '-c:a', 'copy',
+        ]
+
+    def test_smart_cut_args_hevc_without_audio(self):
+        """Test HEVC levels are converted and silent sources drop audio."""
+        video = {**SMART_INFO['streams'][0], 'codec': 'hevc', 'profile': 'Main 10',
+                 'level': 120, 'pix_fmt': 'yuv420p10le', 'bit_rate': None}
+        args = smart_cut_args({'streams': [video]}, '.mkv')
+        assert args == [
+            '-c:v', 'libx265', '-profile:v', 'main10', '-x265-params',
+            'level-idc=4', '-pix_fmt', 'yuv420p10le', '-an',
+        ]
+
+    @pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+    def test_render_smart_real_video(self, tmp_path):
+        """Test a smart cut of a real video decodes and lasts as asked."""
+        source = str(tmp_path / "source.mp4")
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', 'testsrc=duration=8:size=160x120:rate=25',
+            '-f', 'lavfi', '-i', 'sine=duration=8',
+            '-c:v', 'libx264', '-profile:v', 'main', '-pix_fmt', 'yuv420p',
+            '-g', '50', '-c:a', 'aac', '-shortest', source,
+        ], check=True)
+        output = str(tmp_path / "clip.mp4")
+
+        ok = render_clip(
+            source, 1.0, 5.0, output, read_keyframes(source), 'smart',
+            info=probe_media(source),
+        )
+
+        assert ok
+        assert decodes_cleanly(output)
+        clip = probe_media(output)
+        assert abs(clip['duration'] - 4.0) < 0.2
+        assert clip['streams'][0]['profile'] == 'Main'
+
+
+class TestRenderPreview:
+    """Test single-pass preview rendering."""
+    
+    def test_preview_command_concat_filter(self):
+        """Test every range is an input joined by one concat filter."""
+        cmd = preview_command("in.mp4", [(1.0, 2.0), (5.0, 7.5)], "out.mp4")
+        
+        assert cmd.count('-i') == 2
+        assert cmd.count('in.mp4') == 2
+        graph = cmd[cmd.index('-filter_complex') + 1]
+        assert graph.startswith('[0:v:0][0:a:0][1:v:0][1:a:0]concat=n=2:v=1:a=1')
+        assert cmd[-1] == 'out.mp4'
+        assert '[a]' in cmd
+    
+    def test_preview_command_no_audio_scaled(self):
+        """Test silent sources skip audio and apply scaling."""
+        cmd = preview_command("in.mp4", [(0, 1)], "out.mp4", False, '320:180')
+        
+        graph = cmd[cmd.index('-filter_complex') + 1]
+        assert 'a:0' not in graph
+        assert 'a=0' in graph
+        assert 'scale=320:180' in graph
+        assert '[a]' not in cmd
+    
+    def test_render_preview_moves_into_place(self, tmp_path):
+        """Test preview is written to a temp file then moved to output."""
+        output = tmp_path / "previews" / "video preview.mp4"
+        with patch("src.media_server.video_utils.subprocess.run") as mock_run, \
+             patch("src.media_server.video_utils.has_audio_stream", return_value=True):
+            mock_run.return_value = SimpleNamespace(returncode=0)
+            ok = render_preview("in.mp4", [(0, 1)], str(output))
+        
+        assert ok
+        assert output.exists()
+        tmp_output = mock_run.call_args.args[0][-1]
+        assert tmp_output != str(output)
+        assert [p.name for p in output.parent.iterdir()] == ["video preview.mp4"]
+    
+    def test_render_preview_failure_cleans_up(self, tmp_path):
+        """Test failed render leaves no output or temp file."""
+        output = tmp_path / "video preview.mp4"
+        with patch("src.media_server.video_utils.subprocess.run") as mock_run, \
+             patch("src.media_server.video_utils.has_audio_stream", return_value=False):
+            mock_run.return_value = SimpleNamespace(returncode=1)
+            ok = render_preview("in.mp4", [(0, 1)], str(output))
+        
+        assert not ok
+        assert list(tmp_path.iterdir()) == []
+    
+    def test_render_preview_no_ranges(self, tmp_path):
+        """Test empty clip list renders nothing."""
+        assert not render_preview("in.mp4", [], str(tmp_path / "out.mp4"))
+
+
+FFPROBE_JSON = """{
+    "streams": [
+        {"codec_type": "video", "codec_name": "h264", "width": 1920,
+         "height": 1080, "bit_rate": "4000000", "duration": "10.000000"},
+        {"codec_type": "audio", "codec_name": "aac", "bit_rate": "128000"}
+    ],
+    "format": {"format_name": "mov,mp4,m4a", "duration": "10.010000",
+               "bit_rate": "4200000"}
+}"""
+
+
+class TestProbeMedia:
+    """Test ffprobe metadata cache."""
+    
+    def test_probe_media_parses_json(self):
+        """Test streams, duration, resolution and codec are read."""
+        with (
+            patch(
+                "src.media_server.video_utils.run_ffprobe", return_value=FFPROBE_JSON
+            ),
+            patch(
+                "src.media_server.video_utils.read_keyframes", return_value=KEYFRAMES
+            ),
+        ):
+            info = probe_media("video.mp4")
+        
+        assert info['width'] == 1920
+        assert info['height'] == 1080
+        assert info['codec'] == 'h264'
+        assert info['duration'] == 10.01
+        assert info['bit_rate'] == 4200000
+        assert info['keyframe_count'] == 5
+        assert [s['type'] for s in info['streams']] == ['video', 'audio']
+    
+    def test_probe_media_invalid_output(self):
+        """Test unreadable files give empty metadata."""
+        with patch("src.media_server.video_utils.run_ffprobe", return_value="error"):
+            info = probe_media("broken.mp4")
+        
+        assert info['width'] == 0
+        assert info['streams'] == []
+        assert info['keyframe_count'] == 0
+    
+    def test_probe_uses_argv(self):
+        """Test ffprobe is run without a shell."""
+        with patch("src.media_server.video_utils.subprocess.run") as mock_run:
+            mock_run.return_value = SimpleNamespace(stdout="")
+            probe_media("my video.mp4")
+        
+        cmd = mock_run.call_args.args[0]
+        assert isinstance(cmd, list)
+        assert cmd[-1] == "my video.mp4"
+        assert not mock_run.call_args.kwargs.get('shell')
+    
+    def test_get_video_resolution_cached(self, tmp_path):
+        """Test resolution is probed once per file version."""
+        video = tmp_path / "video.mp4"
+        video.write_bytes(b"data")
+        cache = FileCache(tmp_path / "media_info.pkl")
+        
+        with (
+            patch(
+                "src.media_server.video_utils.run_ffprobe", return_value=FFPROBE_JSON
+            ) as mock_probe,
+            patch("src.media_server.video_utils.read_keyframes", return_value=[]),
+        ):
+            assert get_video_resolution(str(video), cache) == (1920, 1080)
+            assert get_video_resolution(str(video), cache) == (1920, 1080)
+        
+        assert mock_probe.call_count == 1
+    
+    def test_probe_media_job_skips_cached(self, tmp_path):
+        """Test bulk prober only probes files missing from the cache."""
+        cached = tmp_path / "a.mp4"
+        cached.write_bytes(b"a")
+        missing = tmp_path / "b.mp4"
+        missing.write_bytes(b"b")
+        cache = FileCache(tmp_path / "media_info.pkl")
+        cache.set(str(cached), {'width': 1})
+        
+        job = probe_media_job([str(cached), str(missing)], cache)
+        assert job.items == [str(missing)]
+        
+        job.on_result(str(missing), {'width': 2})
+        job.on_finish()
+        assert FileCache(tmp_path / "media_info.pkl").get(str(missing)) == {'width': 2}
+
+
+class TestBulkPreviews:
+    """Test bulk preview generation."""
+    
+    def test_scaled_size(self):
+        """Test short side is scaled to the resolution."""
+        assert scaled_size(1920, 1080, 320) == '568:320'
+        assert scaled_size(1080, 1920, 320) == '320:568'
+        assert scaled_size(0, 0, 240) == '240:240'
+    
+    def test_sample_ranges_spread(self):
+        """Test segments are spread evenly over the duration."""
+        ranges = sample_ranges(100.0, 5, 2.0)
+        assert ranges == [
+            (9.0, 11.0), (29.0, 31.0), (49.0, 51.0), (69.0, 71.0), (89.0, 91.0)
+        ]
+    
+    def test_sample_ranges_short_video(self):
+        """Test short videos are used whole."""
+        assert sample_ranges(6.0, 5, 2.0) == [(0.0, 6.0)]
+        assert sample_ranges(0, 5, 2.0) == []
+    
+    def test_generate_preview_renders_samples(self, tmp_path):
+        """Test worker renders sampled ranges to the preview path."""
+        video = tmp_path / "video.mp4"
+        info = {'duration': 100.0, 'width': 1920, 'height': 1080}
+        with patch(
+            "src.media_server.video_utils.render_preview", return_value=True
+        ) as mock_render:
+            assert generate_preview((str(video), info, 2, 2.0, 320)) == info
+        
+        _, ranges, preview, scale = mock_render.call_args.args
+        assert ranges == [(24.0, 26.0), (74.0, 76.0)]
+        assert preview.endswith('previews/video preview.mp4')
+        assert scale == '568:320'
+    
+    def test_preview_job_skips_done_and_failed(self, tmp_path):
+        """Test job resumes by skipping existing previews and known failures."""
+        for name in ("done.mp4", "failed.mp4", "todo.mp4"):
+            (tmp_path / name).write_bytes(name.encode())
+        (tmp_path / "previews").mkdir()
+        (tmp_path / "previews" / "done preview.mp4").write_bytes(b"p")
+        media_info = FileCache(tmp_path / "media_info.pkl")
+        failures = FileCache(tmp_path / "failures.pkl")
+        failures.set(str(tmp_path / "failed.mp4"), "error")
+        
+        videos = [str(tmp_path / n) for n in ("done.mp4", "failed.mp4", "todo.mp4")]
+        job = preview_job(videos, media_info, failures, count=3)
+        
+        assert [task[0] for task in job.items] == [str(tmp_path / "todo.mp4")]
+        assert job.items[0][2] == 3
+    
+    def test_preview_job_records_failures(self, tmp_path):
+        """Test failed videos are recorded and skipped on the next run."""
+        video = tmp_path / "video.mp4"
+        video.write_bytes(b"v")
+        media_info = FileCache(tmp_path / "media_info.pkl")
+        failures = FileCache(tmp_path / "failures.pkl")
+        
+        job = preview_job([str(video)], media_info, failures)
+        job.on_error(job.items[0], RuntimeError("boom"))
+        job.on_finish()
+        
+        assert failures.get(str(video)) == "boom"
+        assert preview_job([str(video)], media_info, failures).items == []
+
+
+class TestClipManifest:
+    """Test clip output reuse."""
+    
+    def test_output_current(self, tmp_path):
+        """Test recorded output with same params is reused."""
+        output = tmp_path / "video_1_2.mp4"
+        output.write_bytes(b"clip")
+        manifest = {}
+        record_output(manifest, str(output), (1.0, 2.0, '', 'snap'))
+        
+        assert is_output_current(manifest, str(output), (1.0, 2.0, '', 'snap'))
+        params = (1.0, 2.0, '320:240', 'snap')
+        assert not is_output_current(manifest, str(output), params)
+    
+    def test_output_changed_or_missing(self, tmp_path):
+        """Test modified or deleted outputs are rendered again."""
+        output = tmp_path / "video_1_2.mp4"
+        output.write_bytes(b"clip")
+        manifest = {}
+        record_output(manifest, str(output), 'params')
+        
+        output.write_bytes(b"edited clip")
+        assert not is_output_current(manifest, str(output), 'params')
+        output.unlink()
+        assert not is_output_current(manifest, str(output), 'params')
+        assert not is_output_current({}, str(output), 'params')
+    
+    def test_clip_manifest_fresh(self, tmp_path):
+        """Test manifest of an unchanged source is returned."""
+        video = tmp_path / "video.mp4"
+        video.write_bytes(b"v1")
+        manifests = FileCache(tmp_path / "clip_outputs.pkl")
+        manifests.set(str(video), {"out.mp4": {}})
+        
+        assert clip_manifest(str(video), manifests) == {"out.mp4": {}}
+    
+    def test_clip_manifest_cleans_stale_outputs(self, tmp_path):
+        """Test outputs of a changed source are deleted unless requested again."""
+        video = tmp_path / "video.mp4"
+        video.write_bytes(b"v1")
+        stale = tmp_path / "video_1_2.mp4"
+        stale.write_bytes(b"clip")
+        requested = tmp_path / "video_3_4.mp4"
+        requested.write_bytes(b"clip")
+        manifests = FileCache(tmp_path / "clip_outputs.pkl")
+        manifests.set(str(video), {str(stale): {}, str(requested): {}})
+        
+        video.write_bytes(b"v2 changed")
+        assert clip_manifest(str(video), manifests, [str(requested)]) == {}
+        assert not stale.exists()
+        assert requested.exists()
+    
+    def test_remove_outputs(self, tmp_path):
+        """Test removed outputs leave the disk and the manifest."""
+        output = tmp_path / "video_1_2.mp4"
+        output.write_bytes(b"clip")
+        manifest = {str(output): {}, "kept.mp4": {}}
+        
+        remove_outputs(manifest, [str(output), str(tmp_path / "missing.mp4")])
+        assert not output.exists()
+        assert manifest == {"kept.mp4": {}}
+
+
+class TestPosters:
+    """Test video poster frames."""
+    
+    def test_poster_offset(self):
+        """Test poster is taken 10% in, at most 10 seconds."""
+        assert poster_offset({'duration': 30.0}) == 3.0
+        assert poster_offset({'duration': 600.0}) == 10.0
+        assert poster_offset(None) == 1.0
+    
+    def test_make_poster(self, tmp_path):
+        """Test poster is extracted at the offset and moved into place."""
+        dest = tmp_path / "posters" / "ab" / "poster.jpg"
+        
+        def fake_run(cmd):
+            with open(cmd[-1], 'wb') as f:
+                f.write(b"jpeg")
+            return SimpleNamespace(returncode=0)
+        
+        with patch(
+            "src.media_server.video_utils.subprocess.run", side_effect=fake_run
+        ) as mock_run:
+            make_poster("in.mp4", str(dest), 3.0)
+        
+        assert dest.read_bytes() == b"jpeg"
+        cmd = mock_run.call_args.args[0]
+        assert cmd[cmd.index('-ss') + 1] == '3.000'
+        assert cmd[cmd.index('-frames:v') + 1] == '1'
+        assert [p.name for p in dest.parent.iterdir()] == ["poster.jpg"]
+    
+    def test_make_poster_falls_back_to_first_frame(self, tmp_path):
+        """Test short videos use their first frame."""
+        dest = tmp_path / "poster.jpg"
+        seeks = []
+        
+        def fake_run(cmd):
+            seek = cmd[cmd.index('-ss') + 1]
+            seeks.append(seek)
+            if seek == '0.000':
+                with open(cmd[-1], 'wb') as f:
+                    f.write(b"jpeg")
+            return SimpleNamespace(returncode=0)
+        
+        with patch("src.media_server.video_utils.subprocess.run", side_effect=fake_run):
+            make_poster("in.mp4", str(dest), 5.0)
+        
+        assert seeks == ['5.000', '0.000']
+        assert dest.exists()
+    
+    def test_poster_job_only_missing(self, tmp_path):
+        """Test job only extracts posters not in the cache."""
+        done = tmp_path / "done.mp4"
+        todo = tmp_path / "todo.mp4"
+        done.write_bytes(b"a")
+        todo.write_bytes(b"b")
+        cache_dir = str(tmp_path / "posters")
+        existing = poster_path(cache_dir, str(done))
+        (tmp_path / "posters").mkdir()
+        import os
+        os.makedirs(os.path.dirname(existing))
+        open(existing, 'wb').close()
+        media_info = FileCache(tmp_path / "media_info.pkl")
+        media_info.set(str(todo), {'duration': 20.0})
+        
+        job = poster_job([str(done), str(todo)], cache_dir, media_info)
+        assert job.items == [(str(todo), poster_path(cache_dir, str(todo)), 2.0)]
+
+
+def _write_gif(path, frames=3):
+    from PIL import Image
+    images = [Image.new("RGB", (31, 21), (i * 80, 0, 0)) for i in range(frames)]
+    images[0].save(path, save_all=frames > 1, append_images=images[1:], duration=100)
+
+
+class TestGifTwins:
+    """Test video twins of animated GIFs."""
+    
+    def test_make_gif_twin(self, tmp_path):
+        """Test an animated GIF is transcoded to even-sized H.264."""
+        gif = tmp_path / "anim.gif"
+        _write_gif(gif)
+        dest = tmp_path / "twins" / "anim.mp4"
+        
+        def fake_run(cmd):
+            with open(cmd[-1], 'wb') as f:
+                f.write(b"mp4")
+            return SimpleNamespace(returncode=0)
+        
+        with patch(
+            "src.media_server.video_utils.subprocess.run", side_effect=fake_run
+        ) as mock_run:
+            assert make_gif_twin(str(gif), str(dest)) == str(dest)
+        
+        cmd = mock_run.call_args.args[0]
+        assert cmd[cmd.index('-c:v') + 1] == 'libx264'
+        assert '-an' in cmd
+        assert 'trunc(iw/2)*2' in cmd[cmd.index('-vf') + 1]
+        assert [p.name for p in dest.parent.iterdir()] == ["anim.mp4"]
+    
+    def test_still_gif_skipped(self, tmp_path):
+        """Test single-frame GIFs are not transcoded."""
+        gif = tmp_path / "still.gif"
+        _write_gif(gif, frames=1)
+        
+        with patch("src.media_server.video_utils.subprocess.run") as mock_run:
+            assert make_gif_twin(str(gif), str(tmp_path / "still.mp4")) is None
+        mock_run.assert_not_called()
+    
+    def test_failed_transcode_leaves_nothing(self, tmp_path):
+        """Test a failed ffmpeg run raises and cleans up."""
+        gif = tmp_path / "anim.gif"
+        _write_gif(gif)
+        dest = tmp_path / "anim.mp4"
+        
+        def fake_run(cmd):
+            with open(cmd[-1], 'wb') as f:
+                f.write(b"partial")
+            return SimpleNamespace(returncode=1)
+        
+        with patch("src.media_server.video_utils.subprocess.run", side_effect=fake_run):
+            with pytest.raises(RuntimeError):
+                make_gif_twin(str(gif), str(dest), 'webm')
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["anim.gif"]
+    
+    def test_gif_twin_job_only_unknown(self, tmp_path):
+        """Test GIFs with a twin, or known to be still, are skipped."""
+        done = tmp_path / "done.gif"
+        still = tmp_path / "still.gif"
+        todo = tmp_path / "todo.gif"
+        for gif in (done, still, todo):
+            _write_gif(gif)
+        cache_dir = str(tmp_path / "twins")
+        twins = FileCache(tmp_path / "gif_twins.pkl")
+        done_twin = tmp_path / "done.mp4"
+        done_twin.write_bytes(b"mp4")
+        twins.set(str(done), str(done_twin))
+        twins.set(str(still), '')
+        
+        job = gif_twin_job(
+            [str(done), str(still), str(todo), str(tmp_path / "a.png")],
+            cache_dir,
+            twins,
+        )
+        assert job.items == [(str(todo), gif_twin_path(cache_dir, str(todo)), 'mp4')]
+
+
+class TestProxies:
+    """Test low-resolution proxy transcodes."""
+    
+    def test_proxy_rungs_below_source(self):
+        """Test proxies are only made smaller than the video."""
+        ladder = ((360, 800), (720, 2500), (1080, 5000))
+        assert proxy_rungs({'width': 1280, 'height': 720}, ladder) == [(360, 800)]
+        assert proxy_rungs({'width': 2160, 'height': 3840}, ladder) == list(ladder)
+        assert proxy_rungs(None, ladder) == list(ladder)
+    
+    def test_make_proxy(self, tmp_path):
+        """Test proxy is H.264 at the rung's bitrate, moved into place."""
+        dest = tmp_path / "proxies" / "v.mp4"
+        
+        def fake_run(cmd):
+            with open(cmd[-1], 'wb') as f:
+                f.write(b"mp4")
+            return SimpleNamespace(returncode=0)
+        
+        with patch(
+            "src.media_server.video_utils.subprocess.run", side_effect=fake_run
+        ) as mock_run:
+            make_proxy("in.mp4", str(dest), 360, 800)
+        
+        cmd = mock_run.call_args.args[0]
+        assert cmd[cmd.index('-c:v') + 1] == 'libx264'
+        assert cmd[cmd.index('-b:v') + 1] == '800k'
+        assert '360' in cmd[cmd.index('-vf') + 1]
+        assert '+faststart' in cmd
+        assert [p.name for p in dest.parent.iterdir()] == ["v.mp4"]
+    
+    def test_proxy_job_only_missing(self, tmp_path):
+        """Test job renders missing rungs smaller than each video."""
+        video = tmp_path / "v.mp4"
+        video.write_bytes(b"v")
+        cache_dir = str(tmp_path / "proxies")
+        media_info = FileCache(tmp_path / "media_info.pkl")
+        media_info.set(str(video), {'width': 1920, 'height': 1080})
+        ladder = ((360, 800), (720, 2500), (1080, 5000))
+        done = proxy_path(cache_dir, str(video), 360)
+        import os
+        os.makedirs(os.path.dirname(done))
+        open(done, 'wb').close()
+        
+        job = proxy_job([str(video)], cache_dir, media_info, ladder)
+        dest = proxy_path(cache_dir, str(video), 720)
+        assert job.items == [(str(video), dest, 720, 2500)]
+    
+    def test_choose_proxy(self):
+        """Test proxy choice from request and client hints."""
+        proxies = [(720, 2500, 'p720'), (360, 800, 'p360')]
+        info = {'width': 3840, 'height': 2160, 'bit_rate': 40_000_000}
+        
+        assert choose_proxy(proxies, '720', info) == 'p720'
+        assert choose_proxy(proxies, '480', info) == 'p360'
+        assert choose_proxy(proxies, '240', info) == 'p360'
+        assert choose_proxy(proxies, '2160', info) is None
+        assert choose_proxy(proxies, 'best', info) is None
+        assert choose_proxy([], '720', info) is None
+        assert choose_proxy(proxies, 'auto', info) is None
+        assert choose_proxy(proxies, 'auto', info, save_data=True) == 'p360'
+        assert choose_proxy(proxies, 'auto', info, downlink_kbps=5000) == 'p720'
+        assert choose_proxy(proxies, 'auto', info, downlink_kbps=1500) == 'p360'
+        assert choose_proxy(proxies, 'auto', info, downlink_kbps=100_000) is None
+
+
+class TestHls:
+    """Test on-demand HLS segmenting."""
+    
+    def test_segments_start_on_keyframes(self):
+        """Test segments run between keyframes at least the target apart."""
+        keyframes = [0.0, 2.0, 4.0, 6.5, 8.0, 13.0, 19.9]
+        assert hls_segments(keyframes, 20.0, target=6.0) == [
+            (0.0, 6.5), (6.5, 6.5), (13.0, 7.0),
+        ]
+        assert hls_segments([], 10.0) == [(0.0, 10.0)]
+        assert hls_segments([0.0], 0) == []
+    
+    def test_playlist(self):
+        """Test VOD playlist lists every segment."""
+        playlist = hls_playlist([(0.0, 6.5), (6.5, 3.0)], '{}.ts')
+        lines = playlist.splitlines()
+        assert lines[0] == '#EXTM3U'
+        assert '#EXT-X-TARGETDURATION:7' in lines
+        assert lines[-5:] == [
+            '#EXTINF:6.500,', '0.ts', '#EXTINF:3.000,', '1.ts', '#EXT-X-ENDLIST'
+        ]
+    
+    def test_can_copy(self):
+        """Test only HLS-compatible codecs are stream copied."""
+        h264 = {'codec': 'h264', 'streams': [{'type': 'audio', 'codec': 'aac'}]}
+        opus = {'codec': 'h264', 'streams': [{'type': 'audio', 'codec': 'opus'}]}
+        assert hls_can_copy(h264)
+        assert not hls_can_copy(opus)
+        assert not hls_can_copy({'codec': 'vp9', 'streams': []})
+        assert not hls_can_copy(None)
+    
+    def test_make_segment(self, tmp_path):
+        """Test segment is cut by stream copy keeping timestamps."""
+        dest = tmp_path / "hls" / "v_3.ts"
+        
+        def fake_run(cmd):
+            with open(cmd[-1], 'wb') as f:
+                f.write(b"ts")
+            return SimpleNamespace(returncode=0)
+        
+        with patch(
+            "src.media_server.video_utils.subprocess.run", side_effect=fake_run
+        ) as mock_run:
+            make_hls_segment("in.mp4", str(dest), 6.5, 6.5)
+            copied = mock_run.call_args.args[0]
+            make_hls_segment("in.webm", str(dest), 6.5, 6.5, copy=False)
+            encoded = mock_run.call_args.args[0]
+        
+        assert copied[copied.index('-ss') + 1] == '6.500000'
+        assert copied[copied.index('-c') + 1] == 'copy'
+        assert '-copyts' in copied
+        assert copied[copied.index('-f') + 1] == 'mpegts'
+        assert encoded[encoded.index('-c:v') + 1] == 'libx264'
+        assert [p.name for p in dest.parent.iterdir()] == ["v_3.ts"]
+
+
+def _box(kind, body=b''):
+    import struct
+    return struct.pack('>I4s', 8 + len(body), kind) + body
+
+
+def _write_mp4(path, faststart):
+    moov = _box(b'moov', b'm' * 100)
+    mdat = _box(b'mdat', b'd' * 1000)
+    body = moov + mdat if faststart else mdat + moov
+    path.write_bytes(_box(b'ftyp', b'isom') + body)
+
+
+class TestFaststart:
+    """Test faststart MP4 scanning and remuxing."""
+    
+    def test_read_boxes(self, tmp_path):
+        """Test top-level boxes are listed, including 64-bit sizes."""
+        import struct
+        f = tmp_path / "v.mp4"
+        large = struct.pack('>I4sQ', 1, b'mdat', 16 + 4) + b'dddd'
+        f.write_bytes(_box(b'ftyp', b'isom') + large + _box(b'moov'))
+        
+        assert read_mp4_boxes(str(f)) == [
+            ('ftyp', 0, 12), ('mdat', 12, 20), ('moov', 32, 8),
+        ]
+    
+    def test_scan(self, tmp_path):
+        """Test moov position is detected."""
+        fast = tmp_path / "fast.mp4"
+        slow = tmp_path / "slow.mp4"
+        _write_mp4(fast, True)
+        _write_mp4(slow, False)
+        other = tmp_path / "other.mp4"
+        other.write_bytes(b"not an mp4 at all")
+        
+        assert scan_faststart(str(fast)) == {
+            'faststart': True, 'first_frame_bytes': 120
+        }
+        assert scan_faststart(str(slow)) == {
+            'faststart': False, 'first_frame_bytes': 1128
+        }
+        assert scan_faststart(str(other))['faststart'] is None
+    
+    def test_remux(self, tmp_path):
+        """Test remuxed file replaces the original and keeps its mtime."""
+        import os
+        video = tmp_path / "slow.mp4"
+        _write_mp4(video, False)
+        os.utime(video, (1000, 1000))
+        
+        def fake_run(cmd):
+            _write_mp4(tmp_path / os.path.basename(cmd[-1]), True)
+            return SimpleNamespace(returncode=0)
+        
+        with patch(
+            "src.media_server.video_utils.subprocess.run", side_effect=fake_run
+        ) as mock_run:
+            result = remux_faststart(str(video))
+        
+        cmd = mock_run.call_args.args[0]
+        assert cmd[cmd.index('-c') + 1] == 'copy'
+        assert '+faststart' in cmd
+        assert result['before']['faststart'] is False
+        assert result['after']['faststart'] is True
+        assert scan_faststart(str(video))['faststart'] is True
+        assert os.stat(video).st_mtime == 1000
+        assert [p.name for p in tmp_path.iterdir()] == ["slow.mp4"]
+    
+    def test_jobs(self, tmp_path):
+        """Test scan records results and remux job only takes slow files."""
+        fast = tmp_path / "fast.mp4"
+        slow = tmp_path / "slow.mp4"
+        _write_mp4(fast, True)
+        _write_mp4(slow, False)
+        cache = FileCache(tmp_path / "faststart.pkl")
+        
+        videos = [str(fast), str(slow), str(tmp_path / "a.webm")]
+        scan = faststart_scan_job(videos, cache)
+        assert scan.items == [str(fast), str(slow)]
+        scan.start()
+        scan.join(10)
+        assert cache.get(str(slow))['faststart'] is False
+        
+        job = faststart_job([str(fast), str(slow)], cache)
+        assert job.items == [str(slow)]
+        job.on_result(str(slow), {
+            'before': {'faststart': False, 'first_frame_bytes': 50_000_000},
+            'after': {'faststart': True, 'first_frame_bytes': 100},
+        })
+        assert job.stats['first_frame_seconds_saved'] == 8.0